@@ -0,0 +1,92 @@
+"""
+Load test of the checkout flow: every worker repeatedly creates an order
+and captures it through the sync endpoints, against a local fake PayPal
+server with optional latency and error injection.
+
+    python -m benchmarks.checkout_load --checkouts 300 --concurrency 16 --latency 0.05 --error-rate 0.02
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .fake_paypal import FakePaypalServer
+from .paypal_async import setup
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def report(label, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    print(f"{label:<14} {len(latencies) / elapsed:8.1f} req/s  "
+          f"p50 {percentile(latencies, 0.50) * 1000:7.1f} ms  "
+          f"p90 {percentile(latencies, 0.90) * 1000:7.1f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  "
+          f"errors {errors}")
+
+
+def run(token, checkouts, concurrency):
+    from django.db import connection
+    from django.test import Client
+
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def checkout(_):
+        client = Client()
+        timings = {}
+        try:
+            start = time.perf_counter()
+            response = client.post(
+                "/paypal/orders/", {"cart": [{"id": "PROD-BENCH", "value": "10"}]},
+                content_type="application/json", headers=headers)
+            timings["create_order"] = (time.perf_counter() - start, response.status_code == 200)
+            if response.status_code != 200:
+                return timings
+
+            start = time.perf_counter()
+            response = client.post(
+                "/paypal/orders/capture/", {"orderID": response.json()["id"]},
+                content_type="application/json", headers=headers)
+            timings["capture_order"] = (time.perf_counter() - start, response.status_code == 201)
+            return timings
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(checkout, range(checkouts)))
+    elapsed = time.perf_counter() - start
+
+    for endpoint in ("create_order", "capture_order"):
+        samples = [result[endpoint] for result in results if endpoint in result]
+        report(endpoint, [latency for latency, ok in samples if ok],
+               sum(1 for _, ok in samples if not ok), elapsed)
+    completed = sum(1 for result in results if result.get("capture_order", (0, False))[1])
+    print(f"{'checkouts':<14} {completed / elapsed:8.1f} /s     completed {completed} of {checkouts}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkouts", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Seconds the fake PayPal server waits per call.")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of PayPal calls answered with a 503.")
+    args = parser.parse_args()
+
+    with FakePaypalServer(latency=args.latency, error_rate=args.error_rate, seed=1) as server:
+        token = setup(server)
+        # Injected failures are expected, don't log every 400
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        run(token, args.checkouts, args.concurrency)
+        print(f"PayPal calls {server.requests}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import json
+import random
+import re
+import secrets
+import string
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _paypal_id(length=17):
+    return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(length))
+
+
+PAYPAL_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+
+
+class _PaypalHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(body) if body else {}
+        except ValueError:
+            return {}
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+
+        with server.stats_lock:
+            server.requests += 1
+
+        error = server.take_error(self.path)
+        if error:
+            return self.respond(error, {"name": "INTERNAL_SERVER_ERROR", "message": "Injected failure."})
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self.respond(401, {"error": "invalid_token"})
+
+        url = urlparse(self.path)
+        if url.path == "/v1/reporting/transactions":
+            return self.respond(*self.transactions(parse_qs(url.query)))
+
+        match = re.fullmatch(r"/v2/payments/captures/(\w+)", url.path)
+        if match:
+            with server.stats_lock:
+                capture = server.captures.get(match.group(1))
+            if capture:
+                return self.respond(200, capture)
+
+        self.respond(404, {"name": "RESOURCE_NOT_FOUND"})
+
+    def transactions(self, query):
+        def param(name, default=None):
+            return query.get(name, [default])[0]
+
+        start = datetime.strptime(param("start_date"), PAYPAL_TIME_FORMAT)
+        end = datetime.strptime(param("end_date"), PAYPAL_TIME_FORMAT)
+        page_size = min(int(param("page_size", 100)), 500)
+        page = int(param("page", 1))
+
+        with self.server.stats_lock:
+            captures = [capture for capture in self.server.captures.values()
+                        if start <= datetime.strptime(capture["create_time"], PAYPAL_TIME_FORMAT) < end]
+        total_pages = max((len(captures) + page_size - 1) // page_size, 1)
+
+        return 200, {
+            "transaction_details": [{"transaction_info": {
+                "transaction_id": capture["id"],
+                "transaction_event_code": "T0006",
+                "transaction_initiation_date": capture["create_time"],
+                "transaction_amount": capture["amount"],
+                "transaction_status": "S",
+                "custom_field": capture["custom_id"],
+            }} for capture in captures[(page - 1) * page_size:page * page_size]],
+            "page": page,
+            "total_items": len(captures),
+            "total_pages": total_pages,
+        }
+
+    def do_POST(self):
+        server = self.server
+        payload = self.read_json()
+        time.sleep(server.latency)
+
+        with server.stats_lock:
+            server.requests += 1
+
+        error = server.take_error(self.path)
+        if error:
+            return self.respond(error, {"name": "INTERNAL_SERVER_ERROR", "message": "Injected failure."})
+
+        if self.path == "/v1/oauth2/token":
+            return self.respond(200, {
+                "access_token": f"FAKE-{_paypal_id()}",
+                "token_type": "Bearer",
+                "expires_in": 32400,
+            })
+
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self.respond(401, {"error": "invalid_token"})
+
+        # PayPal answers a repeated PayPal-Request-Id with the first result
+        request_id = self.headers.get("PayPal-Request-Id")
+        if request_id:
+            with server.stats_lock:
+                replay = server.responses.get(request_id)
+            if replay:
+                return self.respond(*replay)
+
+        status, data = self.route(payload)
+        if request_id and status < 500:
+            with server.stats_lock:
+                server.responses[request_id] = (status, data)
+        self.respond(status, data)
+
+    def route(self, payload):
+        server = self.server
+
+        if self.path == "/v2/checkout/orders":
+            order_id = _paypal_id()
+            with server.stats_lock:
+                server.orders[order_id] = {"payload": payload, "captured": False}
+            return 200, {
+                "id": order_id,
+                "status": "PAYER_ACTION_REQUIRED",
+                "links": [{"href": f"https://www.sandbox.paypal.com/checkoutnow?token={order_id}",
+                           "rel": "payer-action", "method": "GET"}],
+            }
+
+        if self.path == "/v1/catalogs/products":
+            product = dict(payload, id=f"PROD-{_paypal_id()}")
+            with server.stats_lock:
+                server.products[product["id"]] = product
+            return 201, product
+
+        match = re.fullmatch(r"/v2/checkout/orders/(\w+)/capture", self.path)
+        if match:
+            return self.capture(match.group(1))
+
+        return 404, {"name": "RESOURCE_NOT_FOUND"}
+
+    def capture(self, order_id):
+        server = self.server
+        with server.stats_lock:
+            order = server.orders.get(order_id)
+            if order is None:
+                return 404, {"name": "RESOURCE_NOT_FOUND"}
+            if order["captured"]:
+                return 422, {"name": "UNPROCESSABLE_ENTITY",
+                             "details": [{"issue": "ORDER_ALREADY_CAPTURED"}]}
+            order["captured"] = True
+
+        unit = order["payload"].get("purchase_units", [{}])[0]
+        capture = {
+            "id": _paypal_id(),
+            "status": "COMPLETED",
+            "amount": unit.get("amount", {"currency_code": "USD", "value": "0"}),
+            "custom_id": unit.get("custom_id"),
+            "create_time": datetime.now(timezone.utc).strftime(PAYPAL_TIME_FORMAT),
+            "supplementary_data": {"related_ids": {"order_id": order_id}},
+        }
+        with server.stats_lock:
+            server.captures[capture["id"]] = capture
+
+        return 201, {
+            "id": order_id,
+            "status": "COMPLETED",
+            "purchase_units": [{
+                "reference_id": unit.get("reference_id", "default"),
+                "payments": {"captures": [capture]},
+            }],
+        }
+
+
+class FakePaypalServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the PayPal REST endpoints used by the app (OAuth
+    token, orders, capture, catalog products, captures and transaction
+    reports), so tests and benchmarks
+    don't depend on the sandbox. Every request waits `latency` seconds to
+    emulate the round-trip to PayPal.
+
+    Failures can be injected at random with `error_rate` (answered with
+    `error_status`) or deterministically with `fail_next()`.
+
+    Point the app at it with PAYPAL_API_BASE_URL=server.url.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, error_status=503, seed=None):
+        super().__init__((host, port), _PaypalHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.orders = {}
+        self.products = {}
+        self.captures = {}
+        self.responses = {}  # PayPal-Request-Id -> (status, data)
+        self.requests = 0
+        self.failures = []  # [path prefix or None, status, remaining]
+        self.stats_lock = threading.Lock()
+
+    def fail_next(self, status=503, count=1, path=None):
+        """
+        Answer the next `count` requests (to paths starting with `path`, if
+        given) with `status`.
+        """
+        with self.stats_lock:
+            self.failures.append([path, status, count])
+
+    def take_error(self, path):
+        with self.stats_lock:
+            for failure in self.failures:
+                prefix, status, remaining = failure
+                if prefix is None or path.startswith(prefix):
+                    failure[2] -= 1
+                    if failure[2] <= 0:
+                        self.failures.remove(failure)
+                    return status
+
+            if self.error_rate and self.random.random() < self.error_rate:
+                return self.error_status
+        return None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,87 @@
+"""
+Throughput of token usage metering: one debit_tokens() transaction per
+call against the buffered UsageMeter, which reserves in memory, journals
+each event to a local file and writes aggregated batches from its flush
+thread.
+
+    python -m benchmarks.metering --debits 20000 --threads 8 --users 50
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+
+def setup(users, tokens):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    django.setup()
+
+    from django.db import connection
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    from user.helpers.balance import credit_tokens
+    from user.models import CustomUser
+
+    accounts = []
+    for i in range(users):
+        user = CustomUser.objects.create_user(email=f"meter{i}@example.com", password="Bench1234")
+        credit_tokens(user, tokens)
+        accounts.append(user)
+    return accounts
+
+
+def run(label, debit, users, debits, threads):
+    from django.db import connection
+
+    def work(worker):
+        try:
+            for i in range(worker, debits, threads):
+                debit(users[i % len(users)], i)
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(work, range(threads)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {debits / elapsed:10.0f} debits/s  ({elapsed:.2f} s)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--debits", type=int, default=20000)
+    parser.add_argument("--direct-debits", type=int, default=2000,
+                        help="Debits for the unbuffered baseline, which is much slower.")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    users = setup(args.users, tokens=args.debits + args.direct_debits)
+
+    from user.helpers.balance import debit_tokens, get_balances
+    from user.helpers.metering import UsageMeter
+
+    run("debit_tokens per call", lambda user, i: debit_tokens(user, 1),
+        users, args.direct_debits, args.threads)
+
+    meter = UsageMeter(tempfile.mkdtemp(), flush_interval=0.5)
+    elapsed = run("UsageMeter.record", lambda user, i: meter.record(user, 1, reference=f"bench-{i}"),
+                  users, args.debits, args.threads)
+
+    # Until everything recorded is in the DB
+    start = time.perf_counter()
+    meter.flush()
+    elapsed += time.perf_counter() - start
+    print(f"{'recorded and written':<22} {args.debits / elapsed:10.0f} debits/s  ({elapsed:.2f} s)")
+
+    spent = args.users * (args.debits + args.direct_debits) - sum(get_balances([u.pk for u in users]).values())
+    print(f"{'tokens charged':<22} {spent:10d}  (expected {args.debits + args.direct_debits})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Throughput of the sync (WSGI, thread pool) vs async (ASGI, one event loop)
+create-order endpoints against a local fake PayPal server.
+
+    python -m benchmarks.paypal_async --requests 400 --threads 8 --concurrency 200 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+from .fake_paypal import FakePaypalServer
+
+
+def report(label, latencies, elapsed):
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{label:<22} {len(latencies) / elapsed:8.1f} req/s  "
+          f"p50 {statistics.median(latencies) * 1000:7.1f} ms  p99 {p99 * 1000:7.1f} ms")
+
+
+def setup(server):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ['PAYPAL_API_BASE_URL'] = server.url
+    django.setup()
+
+    from django.db import connection
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    from paypal.models import PaypalProductModel
+    from user.models import CustomUser
+    from user.helpers.auth import get_user_tokens
+
+    user = CustomUser.objects.create_superuser(
+        email="bench@example.com", password="Bench1234", verified=True)
+    PaypalProductModel.objects.create(
+        name="Bench", description="Bench", home_url="https://example.com",
+        user=user, paypal_id_product="PROD-BENCH")
+    return get_user_tokens(user)['access']
+
+
+def run_sync(token, requests, threads):
+    from django.test import Client
+
+    def create_order(_):
+        start = time.perf_counter()
+        response = Client().post(
+            "/paypal/orders/", {"cart": [{"id": "PROD-BENCH", "value": "10"}]},
+            content_type="application/json", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.content
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(create_order, range(requests)))
+    report(f"sync WSGI x{threads} threads", latencies, time.perf_counter() - start)
+
+
+async def run_async(token, requests, concurrency):
+    from django.test import AsyncClient
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def create_order():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await AsyncClient().post(
+                "/paypal/orders/async/", {"cart": [{"id": "PROD-BENCH", "value": "10"}]},
+                content_type="application/json", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 200, response.content
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(create_order() for _ in range(requests)))
+    report(f"async ASGI x{concurrency} tasks", latencies, time.perf_counter() - start)
+
+    from paypal.helpers.async_client import get_async_paypal_client
+    await get_async_paypal_client().close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=8,
+                        help="WSGI worker threads.")
+    parser.add_argument("--concurrency", type=int, default=200,
+                        help="In-flight requests on the ASGI event loop.")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="Seconds the fake PayPal server waits per call.")
+    args = parser.parse_args()
+
+    with FakePaypalServer(latency=args.latency) as server:
+        token = setup(server)
+        run_sync(token, args.requests, args.threads)
+        asyncio.run(run_async(token, args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Per-message cost of sending through a fresh SMTP session vs the pooled one.
+
+    python -m benchmarks.smtp_pool --messages 200 --connect-delay 0.05 --login-delay 0.02
+"""
+import argparse
+import smtplib
+import time
+from email.mime.text import MIMEText
+
+from helpers.smtp import SMTPConnectionPool
+from .smtp_server import LocalSMTPServer
+
+SENDER = "bench@example.com"
+RECIPIENT = "user@example.com"
+
+
+def build_message():
+    message = MIMEText("<p>Your code is 123456</p>", "html")
+    message['From'] = SENDER
+    message['To'] = RECIPIENT
+    message['Subject'] = "Confirmation code"
+    return message.as_string()
+
+
+def send_unpooled(port, messages):
+    # What helpers/email.py used to do for every message
+    msg = build_message()
+    for _ in range(messages):
+        with smtplib.SMTP("127.0.0.1", port) as server:
+            server.login(SENDER, "secret")
+            server.sendmail(SENDER, RECIPIENT, msg)
+
+
+def send_pooled(port, messages):
+    pool = SMTPConnectionPool("127.0.0.1", port, username=SENDER,
+                              password="secret", use_ssl=False)
+    msg = build_message()
+    for _ in range(messages):
+        pool.send(SENDER, RECIPIENT, msg)
+    pool.close_all()
+
+
+def run(label, func, server, messages):
+    connections = server.connections
+    start = time.perf_counter()
+    func(server.port, messages)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {messages} msgs  {elapsed:.3f}s  "
+          f"{elapsed / messages * 1000:.2f} ms/msg  "
+          f"{server.connections - connections} connections")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--connect-delay", type=float, default=0.05)
+    parser.add_argument("--login-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    with LocalSMTPServer(connect_delay=args.connect_delay, login_delay=args.login_delay) as server:
+        run("unpooled", send_unpooled, server, args.messages)
+        run("pooled", send_pooled, server, args.messages)
+
+
+if __name__ == "__main__":
+    main()
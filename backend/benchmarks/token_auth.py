@@ -0,0 +1,62 @@
+"""
+Authentication overhead per request with and without the validated token
+cache: `--clients` access tokens, each sent `--requests` times.
+
+    python -m benchmarks.token_auth --clients 100 --requests 12
+"""
+import argparse
+import os
+import time
+
+import django
+
+
+def make_tokens(clients):
+    from rest_framework_simplejwt.tokens import AccessToken
+    from user.helpers.claims import add_user_claims
+    from user.models import CustomUser
+
+    tokens = []
+    for i in range(clients):
+        user = CustomUser(id=i + 1, email=f"bench{i}@example.com", verified=True)
+        tokens.append(str(add_user_claims(AccessToken.for_user(user), user)))
+    return tokens
+
+
+def run(label, token_cache, tokens, requests):
+    from django.test import RequestFactory
+    from user.authentication import ClaimsJWTAuthentication
+
+    factory = RequestFactory()
+    calls = [factory.get('/', HTTP_AUTHORIZATION=f'Bearer {token}') for token in tokens] * requests
+
+    start = time.perf_counter()
+    for request in calls:
+        # DRF creates the authenticators for each request
+        user, _ = ClaimsJWTAuthentication(token_cache=token_cache).authenticate(request)
+    elapsed = time.perf_counter() - start
+
+    print(f"{label:<16} {elapsed / len(calls) * 1e6:8.1f} us/request  "
+          f"hits {token_cache.hits}  misses {token_cache.misses}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=12,
+                        help="Requests sent with each token.")
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    django.setup()
+
+    from user.helpers.token_cache import ValidatedTokenCache
+
+    tokens = make_tokens(args.clients)
+    run("without cache", ValidatedTokenCache(maxsize=0), tokens, args.requests)
+    run("with cache", ValidatedTokenCache(maxsize=args.clients), tokens, args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Refresh token blacklist cost with a large blacklist: simplejwt's
+per-token queries against RefreshTokenBlacklist (bloom filter, bulk
+writes).
+
+    python -m benchmarks.token_blacklist --blacklisted 200000 --checks 5000
+"""
+import argparse
+import os
+import time
+import uuid
+from datetime import timedelta
+
+import django
+
+
+def setup(blacklisted):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    django.setup()
+
+    from django.db import connection
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    from django.utils import timezone
+    from user.helpers.blacklist import write_blacklist
+
+    expires_at = timezone.now() + timedelta(days=90)
+    for start in range(0, blacklisted, 10000):
+        write_blacklist({uuid.uuid4().hex: ("token", None, expires_at)
+                         for _ in range(min(10000, blacklisted - start))})
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed / count * 1e6:8.1f} us/token")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blacklisted", type=int, default=200000)
+    parser.add_argument("--checks", type=int, default=5000)
+    args = parser.parse_args()
+
+    setup(args.blacklisted)
+
+    from django.utils import timezone
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+    from user.helpers.blacklist import RefreshTokenBlacklist
+
+    blacklist = RefreshTokenBlacklist(sync_interval=None, capacity=args.blacklisted * 2)
+    start = time.perf_counter()
+    blacklist.sync()
+    print(f"{'bloom filter loaded':<28} {time.perf_counter() - start:8.2f} s")
+
+    jtis = [uuid.uuid4().hex for _ in range(args.checks)]
+    expires_at = timezone.now() + timedelta(days=90)
+
+    timed("simplejwt check", args.checks,
+          lambda i: BlacklistedToken.objects.filter(token__jti=jtis[i]).exists())
+    timed("bloom filter check", args.checks, lambda i: blacklist.contains(jtis[i]))
+
+    def simplejwt_blacklist(i):
+        token, _ = OutstandingToken.objects.get_or_create(
+            jti=f"simplejwt-{jtis[i]}", defaults={"token": "token", "expires_at": expires_at})
+        BlacklistedToken.objects.get_or_create(token=token)
+
+    timed("simplejwt blacklist", args.checks, simplejwt_blacklist)
+
+    timed("RefreshTokenBlacklist add", args.checks,
+          lambda i: blacklist.add(jtis[i], "token", None, expires_at))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import threading
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from django.conf import settings
+from django.template import Template, Context
+
+
+# email_format: (file inside resources/, subject)
+EMAIL_TEMPLATES = {
+    "register": ("register.html", "Welcome to TestInc!"),
+    "buy_custom": ("buy-custom.html", "Thank you for purchase Custom Pack!"),
+    "OTP": ("otp.html", "Confirmation code"),
+}
+
+
+class CompiledEmailTemplate:
+    """
+    An email template parsed once, so each send only renders the context
+    into a multipart/alternative message.
+    """
+
+    def __init__(self, source, subject):
+        self.template = Template(source)
+        self.subject = subject
+
+    def render(self, sender, to_email, context=None):
+        html = self.template.render(Context(context or {}))
+
+        message = MIMEMultipart("alternative")
+        message['Subject'] = self.subject
+        message['From'] = sender
+        message['To'] = to_email
+        message.attach(MIMEText(html, "html"))
+        return message.as_string()
+
+
+class FileEmailTemplate(CompiledEmailTemplate):
+    """
+    A CompiledEmailTemplate loaded from a file under resources/.
+    """
+
+    def __init__(self, path, subject):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+
+        with open(path, 'r') as file:
+            super().__init__(file.read(), subject)
+
+    def is_stale(self):
+        try:
+            return os.stat(self.path).st_mtime != self.mtime
+        except OSError:
+            return True
+
+
+class EmailTemplateRegistry:
+    """
+    Loads and compiles each email template once per process, keyed by
+    `email_format`. With `auto_reload` (DEBUG) a template is recompiled when
+    its file mtime changes; otherwise templates are frozen after first use.
+    """
+
+    def __init__(self, directory, templates=EMAIL_TEMPLATES, auto_reload=False):
+        self.directory = directory
+        self.templates = templates
+        self.auto_reload = auto_reload
+
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def get(self, email_format):
+        compiled = self._compiled.get(email_format)
+
+        if compiled is None or (self.auto_reload and compiled.is_stale()):
+            if email_format not in self.templates:
+                raise ValueError(f"Unknown email format '{email_format}'.")
+
+            file_name, subject = self.templates[email_format]
+            with self._lock:
+                compiled = FileEmailTemplate(
+                    os.path.join(self.directory, file_name), subject)
+                self._compiled[email_format] = compiled
+
+        return compiled
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_email_templates():
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = EmailTemplateRegistry(
+                    settings.BASE_DIR / 'resources', auto_reload=settings.DEBUG)
+    return _registry
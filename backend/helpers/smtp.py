@@ -0,0 +1,163 @@
+import atexit
+import smtplib
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+
+class SMTPConnectionPool:
+    """
+    Keeps authenticated SMTP sessions alive so each message doesn't pay for
+    a new TCP connection, TLS handshake and login.
+
+    Idle connections older than `max_idle` seconds are closed, and connections
+    idle for more than `health_check_after` seconds are checked with NOOP
+    before being handed out again.
+    """
+
+    def __init__(self, host, port, username=None, password=None, use_ssl=True,
+                 max_size=4, max_idle=60, health_check_after=5, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+
+        self._idle = deque()  # (connection, last_used)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _connect(self):
+        if self.use_ssl:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            conn.ehlo()
+            if conn.has_extn('starttls'):
+                conn.starttls()
+                conn.ehlo()
+
+        if self.username:
+            conn.login(self.username, self.password)
+
+        return conn
+
+    def _is_usable(self, conn, last_used):
+        idle_for = time.monotonic() - last_used
+        if idle_for > self.max_idle:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            return conn.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.close()
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise smtplib.SMTPException("No SMTP connection available.")
+
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, last_used = self._idle.pop()
+
+                if self._is_usable(conn, last_used):
+                    return conn
+                self._close(conn)
+
+            return self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, reusable=True):
+        try:
+            if reusable:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                self._close(conn)
+        finally:
+            self._slots.release()
+
+    def connection(self):
+        return _PooledConnection(self)
+
+    def send(self, from_addr, to_addrs, msg):
+        """
+        Send a single message, reconnecting once if the pooled session was
+        dropped by the server while idle.
+        """
+        try:
+            with self.connection() as conn:
+                return conn.sendmail(from_addr, to_addrs, msg)
+        except smtplib.SMTPServerDisconnected:
+            with self.connection() as conn:
+                return conn.sendmail(from_addr, to_addrs, msg)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for conn, _ in idle:
+            self._close(conn)
+
+
+class _PooledConnection:
+    """
+    Context manager returned by SMTPConnectionPool.connection(). Connections
+    that raised a connection level error are discarded instead of returned.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.pool.acquire()
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        broken = exc_type is not None and issubclass(
+            exc_type, (smtplib.SMTPServerDisconnected, OSError))
+        self.pool.release(self.conn, reusable=not broken)
+        return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_smtp_pool():
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SMTPConnectionPool(
+                    settings.EMAIL_HOST,
+                    settings.EMAIL_PORT,
+                    username=settings.EMAIL_HOST_USER,
+                    password=settings.EMAIL_HOST_PASSWORD,
+                    use_ssl=settings.EMAIL_USE_SSL,
+                    max_size=settings.EMAIL_POOL_SIZE,
+                    max_idle=settings.EMAIL_POOL_MAX_IDLE,
+                    timeout=settings.EMAIL_TIMEOUT,
+                )
+                atexit.register(_pool.close_all)
+    return _pool
@@ -0,0 +1,122 @@
+import email
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.template import Context
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from benchmarks.smtp_server import LocalSMTPServer
+from mailing.models import EmailOutbox
+from .email_templates import EmailTemplateRegistry
+from .smtp import SMTPConnectionPool
+from .work_queue import WorkQueue
+
+
+class TestSMTPConnectionPool(SimpleTestCase):
+
+    def setUp(self):
+        self.server = LocalSMTPServer().__enter__()
+        self.pool = SMTPConnectionPool(
+            "127.0.0.1", self.server.port, username="me@example.com",
+            password="secret", use_ssl=False)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.__exit__()
+
+    def test_connection_is_reused(self):
+        for _ in range(5):
+            self.pool.send("me@example.com", "you@example.com", "Subject: hi\r\n\r\nhi")
+
+        self.assertEqual(self.server.messages, 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_idle_connection_is_replaced(self):
+        self.pool.max_idle = 0
+        self.pool.send("me@example.com", "you@example.com", "Subject: hi\r\n\r\nhi")
+        self.pool.send("me@example.com", "you@example.com", "Subject: hi\r\n\r\nhi")
+
+        self.assertEqual(self.server.messages, 2)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_dropped_connection_reconnects(self):
+        self.pool.send("me@example.com", "you@example.com", "Subject: hi\r\n\r\nhi")
+        conn, _ = self.pool._idle[0]
+        conn.close()
+
+        self.pool.send("me@example.com", "you@example.com", "Subject: hi\r\n\r\nhi")
+
+        self.assertEqual(self.server.messages, 2)
+        self.assertEqual(self.server.connections, 2)
+
+
+class TestEmailTemplateRegistry(SimpleTestCase):
+
+    def test_template_is_compiled_once(self):
+        registry = EmailTemplateRegistry(settings.BASE_DIR / 'resources')
+
+        self.assertIs(registry.get("OTP"), registry.get("OTP"))
+
+    def test_render_builds_valid_mime_message(self):
+        registry = EmailTemplateRegistry(settings.BASE_DIR / 'resources')
+        raw = registry.get("OTP").render(
+            "me@example.com", "you@example.com", {"email": "you@example.com", "otp": "123456"})
+
+        message = email.message_from_string(raw)
+        self.assertEqual(message['Subject'], "Confirmation code")
+        self.assertEqual(message['To'], "you@example.com")
+        self.assertTrue(message.is_multipart())
+        html = message.get_payload()[0].get_payload(decode=True).decode()
+        self.assertIn("123456", html)
+
+    def test_auto_reload_on_mtime_change(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "otp.html")
+            with open(path, "w") as file:
+                file.write("old {{otp}}")
+
+            registry = EmailTemplateRegistry(
+                directory, templates={"OTP": ("otp.html", "Code")}, auto_reload=True)
+            compiled = registry.get("OTP")
+
+            with open(path, "w") as file:
+                file.write("new {{otp}}")
+            os.utime(path, (compiled.mtime + 10, compiled.mtime + 10))
+
+            self.assertIsNot(registry.get("OTP"), compiled)
+            self.assertEqual(registry.get("OTP").template.render(Context({"otp": 1})), "new 1")
+
+
+class TestWorkQueue(TestCase):
+
+    def setUp(self):
+        self.queue = WorkQueue(EmailOutbox, EmailOutbox.SENDING)
+        self.row = EmailOutbox.objects.create(email_format="OTP", to_email="you@example.com")
+
+    def test_claimed_row_is_reclaimed_after_lease(self):
+        self.assertEqual(self.queue.claim(10, lease=60), [self.row])
+        self.assertEqual(self.queue.claim(10, lease=60), [])
+
+        EmailOutbox.objects.update(claimed_at=timezone.now() - timedelta(seconds=61))
+
+        self.assertEqual(self.queue.claim(10, lease=60), [self.row])
+
+    def test_retry_backs_off_then_fails(self):
+        row, = self.queue.claim(10, lease=60)
+        row.attempts = 3
+        before = timezone.now()
+
+        self.queue.retry(row, Exception("down"), max_attempts=5, backoff=30, max_backoff=100)
+
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts, row.last_error), (EmailOutbox.PENDING, 4, "down"))
+        self.assertIsNone(row.claimed_at)
+        self.assertAlmostEqual((row.next_attempt_at - before).total_seconds(), 100, delta=5)
+
+        self.queue.retry(row, Exception("down"), max_attempts=5, backoff=30)
+
+        row.refresh_from_db()
+        self.assertEqual(row.status, EmailOutbox.FAILED)
@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+
+class WorkQueue:
+    """
+    Rows of `model` processed by background workers: due rows are claimed
+    in batches with SELECT ... FOR UPDATE SKIP LOCKED, so workers never get
+    the same row, and failures are retried with exponential backoff.
+
+    The model has PENDING and FAILED statuses plus `in_progress`, the status
+    of claimed rows. Rows a worker left in it (because it died) are claimed
+    again once their lease has expired. The field names default to the ones
+    of EmailOutbox and PaypalWebhookEvent.
+    """
+
+    def __init__(self, model, in_progress, status='status', attempts='attempts',
+                 next_attempt_at='next_attempt_at', claimed_at='claimed_at', error='last_error'):
+        self.model = model
+        self.in_progress = in_progress
+        self.status = status
+        self.attempts = attempts
+        self.next_attempt_at = next_attempt_at
+        self.claimed_at = claimed_at
+        self.error = error
+
+    def claim(self, batch_size, lease, queryset=None):
+        """
+        Claim up to `batch_size` due rows of `queryset` (all rows by
+        default), reclaiming the ones held for more than `lease` seconds.
+        """
+        now = timezone.now()
+        lease_expired = now - timedelta(seconds=lease)
+        queryset = self.model.objects.all() if queryset is None else queryset
+
+        with transaction.atomic():
+            ids = list(
+                queryset.select_for_update(skip_locked=True)
+                .filter(Q(**{self.status: self.model.PENDING, f'{self.next_attempt_at}__lte': now}) |
+                        Q(**{self.status: self.in_progress, f'{self.claimed_at}__lt': lease_expired}))
+                .order_by(self.next_attempt_at)
+                .values_list('id', flat=True)[:batch_size]
+            )
+            self.model.objects.filter(id__in=ids).update(
+                **{self.status: self.in_progress, self.claimed_at: now})
+
+        return list(self.model.objects.filter(id__in=ids).order_by(self.next_attempt_at))
+
+    def retry(self, obj, error, max_attempts, backoff, max_backoff=None):
+        """
+        Release `obj` after a failed attempt: due again in `backoff` seconds,
+        doubled on every attempt up to `max_backoff`, or FAILED after
+        `max_attempts`.
+        """
+        attempts = getattr(obj, self.attempts) + 1
+        values = {
+            self.attempts: attempts,
+            self.error: str(error)[:1000],
+            self.claimed_at: None,
+        }
+
+        if attempts >= max_attempts:
+            values[self.status] = self.model.FAILED
+        else:
+            delay = backoff * 2 ** (attempts - 1)
+            if max_backoff is not None:
+                delay = min(delay, max_backoff)
+            values[self.status] = self.model.PENDING
+            values[self.next_attempt_at] = timezone.now() + timedelta(seconds=delay)
+
+        for field, value in values.items():
+            setattr(obj, field, value)
+        self.model.objects.filter(pk=obj.pk).update(**values)
@@ -0,0 +1,11 @@
+from django.contrib import admin
+from .models import EmailOutbox, BulkEmailCampaign
+
+
+class BulkEmailCampaignAdmin(admin.ModelAdmin):
+    readonly_fields = ('last_user_id', 'sent_count', 'failed_count', 'started_at', 'finished_at')
+
+
+# Register your models here.
+admin.site.register(EmailOutbox)
+admin.site.register(BulkEmailCampaign, BulkEmailCampaignAdmin)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mailing.models import BulkEmailCampaign
+from mailing.services import send_campaign
+
+
+class Command(BaseCommand):
+    help = "Send a bulk email campaign to all active users. Re-running resumes an interrupted campaign."
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_id', type=int)
+        parser.add_argument('--rate', type=int,
+                            help="Messages per second, overrides the campaign setting.")
+        parser.add_argument('--chunk-size', type=int,
+                            help="Recipients per chunk, overrides the campaign setting.")
+
+    def handle(self, *args, **options):
+        try:
+            campaign = BulkEmailCampaign.objects.get(pk=options['campaign_id'])
+        except BulkEmailCampaign.DoesNotExist:
+            raise CommandError("Campaign not found.")
+
+        if campaign.status == BulkEmailCampaign.COMPLETED:
+            raise CommandError("Campaign already completed.")
+
+        if options['rate'] is not None:
+            campaign.rate_per_second = options['rate']
+        if options['chunk_size']:
+            campaign.chunk_size = options['chunk_size']
+        campaign.status = BulkEmailCampaign.RUNNING
+        campaign.save(update_fields=['rate_per_second', 'chunk_size', 'status'])
+
+        campaign = send_campaign(campaign)
+
+        self.stdout.write(
+            f"Campaign {campaign.pk} {campaign.status}: {campaign.sent_count} sent, "
+            f"{campaign.failed_count} failed.")
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from mailing.services import deliver_outbox_batch
+
+
+class Command(BaseCommand):
+    help = "Deliver pending emails from the outbox in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument('--once', action='store_true',
+                            help="Drain the outbox once and exit.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        while True:
+            claimed = deliver_outbox_batch(batch_size)
+
+            if claimed:
+                self.stdout.write(f"Processed {claimed} emails.")
+                continue
+
+            if options['once']:
+                return
+            time.sleep(options['interval'])
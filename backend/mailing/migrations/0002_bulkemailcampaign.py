@@ -0,0 +1,31 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkEmailCampaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('subject', models.CharField(max_length=200)),
+                ('body', models.TextField(help_text='HTML template. Available context: email, first_name, last_name.')),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('running', 'Running'), ('paused', 'Paused'), ('completed', 'Completed')], default='draft', max_length=10)),
+                ('rate_per_second', models.PositiveIntegerField(default=50, help_text='0 means unlimited.')),
+                ('chunk_size', models.PositiveIntegerField(default=500)),
+                ('last_user_id', models.BigIntegerField(default=0, help_text='Resume point, users with a greater id are still pending.')),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import models
+from django.utils import timezone
+
+# Create your models here.
+
+class EmailOutbox(models.Model):
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    email_format = models.CharField(max_length=50)
+    to_email = models.EmailField()
+    context = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.email_format} to {self.to_email} | {self.status}"
+
+
+class BulkEmailCampaign(models.Model):
+    DRAFT = 'draft'
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (DRAFT, 'Draft'),
+        (RUNNING, 'Running'),
+        (PAUSED, 'Paused'),
+        (COMPLETED, 'Completed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    subject = models.CharField(max_length=200)
+    body = models.TextField(help_text="HTML template. Available context: email, first_name, last_name.")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=DRAFT)
+    rate_per_second = models.PositiveIntegerField(default=50, help_text="0 means unlimited.")
+    chunk_size = models.PositiveIntegerField(default=500)
+    last_user_id = models.BigIntegerField(default=0, help_text="Resume point, users with a greater id are still pending.")
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.name} | {self.status}"
@@ -0,0 +1,165 @@
+import os
+import smtplib
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+
+from helpers.email_templates import CompiledEmailTemplate, get_email_templates
+from helpers.smtp import get_smtp_pool
+from helpers.work_queue import WorkQueue
+from .models import EmailOutbox, BulkEmailCampaign
+
+
+def enqueue_email(email_format, to_email, context=None):
+    """
+    Write an outbox row instead of talking to SMTP inside the request.
+    Returns whether the email was enqueued.
+    """
+    try:
+        EmailOutbox.objects.create(
+            email_format=email_format, to_email=to_email, context=context or {})
+        return True
+    except DatabaseError:
+        return False
+
+
+outbox = WorkQueue(EmailOutbox, EmailOutbox.SENDING)
+
+
+def claim_outbox_batch(batch_size):
+    """
+    Claim up to `batch_size` emails that are due. Rows left in SENDING by a
+    worker that died are reclaimed once their lease has expired.
+    """
+    return outbox.claim(batch_size, settings.EMAIL_OUTBOX_LEASE)
+
+
+def schedule_retry(outbox_email, error):
+    # Exponential backoff: 30s, 1m, 2m, 4m... capped
+    outbox.retry(outbox_email, error, settings.EMAIL_OUTBOX_MAX_ATTEMPTS,
+                 settings.EMAIL_OUTBOX_BACKOFF, settings.EMAIL_OUTBOX_MAX_BACKOFF)
+
+
+def deliver_outbox_batch(batch_size=50, pool=None):
+    """
+    Send one batch of due outbox emails over a single pooled SMTP session.
+    Returns the number of emails claimed.
+    """
+    emails = claim_outbox_batch(batch_size)
+    if not emails:
+        return 0
+
+    pool = pool or get_smtp_pool()
+    templates = get_email_templates()
+    sender_email_address = os.environ.get('EMAIL_ADDRESS')
+
+    sent, failed = [], []
+    try:
+        with pool.connection() as conn:
+            for outbox_email in emails:
+                try:
+                    message = templates.get(outbox_email.email_format).render(
+                        sender_email_address, outbox_email.to_email, outbox_email.context)
+                    conn.sendmail(sender_email_address, outbox_email.to_email, message)
+                    sent.append(outbox_email)
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    raise
+                except Exception as e:
+                    failed.append((outbox_email, e))
+    except Exception as e:
+        # The session itself broke; whatever wasn't handled is retried later
+        handled = {outbox_email.id for outbox_email in sent}
+        handled.update(outbox_email.id for outbox_email, _ in failed)
+        failed.extend((outbox_email, e) for outbox_email in emails
+                      if outbox_email.id not in handled)
+
+    EmailOutbox.objects.filter(id__in=[outbox_email.id for outbox_email in sent]).update(
+        status=EmailOutbox.SENT, sent_at=timezone.now(), claimed_at=None)
+
+    for outbox_email, error in failed:
+        schedule_retry(outbox_email, error)
+
+    return len(emails)
+
+
+class _RateLimiter:
+    """
+    Spaces calls evenly so no more than `rate` happen per second.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_at = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+        self.next_at = max(now, self.next_at) + self.interval
+
+
+def send_campaign(campaign, pool=None):
+    """
+    Send `campaign` to every active user, resuming after `last_user_id`.
+
+    Recipients are streamed by id in chunks of `chunk_size`. Each chunk is
+    pipelined over one pooled SMTP session and progress is saved after it,
+    so a stopped or crashed run continues where it left off. Setting the
+    campaign to PAUSED stops the run at the next chunk boundary.
+    """
+    pool = pool or get_smtp_pool()
+    compiled = CompiledEmailTemplate(campaign.body, campaign.subject)
+    limiter = _RateLimiter(campaign.rate_per_second)
+    sender_email_address = os.environ.get('EMAIL_ADDRESS')
+
+    BulkEmailCampaign.objects.filter(pk=campaign.pk).update(
+        status=BulkEmailCampaign.RUNNING, started_at=campaign.started_at or timezone.now())
+
+    recipients = (
+        get_user_model().objects
+        .filter(is_active=True, id__gt=campaign.last_user_id)
+        .order_by('id')
+        .values_list('id', 'email', 'first_name', 'last_name')
+        .iterator(chunk_size=campaign.chunk_size)
+    )
+
+    while True:
+        chunk = list(islice(recipients, campaign.chunk_size))
+        if not chunk:
+            break
+
+        sent = failed = 0
+        last_user_id = campaign.last_user_id
+        try:
+            with pool.connection() as conn:
+                for user_id, email, first_name, last_name in chunk:
+                    limiter.wait()
+                    message = compiled.render(sender_email_address, email, {
+                        "email": email, "first_name": first_name, "last_name": last_name})
+                    try:
+                        conn.sendmail(sender_email_address, email, message)
+                        sent += 1
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError):
+                        failed += 1
+                    last_user_id = user_id
+        finally:
+            BulkEmailCampaign.objects.filter(pk=campaign.pk).update(
+                last_user_id=last_user_id,
+                sent_count=F('sent_count') + sent,
+                failed_count=F('failed_count') + failed)
+            campaign.refresh_from_db()
+
+        if campaign.status == BulkEmailCampaign.PAUSED:
+            return campaign
+
+    BulkEmailCampaign.objects.filter(pk=campaign.pk).update(
+        status=BulkEmailCampaign.COMPLETED, finished_at=timezone.now())
+    campaign.refresh_from_db()
+    return campaign
@@ -0,0 +1,114 @@
+import os
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from faker import Faker
+
+from benchmarks.smtp_server import LocalSMTPServer
+from helpers.smtp import SMTPConnectionPool
+from user.models import CustomUser
+from ..models import EmailOutbox, BulkEmailCampaign
+from ..services import enqueue_email, deliver_outbox_batch, send_campaign
+
+fake = Faker()
+
+
+class TestEnqueueOnSignup(APITestCase):
+
+    def test_continue_with_email_only_enqueues(self):
+        email = fake.email()
+        response = self.client.post(
+            reverse("continue_with_email"), {'email': email}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        outbox_email = EmailOutbox.objects.get(to_email=email)
+        self.assertEqual(outbox_email.email_format, "OTP")
+        self.assertEqual(outbox_email.status, EmailOutbox.PENDING)
+
+
+@mock.patch.dict(os.environ, {'EMAIL_ADDRESS': 'me@example.com'})
+class TestDeliverOutbox(TestCase):
+
+    def setUp(self):
+        self.server = LocalSMTPServer().__enter__()
+        self.pool = SMTPConnectionPool(
+            "127.0.0.1", self.server.port, username="me@example.com",
+            password="secret", use_ssl=False)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.__exit__()
+
+    def test_batch_is_sent_over_one_connection(self):
+        for _ in range(3):
+            enqueue_email("OTP", fake.email(), {"otp": "123456"})
+
+        claimed = deliver_outbox_batch(pool=self.pool)
+
+        self.assertEqual(claimed, 3)
+        self.assertEqual(self.server.messages, 3)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailOutbox.SENT).count(), 3)
+        self.assertEqual(deliver_outbox_batch(pool=self.pool), 0)
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        enqueue_email("OTP", fake.email(), {"otp": "123456"})
+        unreachable = SMTPConnectionPool("127.0.0.1", 1, use_ssl=False, timeout=1)
+
+        deliver_outbox_batch(pool=unreachable)
+
+        outbox_email = EmailOutbox.objects.get()
+        self.assertEqual(outbox_email.status, EmailOutbox.PENDING)
+        self.assertEqual(outbox_email.attempts, 1)
+        self.assertGreater(outbox_email.next_attempt_at, timezone.now())
+        self.assertEqual(deliver_outbox_batch(pool=self.pool), 0)
+
+    def test_unknown_format_fails_permanently(self):
+        enqueue_email("missing", fake.email())
+        EmailOutbox.objects.update(attempts=4)
+
+        deliver_outbox_batch(pool=self.pool)
+
+        self.assertEqual(EmailOutbox.objects.get().status, EmailOutbox.FAILED)
+
+
+@mock.patch.dict(os.environ, {'EMAIL_ADDRESS': 'me@example.com'})
+class TestBulkEmailCampaign(TestCase):
+
+    def setUp(self):
+        self.server = LocalSMTPServer().__enter__()
+        self.pool = SMTPConnectionPool(
+            "127.0.0.1", self.server.port, username="me@example.com",
+            password="secret", use_ssl=False)
+        self.users = [
+            CustomUser.objects.create_user(email=fake.email(), password="Cocoro123")
+            for _ in range(5)
+        ]
+        self.campaign = BulkEmailCampaign.objects.create(
+            name="Launch", subject="News", body="Hi {{email}}!",
+            rate_per_second=0, chunk_size=2)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.__exit__()
+
+    def test_campaign_reaches_every_user(self):
+        campaign = send_campaign(self.campaign, pool=self.pool)
+
+        self.assertEqual(campaign.status, BulkEmailCampaign.COMPLETED)
+        self.assertEqual(campaign.sent_count, 5)
+        self.assertEqual(campaign.last_user_id, self.users[-1].id)
+        self.assertEqual(self.server.messages, 5)
+
+    def test_campaign_resumes_after_last_user(self):
+        self.campaign.last_user_id = self.users[2].id
+        self.campaign.save()
+
+        campaign = send_campaign(self.campaign, pool=self.pool)
+
+        self.assertEqual(campaign.sent_count, 2)
+        self.assertEqual(self.server.messages, 2)
@@ -1,7 +1,12 @@
 from django.contrib import admin
-from .models import PaypalProductModel, PaypalProductModelAdmin, Purchase
+from .models import PaypalProductModel, PaypalProductModelAdmin, Purchase, PaypalOrder, PaypalWebhookEvent, CaptureResult, UserSpend, ProductDailySales
 
 # Register your models here.
 admin.site.register(PaypalProductModel, PaypalProductModelAdmin)
 admin.site.register(Purchase)
+admin.site.register(PaypalOrder)
+admin.site.register(PaypalWebhookEvent)
+admin.site.register(CaptureResult)
+admin.site.register(UserSpend)
+admin.site.register(ProductDailySales)
 
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PaypalConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'paypal'
+
+    def ready(self):
+        from . import catalog  # noqa: F401 (connects the cache invalidation signals)
+        from . import checks  # noqa: F401
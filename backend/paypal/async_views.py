@@ -0,0 +1,120 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+
+from .serializers import OrderSerializer, OnSuccessSerializer
+from helpers.handle_errors import raise_400_HTTP_if_serializer_invalid
+from .services import (capture_paypal_payment_async, create_paypal_order_async,
+                       get_capture_result, is_order_of, record_capture, fulfil_capture_result)
+from user.authentication import ClaimsJWTAuthentication
+from user.permissions import IsVerifiedPermission
+
+# Async versions of the checkout endpoints for ASGI deployments. DRF views
+# are sync only, so authentication and validation reuse the DRF classes in a
+# thread while the PayPal call itself is awaited.
+
+
+def authenticate_verified_user(request):
+    """
+    Same rules as @permission_classes([IsAuthenticated, IsVerifiedPermission]).
+    Returns (user, None) or (None, error response).
+    """
+    try:
+        result = ClaimsJWTAuthentication().authenticate(request)
+    except AuthenticationFailed as e:
+        detail = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+        return None, JsonResponse(detail, status=401)
+
+    if result is None:
+        return None, JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=401)
+
+    user, _ = result
+    if not user.verified:
+        return None, JsonResponse({"msg": IsVerifiedPermission.message}, status=403)
+
+    return user, None
+
+
+async def validate(serializer):
+    try:
+        await sync_to_async(raise_400_HTTP_if_serializer_invalid)(serializer)
+    except ValidationError as e:
+        return JsonResponse(e.detail, status=400)
+    return None
+
+
+def parse_json(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError:
+        return {}
+
+
+@csrf_exempt
+@require_POST
+async def create_order_async(request):
+    """
+    Async version of `create_order`. Same request body and responses.
+    """
+    user, error = await sync_to_async(authenticate_verified_user)(request)
+    if error:
+        return error
+
+    serializer = OrderSerializer(data=parse_json(request), context={"user": user})
+    error = await validate(serializer)
+    if error:
+        return error
+    product, value = serializer.validated_data.get("cart")
+
+    try:
+        order_data = await create_paypal_order_async(user, product, value)
+    except Exception as e:
+        print(str(e))
+        return JsonResponse({"msg": "Unexpected error."}, status=400)
+
+    return JsonResponse(order_data)
+
+
+@csrf_exempt
+@require_POST
+async def capture_order_async(request):
+    """
+    Async version of `capture_order`. Same request body and responses.
+    """
+    user, error = await sync_to_async(authenticate_verified_user)(request)
+    if error:
+        return error
+
+    serializer = OnSuccessSerializer(data=parse_json(request))
+    error = await validate(serializer)
+    if error:
+        return error
+    order_id = serializer.validated_data.get("orderID")
+
+    if not await sync_to_async(is_order_of)(user, order_id):
+        return JsonResponse({"msg": "Order not found."}, status=404)
+
+    result = await sync_to_async(get_capture_result)(order_id)
+    if result is None:
+        try:
+            capture_response = await capture_paypal_payment_async(order_id)
+        except Exception as e:
+            print(str(e))
+            return JsonResponse({"msg": "Paypal unexpected error."}, status=400)
+
+        result = await sync_to_async(record_capture)(user, order_id, capture_response)
+
+    if not settings.PAYPAL_WEBHOOK_ID:
+        try:
+            await sync_to_async(fulfil_capture_result)(result)
+        except Exception as e:
+            print(str(e))
+            return JsonResponse({"msg": "Unexpected error."}, status=400)
+
+    return HttpResponse(status=201)
@@ -0,0 +1,101 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import PaypalProductModel
+
+
+class ProductCatalog:
+    """
+    In-process snapshot of every PaypalProductModel, indexed by PayPal id
+    and by name, so checkout resolves products without hitting the DB.
+
+    Saving or deleting a product bumps a version key in `shared_cache`.
+    Other processes compare it at most every `check_interval` seconds and
+    reload on change, and any snapshot older than `max_age` is reloaded
+    regardless (in case a version bump was lost).
+    """
+
+    VERSION_KEY = 'paypal:catalog:version'
+
+    def __init__(self, shared_cache='shared', check_interval=5, max_age=300):
+        self.shared_cache = shared_cache
+        self.check_interval = check_interval
+        self.max_age = max_age
+
+        self._snapshot = None  # (by_paypal_id, by_name)
+        self._version = None
+        self._loaded_at = 0
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def _cache(self):
+        return caches[self.shared_cache]
+
+    def _shared_version(self):
+        version = self._cache.get(self.VERSION_KEY)
+        if version is None:
+            self._cache.add(self.VERSION_KEY, uuid.uuid4().hex, timeout=None)
+            version = self._cache.get(self.VERSION_KEY)
+        return version
+
+    def _is_fresh(self, now):
+        return self._snapshot is not None and now < self._loaded_at + self.max_age
+
+    def _current(self):
+        now = time.monotonic()
+        if self._is_fresh(now) and now < self._checked_at + self.check_interval:
+            return self._snapshot
+
+        with self._lock:
+            now = time.monotonic()
+            if self._is_fresh(now) and now < self._checked_at + self.check_interval:
+                return self._snapshot
+
+            # Read the version before the rows: a change landing in between
+            # leaves us one version behind, so the next check reloads
+            version = self._shared_version()
+            if not (self._is_fresh(now) and version == self._version):
+                products = list(PaypalProductModel.objects.all())
+                self._snapshot = (
+                    {product.paypal_id_product: product for product in products if product.paypal_id_product},
+                    {product.name: product for product in products},
+                )
+                self._version = version
+                self._loaded_at = now
+            self._checked_at = now
+            return self._snapshot
+
+    def get_by_paypal_id(self, paypal_id):
+        return self._current()[0].get(paypal_id)
+
+    def get_by_name(self, name):
+        return self._current()[1].get(name)
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+        self._cache.set(self.VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+product_catalog = ProductCatalog(
+    shared_cache=settings.PAYPAL_CATALOG_CACHE,
+    check_interval=settings.PAYPAL_CATALOG_CHECK_INTERVAL,
+    max_age=settings.PAYPAL_CATALOG_MAX_AGE,
+)
+
+
+@receiver(post_save, sender=PaypalProductModel)
+@receiver(post_delete, sender=PaypalProductModel)
+def invalidate_product_catalog(sender, **kwargs):
+    # Now for this process, and again once committed so other processes
+    # can't reload the pre-commit rows under the new version
+    product_catalog.invalidate()
+    transaction.on_commit(product_catalog.invalidate)
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+
+from user.helpers.claims import PROCESS_LOCAL_CACHES
+
+
+@checks.register(checks.Tags.caches)
+def check_catalog_cache(app_configs, **kwargs):
+    if not isinstance(caches[settings.PAYPAL_CATALOG_CACHE], PROCESS_LOCAL_CACHES):
+        return []
+
+    return [checks.Error(
+        "PAYPAL_CATALOG_CACHE is local to each process: product changes made on one worker "
+        "reach the others only after PAYPAL_CATALOG_MAX_AGE.",
+        hint="Point PAYPAL_CATALOG_CACHE to a cache shared by all the workers.",
+        id='paypal.E001',
+    )]
@@ -0,0 +1,72 @@
+import csv
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+EXPORT_FIELDS = ('id', 'purchased_date', 'product__name', 'price', 'amount')
+EXPORT_HEADER = ('id', 'purchased_date', 'product', 'price', 'amount')
+STAFF_FIELDS = EXPORT_FIELDS + ('user__email',)
+STAFF_HEADER = EXPORT_HEADER + ('user',)
+
+
+class _Line:
+    # csv.writer only needs .write(); return the line instead of buffering it
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, fields, chunk_size=2000):
+    """
+    Tuples of `fields` for every row of `queryset`, fetched `chunk_size`
+    rows at a time (from a server-side cursor on PostgreSQL), so memory
+    doesn't grow with the history.
+    """
+    return queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def csv_lines(rows, header):
+    writer = csv.writer(_Line())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows, header):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+def buffered(lines, size=64 * 1024):
+    """
+    Join `lines` into bytes chunks of about `size`, so the response isn't
+    written (and compressed) one row at a time.
+    """
+    chunk, length = [], 0
+    for line in lines:
+        data = line.encode()
+        chunk.append(data)
+        length += len(data)
+        if length >= size:
+            yield b"".join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
+
+
+def gzipped(chunks, level=6):
+    """
+    Compress `chunks` into a single gzip stream as they are produced.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
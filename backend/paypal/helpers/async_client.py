@@ -0,0 +1,124 @@
+import asyncio
+import base64
+import threading
+
+import aiohttp
+
+from django.conf import settings
+
+from .credentials import clientID, clientSecret, token_cache
+
+
+class PaypalAPIError(Exception):
+
+    def __init__(self, status, data):
+        super().__init__(f"PayPal API error {status}: {data}")
+        self.status = status
+        self.data = data
+
+
+class AsyncPaypalClient:
+    """
+    aiohttp counterpart of PaypalClient for async views under ASGI.
+
+    One ClientSession (and connection pool) is kept per event loop, so a
+    single ASGI worker can hold hundreds of in-flight PayPal calls. The OAuth
+    token is shared with the sync client through `token_cache`.
+    """
+
+    def __init__(self, base_url, client_id=None, client_secret=None, pool_size=100,
+                 connect_timeout=3.05, read_timeout=15):
+        self.base_url = base_url.rstrip('/')
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+
+        self._sessions = {}  # event loop -> (ClientSession, token refresh lock)
+
+    def _session(self):
+        loop = asyncio.get_running_loop()
+        entry = self._sessions.get(loop)
+
+        if entry is None or entry[0].closed:
+            for other_loop in [other for other in self._sessions if other.is_closed()]:
+                del self._sessions[other_loop]
+
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=self.timeout,
+            )
+            entry = self._sessions[loop] = (session, asyncio.Lock())
+        return entry
+
+    async def _token(self):
+        token = token_cache.peek()
+        if token:
+            return token
+
+        session, lock = self._session()
+        async with lock:
+            token = token_cache.peek()
+            if token:
+                return token
+
+            credentials = base64.b64encode(
+                f"{self.client_id}:{self.client_secret}".encode()).decode()
+            async with session.post(
+                    self.base_url + '/v1/oauth2/token',
+                    data={"grant_type": "client_credentials"},
+                    headers={"Authorization": f"Basic {credentials}"}) as response:
+                data = await response.json(content_type=None)
+                if response.status >= 400:
+                    raise PaypalAPIError(response.status, data)
+
+            token_cache.store(data['access_token'], data['expires_in'])
+            return data['access_token']
+
+    async def request(self, method, path, headers=None, **kwargs):
+        session, _ = self._session()
+        headers = dict(headers or {})
+
+        for attempt in range(2):
+            token = await self._token()
+            headers['Authorization'] = f'Bearer {token}'
+
+            async with session.request(method, self.base_url + path, headers=headers, **kwargs) as response:
+                data = await response.json(content_type=None)
+
+                if response.status == 401 and not attempt:
+                    # Token revoked or expired early: drop it and retry once
+                    token_cache.invalidate(token)
+                    continue
+                if response.status >= 400:
+                    raise PaypalAPIError(response.status, data)
+                return data
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def close(self):
+        for session, _ in self._sessions.values():
+            await session.close()
+        self._sessions = {}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_async_paypal_client():
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AsyncPaypalClient(
+                    settings.PAYPAL_API_BASE_URL,
+                    client_id=clientID,
+                    client_secret=clientSecret,
+                    pool_size=settings.PAYPAL_ASYNC_POOL_SIZE,
+                    connect_timeout=settings.PAYPAL_CONNECT_TIMEOUT,
+                    read_timeout=settings.PAYPAL_READ_TIMEOUT,
+                )
+    return _client
@@ -0,0 +1,113 @@
+import base64
+import threading
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'POST')
+
+
+class PaypalClient:
+    """
+    Keep-alive HTTP client for the PayPal REST API.
+
+    Owns a `requests.Session` with a sized connection pool and explicit
+    connect/read timeouts. Connection errors, timeouts and 5xx/429 answers
+    are retried by the adapter, `max_retries` times at most. That is safe
+    for POSTs too: every POST carries a `PayPal-Request-Id` (a random one
+    unless the caller sets it), and PayPal answers a repeated one with the
+    first result instead of acting twice.
+    """
+
+    def __init__(self, base_url, client_id=None, client_secret=None, pool_size=10,
+                 connect_timeout=3.05, read_timeout=15, max_retries=3, backoff_factor=0.5):
+        self.base_url = base_url.rstrip('/')
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=max_retries, status_forcelist=RETRY_STATUSES, allowed_methods=RETRY_METHODS,
+                              backoff_factor=backoff_factor, raise_on_status=False),
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def fetch_access_token(self):
+        credentials = base64.b64encode(
+            f"{self.client_id}:{self.client_secret}".encode()).decode()
+        response = self.request(
+            'POST', '/v1/oauth2/token', auth=False,
+            data={"grant_type": "client_credentials"},
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Authorization": f"Basic {credentials}",
+            },
+        )
+        response.raise_for_status()
+        response_json = response.json()
+
+        return response_json['access_token'], response_json['expires_in']
+
+    def request(self, method, path, auth=True, headers=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        headers = dict(headers or {})
+        if method == 'POST':
+            headers.setdefault('PayPal-Request-Id', uuid.uuid4().hex)
+        url = self.base_url + path
+
+        if not auth:
+            return self.session.request(method, url, headers=headers, **kwargs)
+
+        from .credentials import PaypalToken, invalidate_paypal_token
+
+        token = PaypalToken()
+        headers['Authorization'] = f'Bearer {token}'
+        response = self.session.request(method, url, headers=headers, **kwargs)
+
+        if response.status_code == 401:
+            # Token revoked or expired early: drop it and retry once
+            invalidate_paypal_token(token)
+            headers['Authorization'] = f'Bearer {PaypalToken()}'
+            response = self.session.request(method, url, headers=headers, **kwargs)
+
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_paypal_client():
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from .credentials import clientID, clientSecret
+
+                _client = PaypalClient(
+                    settings.PAYPAL_API_BASE_URL,
+                    client_id=clientID,
+                    client_secret=clientSecret,
+                    pool_size=settings.PAYPAL_POOL_SIZE,
+                    connect_timeout=settings.PAYPAL_CONNECT_TIMEOUT,
+                    read_timeout=settings.PAYPAL_READ_TIMEOUT,
+                    max_retries=settings.PAYPAL_MAX_RETRIES,
+                )
+    return _client
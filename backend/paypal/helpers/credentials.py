@@ -1,6 +1,12 @@
 import os
-import base64
-import requests
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .client import get_paypal_client
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -9,19 +15,105 @@ clientID = os.environ.get('PAYPAL_CLIENT_ID')
 clientSecret = os.environ.get('PAYPAL_CLIENT_SECRET')
 
 
-def PaypalToken():
+class PaypalTokenCache:
+    """
+    Process-wide cache of the PayPal OAuth access token.
+
+    The token is refreshed `refresh_margin` seconds before PayPal's
+    `expires_in`, and concurrent callers wait on a single refresh instead of
+    each requesting a new token. With `shared_cache` (a Django cache alias)
+    the token is also shared between worker processes.
+    """
+
+    KEY = 'paypal:access_token'
+    LOCK_KEY = 'paypal:access_token:refresh'
+
+    def __init__(self, refresh_margin=300, shared_cache=None):
+        self.refresh_margin = refresh_margin
+        self.shared_cache = shared_cache
+
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def _cache(self):
+        return caches[self.shared_cache] if self.shared_cache else None
+
+    def peek(self):
+        if self._token and time.time() < self._expires_at - self.refresh_margin:
+            return self._token
+
+        if self._cache is not None:
+            shared = self._cache.get(self.KEY)
+            if shared and time.time() < shared[1] - self.refresh_margin:
+                self._token, self._expires_at = shared
+                return self._token
+
+        return None
+
+    def store(self, token, expires_in):
+        self._token = token
+        self._expires_at = time.time() + expires_in
+
+        if self._cache is not None:
+            self._cache.set(self.KEY, (self._token, self._expires_at),
+                            timeout=max(int(expires_in - self.refresh_margin), 1))
 
-    url = "https://api.sandbox.paypal.com/v1/oauth2/token"
-    data = {
-        "client_id": clientID,
-        "client_secret": clientSecret,
-        "grant_type": "client_credentials"
-    }
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Authorization": "Basic {0}".format(base64.b64encode((clientID + ":" + clientSecret).encode()).decode())
-    }
+    def get(self, fetch):
+        token = self.peek()
+        if token:
+            return token
+
+        with self._lock:
+            token = self.peek()
+            if token:
+                return token
+
+            owner = uuid.uuid4().hex
+            if self._cache is not None and not self._cache.add(self.LOCK_KEY, owner, timeout=10):
+                # Another process is refreshing, give it a moment to publish
+                for _ in range(20):
+                    time.sleep(0.1)
+                    token = self.peek()
+                    if token:
+                        return token
+
+            try:
+                token, expires_in = fetch()
+                self.store(token, expires_in)
+            finally:
+                # Unless we didn't get it, or it expired and another process took it
+                if self._cache is not None and self._cache.get(self.LOCK_KEY) == owner:
+                    self._cache.delete(self.LOCK_KEY)
+
+            return token
+
+    def invalidate(self, token=None):
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0
+
+            if self._cache is not None:
+                shared = self._cache.get(self.KEY)
+                if shared and (token is None or shared[0] == token):
+                    self._cache.delete(self.KEY)
+
+
+token_cache = PaypalTokenCache(
+    refresh_margin=settings.PAYPAL_TOKEN_REFRESH_MARGIN,
+    shared_cache=settings.PAYPAL_TOKEN_CACHE,
+)
+
+
+def _request_token():
+    return get_paypal_client().fetch_access_token()
+
+
+def PaypalToken():
+    return token_cache.get(_request_token)
 
-    token = requests.post(url, data, headers=headers)
 
-    return token.json()['access_token']
+def invalidate_paypal_token(token=None):
+    token_cache.invalidate(token)
@@ -1,30 +1,150 @@
-from paypal.helpers.credentials import PaypalToken, clientID, clientSecret
-import requests
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-def create_product(name, description, home_url):
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
 
-    from paypal.models import PaypalProductModel
+from helpers.work_queue import WorkQueue
+from paypal.catalog import product_catalog
+from paypal.helpers.client import get_paypal_client
+from paypal.models import PaypalProductModel
 
-    access_token = PaypalToken()
+logger = logging.getLogger(__name__)
 
+
+def create_product(product):
+    """
+    Create `product` in the PayPal catalog and return its PayPal id.
+
+    The PayPal-Request-Id is derived from the pk: a retry, or a second
+    worker syncing the same product, gets the product created the first
+    time instead of a duplicate.
+    """
     headers = {
         'Content-Type': 'application/json',
         'Accept': 'application/json',
-        'PayPal-Request-Id': f'PRODUCT-{name}',
+        'PayPal-Request-Id': f'PRODUCT-{product.pk}',
         'Prefer': 'return=representation',
-        'Authorization': 'Bearer ' + access_token
     }
 
-    data = '{"name": "' + name + '", "description": "' + description + \
-        '", "type": "SERVICE", "category": "SOFTWARE", "image_url": "https://example.com/streaming.jpg", "home_url": "' + home_url + '"}'
+    data = {
+        "name": product.name,
+        "description": product.description,
+        "type": "SERVICE",
+        "category": "SOFTWARE",
+        "image_url": "https://example.com/streaming.jpg",
+        "home_url": product.home_url,
+    }
+
+    response = get_paypal_client().post(
+        '/v1/catalogs/products', headers=headers, json=data)
+    response.raise_for_status()
+    return response.json()['id']
+
+
+product_queue = WorkQueue(
+    PaypalProductModel, PaypalProductModel.SYNCING, status='sync_status', attempts='sync_attempts',
+    next_attempt_at='sync_next_attempt_at', claimed_at='sync_claimed_at', error='sync_error')
+
+
+def claim_product_batch(batch_size):
+    """
+    Claim up to `batch_size` products due for sync, reclaiming the ones
+    held by a worker whose lease has expired.
+    """
+    return product_queue.claim(
+        batch_size, settings.PAYPAL_PRODUCT_SYNC_LEASE,
+        PaypalProductModel.objects.filter(paypal_id_product__isnull=True, user__is_superuser=True))
+
+
+def schedule_product_retry(product, error):
+    product_queue.retry(product, error, settings.PAYPAL_PRODUCT_SYNC_MAX_ATTEMPTS,
+                        settings.PAYPAL_PRODUCT_SYNC_BACKOFF)
+
+
+def sync_products_batch(batch_size=20):
+    """
+    Create one batch of pending products in PayPal. The calls run in
+    parallel over the pooled client, the DB writes stay on this thread.
+    Returns the number of products claimed.
+    """
+    products = claim_product_batch(batch_size)
+    if not products:
+        return 0
+
+    def create(product):
+        try:
+            return product, create_product(product), None
+        except Exception as e:
+            return product, None, e
+
+    with ThreadPoolExecutor(max_workers=min(len(products), settings.PAYPAL_POOL_SIZE)) as executor:
+        results = list(executor.map(create, products))
+
+    for product, paypal_id, error in results:
+        if error is not None:
+            schedule_product_retry(product, error)
+            continue
+        PaypalProductModel.objects.filter(pk=product.pk).update(
+            paypal_id_product=paypal_id, sync_status=PaypalProductModel.SYNCED,
+            sync_claimed_at=None, sync_error='')
+
+    product_catalog.invalidate()
+    return len(products)
+
+
+def queue_products(queryset):
+    """
+    Queue the products of `queryset` that have no PayPal id yet (e.g. the
+    failed ones) to be synced right away. Returns how many were queued.
+    """
+    queued = queryset.filter(paypal_id_product__isnull=True).exclude(
+        sync_status=PaypalProductModel.SYNCING).update(
+            sync_status=PaypalProductModel.PENDING, sync_attempts=0,
+            sync_next_attempt_at=timezone.now(), sync_error='')
+    transaction.on_commit(start_product_sync)
+    return queued
+
+
+_sync_thread = None
+_sync_requested = False
+_sync_lock = threading.Lock()
+
+
+def start_product_sync():
+    """
+    Sync pending products in a background thread, so the admin request
+    that created them doesn't wait for PayPal. One thread per process;
+    products it fails on are retried by `manage.py sync_paypal_products`.
+    """
+    global _sync_thread, _sync_requested
+
+    with _sync_lock:
+        _sync_requested = True
+        if _sync_thread is None:
+            _sync_thread = threading.Thread(target=_run_product_sync, name="paypal-product-sync", daemon=True)
+            _sync_thread.start()
 
-    response = requests.post(
-        'https://api-m.sandbox.paypal.com/v1/catalogs/products', headers=headers, data=data)
 
-    response_json = response.json()
-    product_id = response_json['id']
+def _run_product_sync():
+    global _sync_thread, _sync_requested
 
-    paypal_product = PaypalProductModel.objects.get(name=name)
-    paypal_product.paypal_id_product = product_id
-    paypal_product.save()
+    try:
+        while True:
+            with _sync_lock:
+                if not _sync_requested:
+                    _sync_thread = None
+                    return
+                _sync_requested = False
 
+            while sync_products_batch():
+                pass
+    except Exception:
+        # Claimed products are retried once their lease expires
+        logger.exception("PayPal product sync failed")
+        with _sync_lock:
+            _sync_thread = None
+    finally:
+        connection.close()
@@ -0,0 +1,269 @@
+import base64
+import re
+import threading
+import time
+import zlib
+from datetime import datetime
+from urllib.parse import urlparse
+
+import certifi
+import rsa
+from django.conf import settings
+from django.utils import timezone
+from pyasn1.codec.der import decoder, encoder
+from pyasn1_modules import rfc3279, rfc5280
+
+from .client import get_paypal_client
+
+
+PEM_CERTIFICATE = re.compile(r'-----BEGIN CERTIFICATE-----(.*?)-----END CERTIFICATE-----', re.S)
+SIGNATURE_HASHES = ('SHA-256', 'SHA-384', 'SHA-512')
+
+
+def _der_header(der, offset):
+    """Length of the DER header at `offset` and of the value after it."""
+    length = der[offset + 1]
+    if length < 0x80:
+        return 2, length
+    size = length & 0x7f
+    return 2 + size, int.from_bytes(der[offset + 2:offset + 2 + size], 'big')
+
+
+def _common_names(name):
+    return [
+        str(decoder.decode(bytes(attribute['value']), asn1Spec=rfc5280.DirectoryString())[0].getComponent())
+        for rdn in name['rdnSequence'] for attribute in rdn
+        if attribute['type'] == rfc5280.id_at_commonName
+    ]
+
+
+class Certificate:
+    """
+    The parts of an X.509 certificate needed to check a chain of RSA
+    certificates: names, validity, CA constraints, key usage, key and
+    signature. `key_usage` and `path_len` are None when the certificate
+    doesn't restrict them.
+    """
+
+    def __init__(self, der):
+        cert = decoder.decode(der, asn1Spec=rfc5280.Certificate())[0]
+        tbs = cert['tbsCertificate']
+
+        # Signed bytes as received, not re-encoded
+        outer, _ = _der_header(der, 0)
+        header, length = _der_header(der, outer)
+        self.signed = der[outer:outer + header + length]
+        self.signature = cert['signature'].asOctets()
+
+        self.subject = encoder.encode(tbs['subject'])
+        self.issuer = encoder.encode(tbs['issuer'])
+        self.common_names = _common_names(tbs['subject'])
+        self.not_before = tbs['validity']['notBefore'].getComponent().asDateTime
+        self.not_after = tbs['validity']['notAfter'].getComponent().asDateTime
+
+        self.is_ca = False
+        self.path_len = None
+        self.key_usage = None
+        for extension in tbs['extensions']:
+            if extension['extnID'] == rfc5280.id_ce_basicConstraints:
+                constraints = decoder.decode(
+                    extension['extnValue'].asOctets(), asn1Spec=rfc5280.BasicConstraints())[0]
+                self.is_ca = bool(constraints['cA'])
+                if constraints['pathLenConstraint'].hasValue():
+                    self.path_len = int(constraints['pathLenConstraint'])
+            elif extension['extnID'] == rfc5280.id_ce_keyUsage:
+                bits = decoder.decode(extension['extnValue'].asOctets(), asn1Spec=rfc5280.KeyUsage())[0]
+                self.key_usage = {name for name, bit in rfc5280.KeyUsage.namedValues.items()
+                                  if bit < len(bits) and bits[bit]}
+
+        key_info = tbs['subjectPublicKeyInfo']
+        self.public_key = None
+        if key_info['algorithm']['algorithm'] == rfc3279.rsaEncryption:
+            self.public_key = rsa.PublicKey.load_pkcs1(key_info['subjectPublicKey'].asOctets(), 'DER')
+
+    def is_valid_at(self, now):
+        return self.not_before <= now <= self.not_after
+
+    def allows(self, usage):
+        return self.key_usage is None or usage in self.key_usage
+
+    def can_issue(self, below):
+        """
+        Whether it may sign certificates, with `below` intermediate CAs
+        between it and the end of the chain.
+        """
+        return self.allows('keyCertSign') and (self.path_len is None or self.path_len >= below)
+
+    def is_signed_by(self, issuer):
+        if issuer.subject != self.issuer or issuer.public_key is None:
+            return False
+        try:
+            return rsa.verify(self.signed, self.signature, issuer.public_key) in SIGNATURE_HASHES
+        except rsa.VerificationError:
+            return False
+
+
+def load_certificates(pem):
+    return [Certificate(base64.b64decode(block)) for block in PEM_CERTIFICATE.findall(pem)]
+
+
+class PaypalCertCache:
+    """
+    Signing certificates referenced by PAYPAL-CERT-URL, cached per URL.
+
+    The URL comes from the request, so the download is only trusted if it
+    chains (through the certificates sent along with it) up to a root of
+    `ca_bundle` (certifi's by default), every certificate is within its
+    validity dates, every issuer is allowed to sign certificates that deep
+    in the chain (CA flag, keyCertSign key usage, path length) and the
+    first one is issued to one of `subjects` for digital signatures. Its
+    public key is cached for `ttl` seconds, or until the chain expires.
+
+    PayPal rotates them rarely and every webhook points to the same few, so
+    verifying a delivery normally costs no HTTP call at all.
+    """
+
+    def __init__(self, ttl, subjects, ca_bundle=None, session=None, timeout=10, max_chain=5):
+        self.ttl = ttl
+        self.subjects = subjects
+        self.ca_bundle = ca_bundle
+        self.session = session
+        self.timeout = timeout
+        self.max_chain = max_chain
+        self._roots = None  # subject -> [Certificate]
+        self._keys = {}  # url -> (rsa.PublicKey, expires_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_paypal_url(url):
+        parsed = urlparse(url)
+        return parsed.scheme == 'https' and (
+            parsed.hostname == 'paypal.com' or (parsed.hostname or '').endswith('.paypal.com'))
+
+    def _load_roots(self):
+        if self._roots is None:
+            roots = {}
+            with open(self.ca_bundle or certifi.where()) as f:
+                for cert in load_certificates(f.read()):
+                    roots.setdefault(cert.subject, []).append(cert)
+            self._roots = roots
+        return self._roots
+
+    def validate(self, certs, now):
+        """
+        Check the chain `certs` (the signing certificate first) at `now`.
+        Returns the time the chain expires.
+
+        Raises:
+            ValueError: If it isn't a valid, trusted PayPal chain.
+        """
+        if not certs:
+            raise ValueError("No certificate found")
+        leaf = certs[0]
+        if not set(leaf.common_names) & set(self.subjects):
+            raise ValueError(f"Certificate issued to {leaf.common_names}")
+        if leaf.public_key is None or not leaf.allows('digitalSignature'):
+            raise ValueError("Certificate can't be used to verify signatures")
+
+        roots = self._load_roots()
+        cert, expires_at = leaf, leaf.not_after
+        for below in range(self.max_chain):
+            if not cert.is_valid_at(now):
+                raise ValueError(f"Certificate {cert.common_names} expired or not yet valid")
+            expires_at = min(expires_at, cert.not_after)
+
+            # Roots are trusted as configured, whether or not they have the CA flag
+            root = next((root for root in roots.get(cert.issuer, ())
+                         if root.is_valid_at(now) and root.can_issue(below) and cert.is_signed_by(root)), None)
+            if root is not None:
+                return min(expires_at, root.not_after)
+
+            issuer = next((other for other in certs[1:]
+                           if other.is_ca and other.can_issue(below) and cert.is_signed_by(other)), None)
+            if issuer is None:
+                break
+            cert = issuer
+        raise ValueError("Certificate chain doesn't lead to a trusted root")
+
+    def get(self, url):
+        """
+        The public key of the certificate at `url`, downloaded and validated
+        the first time.
+        """
+        entry = self._keys.get(url)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+
+        if not self.is_paypal_url(url):
+            raise ValueError(f"Refusing certificate from {url}")
+
+        with self._lock:
+            entry = self._keys.get(url)
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+
+            session = self.session or get_paypal_client().session
+            response = session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+
+            certs = load_certificates(response.text)
+            now = timezone.now()
+            expires_at = self.validate(certs, now)
+
+            public_key = certs[0].public_key
+            ttl = min(self.ttl, (expires_at - now).total_seconds())
+            self._keys[url] = (public_key, time.monotonic() + ttl)
+            return public_key
+
+
+webhook_certs = PaypalCertCache(
+    settings.PAYPAL_WEBHOOK_CERT_TTL,
+    subjects=settings.PAYPAL_WEBHOOK_CERT_SUBJECTS,
+    ca_bundle=settings.PAYPAL_WEBHOOK_CA_BUNDLE,
+    timeout=(settings.PAYPAL_CONNECT_TIMEOUT, settings.PAYPAL_READ_TIMEOUT),
+)
+
+
+def is_recent(transmission_time, max_age):
+    """
+    Whether PAYPAL-TRANSMISSION-TIME is within `max_age` seconds of now,
+    so a captured delivery can't be replayed later.
+    """
+    try:
+        sent_at = datetime.fromisoformat(transmission_time)
+    except ValueError:
+        return False
+    if sent_at.tzinfo is None:
+        return False
+    return abs((timezone.now() - sent_at).total_seconds()) <= max_age
+
+
+def verify_webhook_signature(headers, body, webhook_id=None):
+    """
+    Offline check of a PayPal webhook delivery: the transmission signature
+    is SHA256withRSA over "<transmission id>|<time>|<webhook id>|<crc32 of body>",
+    and the transmission time must be within PAYPAL_WEBHOOK_MAX_AGE seconds.
+    """
+    webhook_id = webhook_id or settings.PAYPAL_WEBHOOK_ID
+    transmission_id = headers.get('PAYPAL-TRANSMISSION-ID')
+    transmission_time = headers.get('PAYPAL-TRANSMISSION-TIME')
+    signature = headers.get('PAYPAL-TRANSMISSION-SIG')
+    cert_url = headers.get('PAYPAL-CERT-URL')
+    auth_algo = headers.get('PAYPAL-AUTH-ALGO', 'SHA256withRSA')
+
+    if not (webhook_id and transmission_id and transmission_time and signature and cert_url):
+        return False
+    if auth_algo != 'SHA256withRSA':
+        return False
+    if not is_recent(transmission_time, settings.PAYPAL_WEBHOOK_MAX_AGE):
+        return False
+
+    message = f"{transmission_id}|{transmission_time}|{webhook_id}|{zlib.crc32(body)}"
+    try:
+        public_key = webhook_certs.get(cert_url)
+        return rsa.verify(message.encode(), base64.b64decode(signature), public_key) == 'SHA-256'
+    except rsa.VerificationError:
+        return False
+    except Exception as e:
+        print(str(e))
+        return False
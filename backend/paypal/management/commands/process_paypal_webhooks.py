@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from paypal.services import process_webhook_batch
+
+
+class Command(BaseCommand):
+    help = "Fulfil captured PayPal orders from stored webhook events in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to sleep when there are no pending events.")
+        parser.add_argument('--once', action='store_true',
+                            help="Process the pending events once and exit.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        while True:
+            claimed = process_webhook_batch(batch_size)
+
+            if claimed:
+                self.stdout.write(f"Processed {claimed} webhook events.")
+                continue
+
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,43 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from paypal.reconciliation import OK, reconcile
+
+
+class Command(BaseCommand):
+    help = "Check that every completed PayPal payment credited its buyer, and optionally fix the ones that didn't."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=31,
+                            help="Reconcile the payments of the last N days.")
+        parser.add_argument('--start', help="Start date (YYYY-MM-DD), instead of --days.")
+        parser.add_argument('--end', help="End date (YYYY-MM-DD, exclusive). Defaults to now.")
+        parser.add_argument('--repair', action='store_true',
+                            help="Credit tokens and create the purchase of missing payments.")
+        parser.add_argument('--page-size', type=int, default=500,
+                            help="Transactions per PayPal report page (max 500).")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Transactions checked against the database at once.")
+
+    def parse_date(self, value):
+        try:
+            return timezone.make_aware(datetime.strptime(value, '%Y-%m-%d'))
+        except ValueError:
+            raise CommandError(f"Invalid date '{value}', expected YYYY-MM-DD.")
+
+    def handle(self, *args, **options):
+        end = self.parse_date(options['end']) if options['end'] else timezone.now()
+        start = self.parse_date(options['start']) if options['start'] else end - timedelta(days=options['days'])
+
+        totals = Counter()
+        for capture_id, state in reconcile(start, end, repair=options['repair'],
+                                           page_size=options['page_size'], chunk_size=options['chunk_size']):
+            totals[state] += 1
+            if state != OK:
+                self.stdout.write(f"{state}: {capture_id}")
+
+        summary = ", ".join(f"{count} {state}" for state, count in sorted(totals.items()))
+        self.stdout.write(f"Reconciled {sum(totals.values())} payments: {summary or 'none'}.")
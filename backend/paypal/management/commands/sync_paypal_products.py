@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from paypal.helpers.products import queue_products, sync_products_batch
+from paypal.models import PaypalProductModel
+
+
+class Command(BaseCommand):
+    help = "Create pending products in the PayPal catalog in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help="Seconds to sleep when no product is pending.")
+        parser.add_argument('--once', action='store_true',
+                            help="Sync the pending products once and exit.")
+        parser.add_argument('--retry-failed', action='store_true',
+                            help="Queue the products that ran out of attempts again first.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if options['retry_failed']:
+            queued = queue_products(PaypalProductModel.objects.filter(sync_status=PaypalProductModel.FAILED))
+            self.stdout.write(f"Queued {queued} failed products.")
+
+        while True:
+            claimed = sync_products_batch(batch_size)
+
+            if claimed:
+                self.stdout.write(f"Processed {claimed} products.")
+                continue
+
+            if options['once']:
+                return
+            time.sleep(options['interval'])
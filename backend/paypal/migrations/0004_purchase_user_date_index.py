@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypal', '0003_captureresult'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['user', 'purchased_date', 'id'], name='paypal_purc_user_id_0379cf_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:33
+
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDate
+
+
+def parse_price(price):
+    try:
+        return Decimal(str(price)).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def backfill(apps, schema_editor):
+    Purchase = apps.get_model('paypal', 'Purchase')
+    UserSpend = apps.get_model('paypal', 'UserSpend')
+    ProductDailySales = apps.get_model('paypal', 'ProductDailySales')
+
+    batch = []
+    for purchase in Purchase.objects.filter(amount__isnull=True).only('id', 'price').iterator(chunk_size=2000):
+        purchase.amount = parse_price(purchase.price)
+        batch.append(purchase)
+        if len(batch) >= 2000:
+            Purchase.objects.bulk_update(batch, ['amount'])
+            batch = []
+    Purchase.objects.bulk_update(batch, ['amount'])
+
+    UserSpend.objects.all().delete()
+    UserSpend.objects.bulk_create(
+        UserSpend(user_id=row['user'], total_spent=row['total'] or 0,
+                  purchase_count=row['count'], last_purchase_at=row['last'])
+        for row in Purchase.objects.values('user').annotate(
+            total=Sum('amount'), count=Count('id'), last=Max('purchased_date')).order_by()
+    )
+
+    ProductDailySales.objects.all().delete()
+    ProductDailySales.objects.bulk_create(
+        ProductDailySales(product_id=row['product'], day=row['day'],
+                          total_amount=row['total'] or 0, purchase_count=row['count'])
+        for row in Purchase.objects.annotate(day=TruncDate('purchased_date')).values('product', 'day').annotate(
+            total=Sum('amount'), count=Count('id')).order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypal', '0005_purchase_amount_userspend_productdailysales'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
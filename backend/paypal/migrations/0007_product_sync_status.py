@@ -0,0 +1,65 @@
+# Generated by Django 5.0.2 on 2026-10-18 21:17
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def set_sync_status(apps, schema_editor):
+    PaypalProductModel = apps.get_model('paypal', 'PaypalProductModel')
+
+    # Products never created in PayPal had an empty id; NULL lets several
+    # of them wait for sync despite the unique constraint
+    PaypalProductModel.objects.filter(paypal_id_product='').update(paypal_id_product=None)
+    PaypalProductModel.objects.filter(paypal_id_product__isnull=False).update(sync_status='synced')
+
+
+def unset_sync_status(apps, schema_editor):
+    PaypalProductModel = apps.get_model('paypal', 'PaypalProductModel')
+    PaypalProductModel.objects.filter(paypal_id_product__isnull=True).update(paypal_id_product='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paypal', '0006_backfill_purchase_amount'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paypalproductmodel',
+            name='sync_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='paypalproductmodel',
+            name='sync_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='paypalproductmodel',
+            name='sync_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='paypalproductmodel',
+            name='sync_next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='paypalproductmodel',
+            name='sync_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('syncing', 'Syncing'), ('synced', 'Synced'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='paypalproductmodel',
+            name='paypal_id_product',
+            field=models.CharField(blank=True, help_text='The product ID will be generated once saved.', max_length=200, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='paypalproductmodel',
+            index=models.Index(fields=['sync_status', 'sync_next_attempt_at'], name='paypal_payp_sync_st_9c833e_idx'),
+        ),
+        migrations.RunPython(set_sync_status, unset_sync_status),
+    ]
@@ -1,37 +1,80 @@
-from django.db import models
+from django.db import models, transaction
 from user.models import CustomUser
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from paypal.helpers.products import create_product
-from .permissions import IsSuperuserOrReadOnly
+from decimal import Decimal, InvalidOperation
+
 from django.contrib import admin
+from django.utils import timezone
 
 # Create your models here.
 
 class PaypalProductModel(models.Model):
+    """
+    A product sold through PayPal. New products are created in the PayPal
+    catalog after commit, by `sync_paypal_products` (see
+    paypal/helpers/products.py), which fills `paypal_id_product`.
+    """
+
+    PENDING = 'pending'
+    SYNCING = 'syncing'
+    SYNCED = 'synced'
+    FAILED = 'failed'
+    SYNC_STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SYNCING, 'Syncing'),
+        (SYNCED, 'Synced'),
+        (FAILED, 'Failed'),
+    ]
 
     name = models.CharField(max_length=50, unique=True)
     description = models.CharField(max_length=200)
     home_url = models.CharField(max_length=200)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, limit_choices_to={'is_superuser': True})
-    paypal_id_product = models.CharField(max_length=200, unique=True, help_text="The product ID will be generated once saved.")
+    paypal_id_product = models.CharField(max_length=200, unique=True, blank=True, null=True, help_text="The product ID will be generated once saved.")
+    sync_status = models.CharField(max_length=10, choices=SYNC_STATUS_CHOICES, default=PENDING)
+    sync_attempts = models.PositiveIntegerField(default=0)
+    sync_next_attempt_at = models.DateTimeField(default=timezone.now)
+    sync_claimed_at = models.DateTimeField(blank=True, null=True)
+    sync_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sync_status', 'sync_next_attempt_at']),
+        ]
 
     def __str__(self):
         return self.name
 
-@receiver(post_save, sender=PaypalProductModel)
-def my_function(sender, instance, created, **kwargs):
-    if created:
+    def save(self, *args, **kwargs):
+        # Products created with their PayPal id (tests, imports) need no sync
+        if not self.paypal_id_product:
+            self.paypal_id_product = None
+        elif self.sync_status != self.SYNCED:
+            self.sync_status = self.SYNCED
+        super().save(*args, **kwargs)
+
 
-        if not IsSuperuserOrReadOnly().has_permission(instance, None):
-            return
+@receiver(post_save, sender=PaypalProductModel)
+def queue_product_sync(sender, instance, created, **kwargs):
+    if created and instance.sync_status == PaypalProductModel.PENDING:
+        from paypal.helpers.products import start_product_sync
 
-        if instance.paypal_id_product == "":
-            # If the product was not created in "tests.py" create it in paypal
-            create_product(instance.name, instance.description, instance.home_url)
+        # Only once the row is visible to the thread doing the sync
+        transaction.on_commit(start_product_sync)
 
 class PaypalProductModelAdmin(admin.ModelAdmin):
-    readonly_fields = ('paypal_id_product',)
+    readonly_fields = ('paypal_id_product', 'sync_status', 'sync_attempts', 'sync_error')
+    list_display = ('name', 'paypal_id_product', 'sync_status')
+    list_filter = ('sync_status',)
+    actions = ['sync_with_paypal']
+
+    @admin.action(description="Sync selected products with PayPal")
+    def sync_with_paypal(self, request, queryset):
+        from paypal.helpers.products import queue_products
+
+        queued = queue_products(queryset)
+        self.message_user(request, f"{queued} products queued for PayPal sync.")
     
     
 class Purchase(models.Model):
@@ -40,8 +83,126 @@ class Purchase(models.Model):
     product = models.ForeignKey(PaypalProductModel, on_delete=models.CASCADE)
     purchased_date = models.DateTimeField(auto_now_add=True)
     price = models.CharField(max_length=50)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'purchased_date', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.product} Purchased by {self.user}"
 
+    @staticmethod
+    def parse_price(price):
+        try:
+            return Decimal(str(price)).quantize(Decimal('0.01'))
+        except (InvalidOperation, ValueError):
+            return None
+
+    def save(self, *args, **kwargs):
+        if self.amount is None:
+            self.amount = self.parse_price(self.price)
+        super().save(*args, **kwargs)
+
+
+class UserSpend(models.Model):
+    """
+    Running totals of a user's purchases, kept up to date by
+    `paypal.services.record_purchase` in the purchase's transaction.
+    """
+
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='spend')
+    total_spent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    purchase_count = models.PositiveIntegerField(default=0)
+    last_purchase_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.user} | {self.total_spent}"
+
+
+class ProductDailySales(models.Model):
+
+    product = models.ForeignKey(PaypalProductModel, on_delete=models.CASCADE)
+    day = models.DateField()
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    purchase_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='unique_product_daily_sales'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} {self.day} | {self.total_amount}"
+
+
+
+
+class PaypalOrder(models.Model):
+    """
+    Orders created through `create_order`, so a capture webhook (which only
+    carries the order id) can be matched back to the buyer.
+    """
+
+    order_id = models.CharField(max_length=50, unique=True)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    product = models.ForeignKey(PaypalProductModel, on_delete=models.CASCADE)
+    value = models.CharField(max_length=50)
+    reference_id = models.CharField(max_length=50, default="CUSTOM")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.order_id} | {self.user}"
+
 
+class CaptureResult(models.Model):
+    """
+    Outcome of capturing a PayPal order, one row per order. Repeated
+    capture requests are answered from here, and `fulfilled` guards the
+    token credit so it happens once whichever path (view or webhook) gets
+    there first.
+    """
+
+    order_id = models.CharField(max_length=50, unique=True)
+    capture_id = models.CharField(max_length=50, blank=True, db_index=True)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    status = models.CharField(max_length=30)
+    response = models.JSONField(default=dict)
+    fulfilled = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.order_id} | {self.status}"
+
+
+class PaypalWebhookEvent(models.Model):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (PROCESSED, 'Processed'),
+        (FAILED, 'Failed'),
+    ]
+
+    event_id = models.CharField(max_length=100, unique=True)
+    event_type = models.CharField(max_length=100)
+    resource = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} | {self.status}"
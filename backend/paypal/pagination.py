@@ -0,0 +1,38 @@
+import math
+
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class PurchaseCursorPagination(CursorPagination):
+    """
+    Cursor pagination of a user's purchases, newest first. DRF's cursor
+    holds the purchased_date of the last row plus an offset: each page is
+    read from the (user, purchased_date, id) index starting at that date,
+    skipping the rows of that same date already served (`-id` only orders
+    them). Pages cost the same however many purchases the user has, unless
+    many share one purchased_date. The total is only counted when asked
+    for with ?include_total=true.
+    """
+
+    ordering = ('-purchased_date', '-id')
+    page_size = 5
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.total = None
+        if request.query_params.get('include_total') in ('true', '1'):
+            self.total = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.total is not None:
+            response['count'] = self.total
+            response['results'] = dict(data, total_pages=max(math.ceil(self.total / self.page_size), 1))
+        return Response(response)
@@ -0,0 +1,127 @@
+from datetime import timedelta
+from itertools import islice
+
+from paypal.helpers.client import get_paypal_client
+from user.models import TokenLedger
+from .models import CaptureResult, PaypalOrder
+from .services import fulfil_capture, fulfil_capture_result
+
+# The Transaction Search API answers at most 31 days per query
+REPORT_WINDOW = timedelta(days=31)
+
+OK = 'ok'
+MISSING = 'missing'
+REPAIRED = 'repaired'
+UNMATCHED = 'unmatched'
+
+
+def paypal_time(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S%z')
+
+
+def report_windows(start, end):
+    while start < end:
+        window_end = min(start + REPORT_WINDOW, end)
+        yield start, window_end
+        start = window_end
+
+
+def reported_payments(start, end, page_size=500):
+    """
+    `transaction_info` of every successful payment PayPal reports between
+    `start` and `end` (aware datetimes), fetched `page_size` at a time.
+    """
+    client = get_paypal_client()
+
+    for window_start, window_end in report_windows(start, end):
+        page = 1
+        while True:
+            response = client.get('/v1/reporting/transactions', params={
+                'start_date': paypal_time(window_start),
+                'end_date': paypal_time(window_end),
+                'transaction_status': 'S',
+                'fields': 'transaction_info',
+                'page_size': page_size,
+                'page': page,
+            })
+            response.raise_for_status()
+            data = response.json()
+
+            for detail in data.get('transaction_details', []):
+                info = detail.get('transaction_info', {})
+                # T00xx are payments received; refunds, fees, etc. use other codes
+                if info.get('transaction_id') and info.get('transaction_event_code', '').startswith('T00'):
+                    yield info
+
+            if page >= data.get('total_pages', 1):
+                break
+            page += 1
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def repair_capture(capture_id, result=None):
+    """
+    Fulfil a completed capture that didn't credit its buyer. Without a
+    stored (completed) result the capture is fetched from PayPal to find
+    its order. Returns whether it could be matched to an order of ours.
+    """
+    if result is not None and result.status == 'COMPLETED':
+        fulfil_capture_result(result)
+        return True
+
+    response = get_paypal_client().get(f'/v2/payments/captures/{capture_id}')
+    response.raise_for_status()
+    capture = response.json()
+
+    order_id = capture.get('supplementary_data', {}).get('related_ids', {}).get('order_id')
+    order = PaypalOrder.objects.select_related('user', 'product').filter(order_id=order_id).first()
+    if order is None:
+        return False
+
+    fulfil_capture(order, capture)
+    return True
+
+
+def reconcile_payments(payments, repair=False):
+    """
+    Compare one chunk of reported payments against what was fulfilled, in
+    two queries whatever the chunk size. A capture is fulfilled when its
+    purchase credit is in the ledger (the Purchase row is written in the
+    same transaction) or, for older orders, its CaptureResult says so.
+
+    Returns (capture_id, state) pairs, state being OK, MISSING, or with
+    `repair`, REPAIRED or UNMATCHED (not an order of this app).
+    """
+    capture_ids = [payment['transaction_id'] for payment in payments]
+
+    credited = set(TokenLedger.objects.filter(
+        reason=TokenLedger.PURCHASE, reference__in=capture_ids).values_list('reference', flat=True))
+    results = {result.capture_id: result
+               for result in CaptureResult.objects.select_related('user').filter(capture_id__in=capture_ids)}
+
+    states = []
+    for capture_id in capture_ids:
+        result = results.get(capture_id)
+        if capture_id in credited or (result is not None and result.fulfilled):
+            state = OK
+        elif not repair:
+            state = MISSING
+        else:
+            state = REPAIRED if repair_capture(capture_id, result) else UNMATCHED
+        states.append((capture_id, state))
+    return states
+
+
+def reconcile(start, end, repair=False, page_size=500, chunk_size=500):
+    """
+    Reconcile every payment PayPal reports between `start` and `end`,
+    holding at most `chunk_size` of them in memory. Yields the
+    (capture_id, state) pairs of `reconcile_payments`.
+    """
+    for payments in chunked(reported_payments(start, end, page_size), chunk_size):
+        yield from reconcile_payments(payments, repair)
@@ -1,6 +1,7 @@
 # serializers.py
 from rest_framework import serializers
 from .models import Purchase, PaypalProductModel
+from .catalog import product_catalog
 
 
 class PaypalProductModelSerializer(serializers.ModelSerializer):
@@ -56,7 +57,7 @@ class OrderSerializer(serializers.Serializer):
                 raise serializers.ValidationError(
                     f"Invalid value '{value}' for product '{product_id}'.")
 
-        product = PaypalProductModel.objects.filter(paypal_id_product=product_id).first()
+        product = product_catalog.get_by_paypal_id(product_id)
         if not product:
             raise serializers.ValidationError("Product doesn't exist.")
 
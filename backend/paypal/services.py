@@ -1,24 +1,35 @@
-from paypal.helpers.credentials import PaypalToken, clientID, clientSecret
-import requests
-from helpers.email import send_email
-from .models import Purchase, PaypalProductModel
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from helpers.work_queue import WorkQueue
+from paypal.helpers.client import get_paypal_client
+from paypal.helpers.async_client import get_async_paypal_client
+from mailing.services import enqueue_email
+from user.helpers.balance import credit_tokens
+from user.models import TokenLedger
+from .catalog import product_catalog
+from .models import (Purchase, PaypalProductModel, PaypalOrder, PaypalWebhookEvent, CaptureResult,
+                     UserSpend, ProductDailySales)
 
 
 # paypal custom order
 def get_product_from_cart(cart):
     product_id = cart[0]["id"]
-    product = PaypalProductModel.objects.get(paypal_id_product=product_id)
-    return product
+    return get_product(product_id)
 
 
-def create_paypal_order(user, product, value):
-    access_token = PaypalToken()
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {access_token}',
-    }
+def get_product(paypal_id):
+    product = product_catalog.get_by_paypal_id(paypal_id)
+    if product is None:
+        raise PaypalProductModel.DoesNotExist(f"Product {paypal_id} doesn't exist.")
+    return product
 
-    data = {
+
+def build_order_data(product, value):
+    return {
         "purchase_units": [
             {
                 "amount": {
@@ -47,37 +58,122 @@ def create_paypal_order(user, product, value):
         }
     }
 
-    response = requests.post(
-        "https://api.sandbox.paypal.com/v2/checkout/orders",
+
+def create_paypal_order(user, product, value):
+    headers = {
+        'Content-Type': 'application/json',
+    }
+
+    response = get_paypal_client().post(
+        "/v2/checkout/orders",
         headers=headers,
-        json=data
+        json=build_order_data(product, value)
     )
     response.raise_for_status()
 
-    return response.json()
+    order_data = response.json()
+    PaypalOrder.objects.create(
+        order_id=order_data['id'], user=user, product=product, value=value)
+    return order_data
 
 
 # capture order
+def capture_headers(order_id):
+    # PayPal answers a repeated PayPal-Request-Id with the original result
+    # instead of capturing again, which also makes the call safe to retry
+    return {
+        "Content-Type": "application/json",
+        "PayPal-Request-Id": f"CAPTURE-{order_id}",
+    }
+
+
 def capture_paypal_payment(order_id):
 
-    token = PaypalToken()
-    capture_url = f"https://api.sandbox.paypal.com/v2/checkout/orders/{order_id}/capture"
-    headers = {"Content-Type": "application/json",
-               "Authorization": "Bearer " + token}
+    capture_url = f"/v2/checkout/orders/{order_id}/capture"
 
-    response = requests.post(capture_url, headers=headers)
+    response = get_paypal_client().post(
+        capture_url, headers=capture_headers(order_id))
     response.raise_for_status()
     return response.json()
 
 
+async def create_paypal_order_async(user, product, value):
+    order_data = await get_async_paypal_client().post(
+        "/v2/checkout/orders",
+        json=build_order_data(product, value)
+    )
+    await PaypalOrder.objects.acreate(
+        order_id=order_data['id'], user=user, product=product, value=value)
+    return order_data
+
+
+async def capture_paypal_payment_async(order_id):
+    capture_url = f"/v2/checkout/orders/{order_id}/capture"
+
+    return await get_async_paypal_client().post(capture_url, headers=capture_headers(order_id))
+
+
+def get_capture_result(order_id):
+    return CaptureResult.objects.filter(order_id=order_id).first()
+
+
+def is_order_of(user, order_id):
+    return PaypalOrder.objects.filter(order_id=order_id, user=user).exists()
+
+
+def record_capture(user, order_id, capture_response):
+    """
+    Store the capture of `order_id` (once). A later COMPLETED answer
+    replaces a stored non final one, e.g. a PENDING capture that cleared.
+    """
+    captures = capture_response['purchase_units'][0].get('payments', {}).get('captures') or [{}]
+    fields = {
+        'capture_id': captures[0].get('id', ''),
+        'status': capture_response.get('status', ''),
+        'response': capture_response,
+    }
+
+    result, created = CaptureResult.objects.get_or_create(
+        order_id=order_id, defaults=dict(fields, user=user))
+
+    if not created and result.status != 'COMPLETED' and fields['status'] == 'COMPLETED':
+        CaptureResult.objects.filter(pk=result.pk).update(**fields)
+        result.refresh_from_db()
+    return result
+
+
+def fulfil_capture_result(result):
+    """
+    Credit tokens and create the purchase for a completed capture exactly
+    once. The `fulfilled` flag is claimed with a conditional UPDATE in the
+    same transaction, so concurrent retries can't both credit.
+    Returns whether this call did the work.
+    """
+    if result.status != 'COMPLETED' or result.fulfilled:
+        return False
+
+    with transaction.atomic():
+        claimed = CaptureResult.objects.filter(
+            pk=result.pk, fulfilled=False).update(fulfilled=True)
+        if not claimed:
+            return False
+
+        process_completed_payment(result.user, result.response)
+        create_purchase_record(result.user, result.response)
+
+    result.fulfilled = True
+    return True
+
+
 def process_completed_payment(user, capture_response):
     purchase_units = capture_response.get('purchase_units')
     reference_id = purchase_units[0].get('reference_id')
 
     if reference_id == 'CUSTOM':
         num_tokens = calculate_tokens(capture_response)
-        user = add_tokens_to_user(user, num_tokens)
-        send_email("buy_custom", user.email, context={
+        capture_id = purchase_units[0]['payments']['captures'][0].get('id', '')
+        user = add_tokens_to_user(user, num_tokens, reference=capture_id)
+        enqueue_email("buy_custom", user.email, context={
             "tokens": int(float(num_tokens))})
 
 
@@ -87,9 +183,8 @@ def calculate_tokens(capture_response):
     return int(float(amount_value))  # Assuming 1 token = $1
 
 
-def add_tokens_to_user(user, num_tokens):
-    user.tokens += num_tokens
-    user.save()
+def add_tokens_to_user(user, num_tokens, reference=''):
+    credit_tokens(user, num_tokens, reason=TokenLedger.PURCHASE, reference=reference)
     return user
 
 
@@ -98,6 +193,142 @@ def create_purchase_record(user, capture_response):
     custom_id = purchase_units[0]['payments']['captures'][0]['custom_id']
     amount_value = purchase_units[0]['payments']['captures'][0]['amount']['value']
 
-    product = PaypalProductModel.objects.get(paypal_id_product=custom_id)
-    purchase = Purchase(user=user, product=product, price=amount_value)
-    purchase.save()
+    product = get_product(custom_id)
+    return record_purchase(user, product, amount_value)
+
+
+def _increment_or_create(model, lookup, increments, defaults):
+    """
+    Add `increments` (F() expressions) to the row matching `lookup`, or
+    create it from `defaults` when it doesn't exist yet.
+    """
+    if model.objects.filter(**lookup).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **defaults)
+    except IntegrityError:
+        # Created by a concurrent purchase in the meantime
+        model.objects.filter(**lookup).update(**increments)
+
+
+def record_purchase(user, product, price):
+    """
+    Create a Purchase and fold it into UserSpend and ProductDailySales in
+    the same transaction, so totals never drift from the rows.
+    """
+    with transaction.atomic():
+        purchase = Purchase.objects.create(user=user, product=product, price=price)
+        amount = purchase.amount or 0
+        purchased_at = purchase.purchased_date
+
+        _increment_or_create(
+            UserSpend, {'user': user},
+            increments={
+                'total_spent': F('total_spent') + amount,
+                'purchase_count': F('purchase_count') + 1,
+                'last_purchase_at': Greatest(Coalesce(F('last_purchase_at'), purchased_at), purchased_at),
+            },
+            defaults={'total_spent': amount, 'purchase_count': 1, 'last_purchase_at': purchased_at},
+        )
+        _increment_or_create(
+            ProductDailySales, {'product': product, 'day': timezone.localdate(purchased_at)},
+            increments={
+                'total_amount': F('total_amount') + amount,
+                'purchase_count': F('purchase_count') + 1,
+            },
+            defaults={'total_amount': amount, 'purchase_count': 1},
+        )
+    return purchase
+
+
+def get_user_spend(user):
+    """
+    Total spent, purchase count and last purchase date of `user` (a single
+    primary key lookup). Users without purchases get an unsaved zero row.
+    """
+    return UserSpend.objects.filter(user=user).first() or UserSpend(user=user)
+
+
+# webhooks
+def record_webhook_event(event):
+    """
+    Persist a verified webhook delivery. PayPal retries deliveries until it
+    gets a 2xx, so a repeated event id is stored only once.
+    Returns whether the event is new.
+    """
+    _, created = PaypalWebhookEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={
+            'event_type': event.get('event_type', ''),
+            'resource': event.get('resource') or {},
+        },
+    )
+    return created
+
+
+webhook_queue = WorkQueue(PaypalWebhookEvent, PaypalWebhookEvent.PROCESSING)
+
+
+def claim_webhook_batch(batch_size):
+    """
+    Claim up to `batch_size` due events, reclaiming the ones held by a
+    worker whose lease has expired.
+    """
+    return webhook_queue.claim(batch_size, settings.PAYPAL_WEBHOOK_LEASE)
+
+
+def schedule_webhook_retry(event, error):
+    webhook_queue.retry(event, error, settings.PAYPAL_WEBHOOK_MAX_ATTEMPTS, settings.PAYPAL_WEBHOOK_BACKOFF)
+
+
+def capture_order_id(capture):
+    return capture.get('supplementary_data', {}).get('related_ids', {}).get('order_id')
+
+
+def fulfil_capture(order, capture):
+    """
+    Credit the buyer of `order` for a completed `capture` resource, unless
+    `capture_order` already did.
+    """
+    capture_response = {
+        'id': order.order_id,
+        'status': 'COMPLETED',
+        'purchase_units': [{
+            'reference_id': order.reference_id,
+            'payments': {'captures': [capture]},
+        }],
+    }
+    result = record_capture(order.user, order.order_id, capture_response)
+    return fulfil_capture_result(result)
+
+
+def process_webhook_batch(batch_size=50):
+    """
+    Fulfil one batch of PAYMENT.CAPTURE.COMPLETED events.
+    Returns the number of events claimed.
+    """
+    events = claim_webhook_batch(batch_size)
+    if not events:
+        return 0
+
+    orders = PaypalOrder.objects.select_related('user', 'product').in_bulk(
+        [capture_order_id(event.resource) for event in events], field_name='order_id')
+
+    processed = []
+    for event in events:
+        order = orders.get(capture_order_id(event.resource))
+        try:
+            if order is None:
+                raise PaypalOrder.DoesNotExist(
+                    f"No order for capture {event.resource.get('id')}")
+            with transaction.atomic():
+                fulfil_capture(order, event.resource)
+            processed.append(event.id)
+        except Exception as e:
+            schedule_webhook_retry(event, e)
+
+    PaypalWebhookEvent.objects.filter(id__in=processed).update(
+        status=PaypalWebhookEvent.PROCESSED, processed_at=timezone.now(), claimed_at=None)
+
+    return len(events)
@@ -0,0 +1,94 @@
+import base64
+from unittest import mock
+
+import rsa
+from pyasn1.codec.der import encoder
+from pyasn1.type import char, univ, useful
+from pyasn1_modules import rfc3279, rfc4055, rfc5280
+
+from benchmarks.fake_paypal import FakePaypalServer
+from ..helpers.client import PaypalClient
+from ..helpers.credentials import token_cache
+
+
+class FakePaypalMixin:
+    """
+    Runs the test case against a local FakePaypalServer (self.paypal)
+    instead of the PayPal sandbox.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.paypal = FakePaypalServer().__enter__()
+        cls.addClassCleanup(cls.paypal.__exit__, None, None, None)
+
+    def setUp(self):
+        super().setUp()
+        client = PaypalClient(self.paypal.url, client_id="test", client_secret="test", backoff_factor=0)
+        patcher = mock.patch('paypal.helpers.client._client', client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(client.session.close)
+
+        token_cache.invalidate()
+        self.addCleanup(token_cache.invalidate)
+
+
+def _name(common_name):
+    attribute = rfc5280.AttributeTypeAndValue()
+    attribute['type'] = rfc5280.id_at_commonName
+    attribute['value'] = encoder.encode(char.UTF8String(common_name))
+    rdn = rfc5280.RelativeDistinguishedName()
+    rdn.append(attribute)
+    name = rfc5280.Name()
+    name['rdnSequence'].append(rdn)
+    return name
+
+
+def make_certificate(common_name, public_key, issuer_name, issuer_key, not_before, not_after, ca=False,
+                     path_len=None, key_usage=None):
+    """
+    PEM of a SHA256withRSA X.509 certificate for `public_key`, signed with
+    `issuer_key`. `key_usage` is a list of KeyUsage bit names.
+    """
+    algorithm = rfc5280.AlgorithmIdentifier()
+    algorithm['algorithm'] = rfc4055.sha256WithRSAEncryption
+    algorithm['parameters'] = encoder.encode(univ.Null(''))
+
+    tbs = rfc5280.TBSCertificate()
+    tbs['version'] = 'v3'
+    tbs['serialNumber'] = 1
+    tbs['signature'] = algorithm
+    tbs['issuer'] = _name(issuer_name)
+    tbs['validity']['notBefore']['utcTime'] = useful.UTCTime.fromDateTime(not_before)
+    tbs['validity']['notAfter']['utcTime'] = useful.UTCTime.fromDateTime(not_after)
+    tbs['subject'] = _name(common_name)
+    tbs['subjectPublicKeyInfo']['algorithm']['algorithm'] = rfc3279.rsaEncryption
+    tbs['subjectPublicKeyInfo']['algorithm']['parameters'] = encoder.encode(univ.Null(''))
+    tbs['subjectPublicKeyInfo']['subjectPublicKey'] = univ.BitString.fromOctetString(
+        public_key.save_pkcs1('DER'))
+    if ca:
+        constraints = rfc5280.BasicConstraints()
+        constraints['cA'] = True
+        if path_len is not None:
+            constraints['pathLenConstraint'] = path_len
+        extension = rfc5280.Extension()
+        extension['extnID'] = rfc5280.id_ce_basicConstraints
+        extension['critical'] = True
+        extension['extnValue'] = encoder.encode(constraints)
+        tbs['extensions'].append(extension)
+    if key_usage is not None:
+        extension = rfc5280.Extension()
+        extension['extnID'] = rfc5280.id_ce_keyUsage
+        extension['critical'] = True
+        extension['extnValue'] = encoder.encode(rfc5280.KeyUsage(",".join(key_usage)))
+        tbs['extensions'].append(extension)
+
+    cert = rfc5280.Certificate()
+    cert['tbsCertificate'] = tbs
+    cert['signatureAlgorithm'] = algorithm
+    cert['signature'] = univ.BitString.fromOctetString(
+        rsa.sign(encoder.encode(tbs), issuer_key, 'SHA-256'))
+    return ("-----BEGIN CERTIFICATE-----\n" + base64.encodebytes(encoder.encode(cert)).decode()
+            + "-----END CERTIFICATE-----\n")
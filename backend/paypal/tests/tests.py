@@ -1,7 +1,42 @@
+import base64
+from io import StringIO
+import csv
+from datetime import timedelta
+from decimal import Decimal
+import json
+import time
+import gzip
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+import rsa
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
 from django.urls import reverse
 from rest_framework import status
-from ..models import PaypalProductModel, Purchase
+from ..models import PaypalProductModel, Purchase, PaypalOrder, PaypalWebhookEvent, CaptureResult, UserSpend, ProductDailySales
+from ..helpers.client import PaypalClient, get_paypal_client
+from ..helpers.credentials import PaypalTokenCache, token_cache
+from ..helpers.webhooks import PaypalCertCache, webhook_certs
+from ..services import (process_webhook_batch, capture_paypal_payment, record_purchase, get_user_spend,
+                        create_paypal_order, record_capture, fulfil_capture_result)
+from ..reconciliation import reconcile, MISSING, OK, REPAIRED, UNMATCHED
+from ..helpers.products import sync_products_batch, start_product_sync
+from ..catalog import ProductCatalog, product_catalog
+from ..checks import check_catalog_cache
+from ..serializers import OrderSerializer
+from mailing.models import EmailOutbox
+from user.models import CustomUser
 from user.tests.setup import SetUpAuthUser
+from user.helpers.balance import get_balance
+from .setup import FakePaypalMixin, make_certificate
 from faker import Faker
 from dotenv import load_dotenv
 import ipdb
@@ -9,12 +44,12 @@ import os
 
 load_dotenv()
 
-PRODUCT_ID = os.environ.get('PAYPAL_PRODUCT_ID_TEST')
+PRODUCT_ID = os.environ.get('PAYPAL_PRODUCT_ID_TEST', 'PROD-TEST')
 
 fake = Faker()
 
 
-class TestCreateOrder(SetUpAuthUser):
+class TestCreateOrder(FakePaypalMixin, SetUpAuthUser):
     
     def setUp(self):
         super().setUp()
@@ -65,6 +100,155 @@ class TestCreateOrder(SetUpAuthUser):
         self.assertEqual(response.data.get("msg"), f"Invalid field 'Cart': Invalid value 'INVALID' for product '{self.product.paypal_id_product}'.")
 
 
+class TestCheckoutFlow(FakePaypalMixin, SetUpAuthUser):
+
+    def setUp(self):
+        super().setUp()
+        self.headers = {'Authorization': f'Bearer {self.token}'}
+        self.product = PaypalProductModel.objects.create(name="Test1", description="Test1", home_url="https://example.com", user=self.user, paypal_id_product=PRODUCT_ID)
+
+    def checkout(self):
+        response = self.client.post(reverse('create_order'), headers=self.headers, format='json',
+                                    data={'cart': [{'id': PRODUCT_ID, 'value': '10'}]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return self.client.post(reverse('capture_order'), headers=self.headers, format='json',
+                                data={'orderID': response.data['id']})
+
+    def test_create_and_capture(self):
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(get_balance(self.user), 10)
+        self.assertEqual(Purchase.objects.get().amount, Decimal("10.00"))
+
+    def test_capture_is_retried_on_server_error(self):
+        self.paypal.fail_next(503, count=2, path="/v2/checkout/orders/")
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(CaptureResult.objects.get().status, "COMPLETED")
+
+    def test_create_order_is_retried_once(self):
+        self.paypal.fail_next(503, path="/v2/checkout/orders")
+        orders = len(self.paypal.orders)
+
+        response = self.client.post(reverse('create_order'), headers=self.headers, format='json',
+                                    data={'cart': [{'id': PRODUCT_ID, 'value': '10'}]})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.paypal.orders), orders + 1)
+        self.assertEqual(PaypalOrder.objects.count(), 1)
+
+
+class TestCreateOrderAsync(SetUpAuthUser):
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('create_order_async')
+        self.headers = {'Authorization': f'Bearer {self.token}'}
+
+    def test_create_order_async_unauthenticated(self):
+        response = self.client.post(self.url, data={'cart': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_create_order_async_unverified_user(self):
+        self.user.verified = False
+        self.user.save()
+
+        response = self.client.post(self.url, headers=self.headers, data={'cart': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.json().get("msg"), "User account must be verified to make this action.")
+
+    def test_create_order_async_empty_cart(self):
+        response = self.client.post(self.url, headers=self.headers, data={'cart': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json().get("msg"), "Invalid field 'Cart': Cart cannot be empty.")
+
+
+class TestCaptureOrder(SetUpAuthUser):
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('capture_order')
+        self.headers = {'Authorization': f'Bearer {self.token}'}
+        self.product = PaypalProductModel.objects.create(name="Test1", description="Test1", home_url="https://example.com", user=self.user, paypal_id_product="PROD-TEST")
+        PaypalOrder.objects.create(order_id="ORDER-1", user=self.user, product=self.product, value="10")
+        self.capture_response = {
+            "id": "ORDER-1",
+            "status": "COMPLETED",
+            "purchase_units": [{
+                "reference_id": "CUSTOM",
+                "payments": {"captures": [{
+                    "id": "CAPTURE-1",
+                    "status": "COMPLETED",
+                    "amount": {"currency_code": "USD", "value": "10.00"},
+                    "custom_id": "PROD-TEST",
+                }]},
+            }],
+        }
+
+    def capture(self):
+        return self.client.post(self.url, headers=self.headers, data={'orderID': 'ORDER-1'}, format='json')
+
+    def test_capture_order_success(self):
+        with mock.patch('paypal.views.capture_paypal_payment', return_value=self.capture_response):
+            response = self.capture()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(get_balance(self.user), 10)
+        self.assertEqual(Purchase.objects.get().price, "10.00")
+        result = CaptureResult.objects.get()
+        self.assertEqual(result.capture_id, "CAPTURE-1")
+        self.assertTrue(result.fulfilled)
+
+    def test_repeated_capture_is_answered_from_store(self):
+        with mock.patch('paypal.views.capture_paypal_payment', return_value=self.capture_response) as capture:
+            self.capture()
+            response = self.capture()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(capture.call_count, 1)
+        self.assertEqual(get_balance(self.user), 10)
+        self.assertEqual(Purchase.objects.count(), 1)
+
+    def test_failed_fulfilment_is_completed_on_retry(self):
+        with mock.patch('paypal.views.capture_paypal_payment', return_value=self.capture_response) as capture:
+            with mock.patch('paypal.services.create_purchase_record', side_effect=Exception("Database is locked")):
+                response = self.capture()
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(get_balance(self.user), 0)
+
+            response = self.capture()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(capture.call_count, 1)
+        self.assertEqual(get_balance(self.user), 10)
+        self.assertTrue(CaptureResult.objects.get().fulfilled)
+
+    def test_capture_order_of_other_user(self):
+        other = CustomUser.objects.create_user(email="other@example.com", password="Other1234", verified=True)
+        PaypalOrder.objects.filter(order_id="ORDER-1").update(user=other)
+
+        with mock.patch('paypal.views.capture_paypal_payment', return_value=self.capture_response) as capture:
+            response = self.capture()
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(capture.call_count, 0)
+        self.assertEqual(get_balance(self.user), 0)
+
+    def test_capture_sends_request_id(self):
+        response = requests.Response()
+        response.status_code = 201
+        response._content = json.dumps(self.capture_response).encode()
+
+        with mock.patch('paypal.services.get_paypal_client') as client:
+            client.return_value.post.return_value = response
+            capture_paypal_payment("ORDER-1")
+
+        self.assertEqual(client.return_value.post.call_args.kwargs['headers']['PayPal-Request-Id'], "CAPTURE-ORDER-1")
+
+
 class TestPurchases(SetUpAuthUser):
     def setUp(self):
         super().setUp()
@@ -78,12 +262,40 @@ class TestPurchases(SetUpAuthUser):
         
  
     def test_purchases_ok(self):
-        response = self.client.get(self.url, headers=self.headers)
+        response = self.client.get(self.url, {'include_total': 'true'}, headers=self.headers)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data.get('count'), 1)
         self.assertEqual(response.data["results"]['total_pages'], 1)
         self.assertEqual(response.data['results']['user_purchases'][0]['product']['name'], 'Test1')
 
+    def test_purchases_without_total(self):
+        response = self.client.get(self.url, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertNotIn('total_pages', response.data['results'])
+        self.assertIsNone(response.data['next'])
+
+    def test_purchases_cursor_pages(self):
+        Purchase.objects.bulk_create(
+            Purchase(user=self.user, product=self.product, price=i) for i in range(11))
+
+        ids, url, params = [], self.url, {'page_size': 5}
+        while url:
+            with self.assertNumQueries(1):  # one page query, the user comes from the token
+                response = self.client.get(url, params, headers=self.headers)
+            ids += [purchase['id'] for purchase in response.data['results']['user_purchases']]
+            url, params = response.data['next'], None
+
+        expected = list(Purchase.objects.filter(user=self.user).order_by('-purchased_date', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_purchases_page_size_is_capped(self):
+        Purchase.objects.bulk_create(
+            Purchase(user=self.user, product=self.product, price=i) for i in range(60))
+
+        response = self.client.get(self.url, {'page_size': 1000}, headers=self.headers)
+        self.assertEqual(len(response.data['results']['user_purchases']), 50)
+
     def test_purchases_unverified_user(self):
         self.user.verified = False
         self.user.save()
@@ -93,3 +305,588 @@ class TestPurchases(SetUpAuthUser):
         self.assertEqual(response.data.get("msg"), "User account must be verified to make this action.")
 
 
+    def export(self, file_format, params=None, headers=None):
+        response = self.client.get(reverse('export_purchases', args=[file_format]), params,
+                                   headers={**self.headers, **(headers or {})})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content)
+
+    def test_export_csv(self):
+        other = CustomUser.objects.create_user(email="other@example.com", password="Other1234")
+        Purchase.objects.create(user=other, product=self.product, price=5)
+        Purchase.objects.bulk_create(
+            Purchase(user=self.user, product=self.product, price=i) for i in range(3))
+
+        response, content = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(content.decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'purchased_date', 'product', 'price', 'amount'])
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row[2] for row in rows[1:]}, {'Test1'})
+        self.assertEqual([int(row[0]) for row in rows[1:]], list(
+            Purchase.objects.filter(user=self.user).order_by('-purchased_date', '-id').values_list('id', flat=True)))
+
+    def test_export_jsonl_gzip(self):
+        response, content = self.export('jsonl', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        lines = gzip.decompress(content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual(row['id'], self.purchase.id)
+        self.assertEqual(row['product'], 'Test1')
+        self.assertEqual(row['amount'], '9.99')
+
+    def test_export_all_is_staff_only(self):
+        other = CustomUser.objects.create_user(email="other@example.com", password="Other1234")
+        Purchase.objects.create(user=other, product=self.product, price=5)
+
+        response, content = self.export('csv', {'all': 'true'})
+        self.assertEqual(len(content.decode().splitlines()), 3)
+        self.assertIn('other@example.com', content.decode())
+
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get(reverse('export_purchases', args=['csv']), {'all': 'true'}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_unsupported_format(self):
+        response = self.client.get(reverse('export_purchases', args=['xml']), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestPaypalTokenCache(SimpleTestCase):
+
+    def setUp(self):
+        self.fetches = 0
+        cache.clear()
+
+    def fetch(self):
+        self.fetches += 1
+        time.sleep(0.05)
+        return f"TOKEN-{self.fetches}", 32400
+
+    def test_token_is_reused_until_expiry(self):
+        cache = PaypalTokenCache(refresh_margin=300)
+
+        self.assertEqual(cache.get(self.fetch), "TOKEN-1")
+        self.assertEqual(cache.get(self.fetch), "TOKEN-1")
+        self.assertEqual(self.fetches, 1)
+
+        cache._expires_at = time.time() + 299
+        self.assertEqual(cache.get(self.fetch), "TOKEN-2")
+
+    def test_concurrent_refreshes_are_coalesced(self):
+        cache = PaypalTokenCache()
+
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            tokens = list(executor.map(lambda _: cache.get(self.fetch), range(10)))
+
+        self.assertEqual(set(tokens), {"TOKEN-1"})
+        self.assertEqual(self.fetches, 1)
+
+    def test_invalidate_forces_refresh(self):
+        cache = PaypalTokenCache(shared_cache='default')
+        token = cache.get(self.fetch)
+
+        cache.invalidate(token)
+
+        self.assertEqual(cache.get(self.fetch), "TOKEN-2")
+
+    def test_token_is_shared_between_processes(self):
+        PaypalTokenCache(shared_cache='default').get(self.fetch)
+
+        self.assertEqual(PaypalTokenCache(shared_cache='default').get(self.fetch), "TOKEN-1")
+        self.assertEqual(self.fetches, 1)
+
+    def test_other_process_lock_is_kept(self):
+        # Another process is refreshing and doesn't publish in time
+        cache.add(PaypalTokenCache.LOCK_KEY, "other", timeout=10)
+
+        with mock.patch("paypal.helpers.credentials.time.sleep"):
+            self.assertEqual(PaypalTokenCache(shared_cache='default').get(self.fetch), "TOKEN-1")
+        self.assertEqual(cache.get(PaypalTokenCache.LOCK_KEY), "other")
+
+
+class TestPaypalClient(SimpleTestCase):
+
+    def setUp(self):
+        self.client = PaypalClient("http://paypal.test", max_retries=2, backoff_factor=0)
+        token_cache.store("TOKEN", 32400)
+
+    def tearDown(self):
+        token_cache.invalidate()
+
+    def respond(self, *status_codes):
+        responses = []
+        for status_code in status_codes:
+            response = requests.Response()
+            response.status_code = status_code
+            responses.append(response)
+        return mock.patch.object(self.client.session, 'request', side_effect=responses)
+
+    def test_post_carries_a_request_id(self):
+        with self.respond(201, 201) as request:
+            self.client.post("/v2/checkout/orders")
+            self.client.post("/v2/checkout/orders", headers={'PayPal-Request-Id': "ORDER-1"})
+
+        request_ids = [call.kwargs['headers']['PayPal-Request-Id'] for call in request.call_args_list]
+        self.assertTrue(request_ids[0])
+        self.assertEqual(request_ids[1], "ORDER-1")
+
+    def test_unauthorized_invalidates_token(self):
+        with self.respond(401, 201) as request, \
+                mock.patch('paypal.helpers.credentials._request_token', return_value=("NEW", 32400)):
+            response = self.client.post("/v2/checkout/orders")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(request.call_args.kwargs['headers']['Authorization'], "Bearer NEW")
+        self.assertEqual(request.call_args.kwargs['timeout'], self.client.timeout)
+
+
+@override_settings(PAYPAL_WEBHOOK_ID="WH-TEST")
+class TestPaypalWebhook(SetUpAuthUser):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.public_key, cls.private_key = rsa.newkeys(1024)
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('paypal_webhook')
+        self.product = PaypalProductModel.objects.create(name="Test1", description="Test1", home_url="https://example.com", user=self.user, paypal_id_product="PROD-TEST")
+        PaypalOrder.objects.create(order_id="ORDER-1", user=self.user, product=self.product, value="10")
+
+        certs = mock.patch.object(webhook_certs, 'get', return_value=self.public_key)
+        certs.start()
+        self.addCleanup(certs.stop)
+
+    def event(self, event_id="WH-EVENT-1", order_id="ORDER-1"):
+        return {
+            "id": event_id,
+            "event_type": "PAYMENT.CAPTURE.COMPLETED",
+            "resource": {
+                "id": "CAPTURE-1",
+                "status": "COMPLETED",
+                "amount": {"currency_code": "USD", "value": "10.00"},
+                "custom_id": "PROD-TEST",
+                "supplementary_data": {"related_ids": {"order_id": order_id}},
+            },
+        }
+
+    def deliver(self, event, webhook_id="WH-TEST", sent_at=None):
+        body = json.dumps(event).encode()
+        transmission_time = (sent_at or timezone.now()).strftime('%Y-%m-%dT%H:%M:%SZ')
+        message = f"TRANSMISSION-1|{transmission_time}|{webhook_id}|{zlib.crc32(body)}"
+        signature = base64.b64encode(rsa.sign(message.encode(), self.private_key, 'SHA-256')).decode()
+        headers = {
+            'PAYPAL-TRANSMISSION-ID': 'TRANSMISSION-1',
+            'PAYPAL-TRANSMISSION-TIME': transmission_time,
+            'PAYPAL-TRANSMISSION-SIG': signature,
+            'PAYPAL-CERT-URL': 'https://api.sandbox.paypal.com/v1/notifications/certs/CERT-1',
+            'PAYPAL-AUTH-ALGO': 'SHA256withRSA',
+        }
+        return self.client.post(self.url, data=body, content_type='application/json', headers=headers)
+
+    def test_webhook_stores_event(self):
+        response = self.deliver(self.event())
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(PaypalWebhookEvent.objects.get().status, PaypalWebhookEvent.PENDING)
+        self.assertEqual(get_balance(self.user), 0)
+
+    def test_webhook_invalid_signature(self):
+        response = self.deliver(self.event(), webhook_id="WH-OTHER")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PaypalWebhookEvent.objects.exists())
+
+    def test_webhook_stale_transmission_time(self):
+        response = self.deliver(self.event(), sent_at=timezone.now() - timedelta(minutes=10))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PaypalWebhookEvent.objects.exists())
+
+    def test_webhook_redelivery_is_stored_once(self):
+        self.deliver(self.event())
+        self.deliver(self.event())
+
+        self.assertEqual(PaypalWebhookEvent.objects.count(), 1)
+
+    def test_worker_fulfils_captures(self):
+        self.deliver(self.event())
+
+        self.assertEqual(process_webhook_batch(), 1)
+
+        self.assertEqual(get_balance(self.user), 10)
+        self.assertEqual(Purchase.objects.get().price, "10.00")
+        self.assertEqual(EmailOutbox.objects.get().email_format, "buy_custom")
+        self.assertEqual(PaypalWebhookEvent.objects.get().status, PaypalWebhookEvent.PROCESSED)
+        self.assertEqual(process_webhook_batch(), 0)
+
+    def test_worker_skips_orders_fulfilled_inline(self):
+        with override_settings(PAYPAL_WEBHOOK_ID=None), \
+                mock.patch('paypal.views.capture_paypal_payment', return_value={
+                    "id": "ORDER-1", "status": "COMPLETED",
+                    "purchase_units": [{"reference_id": "CUSTOM", "payments": {
+                        "captures": [self.event()["resource"]]}}]}):
+            self.client.post(reverse('capture_order'), data={'orderID': 'ORDER-1'}, format='json',
+                             headers={'Authorization': f'Bearer {self.token}'})
+        self.deliver(self.event())
+
+        process_webhook_batch()
+
+        self.assertEqual(get_balance(self.user), 10)
+        self.assertEqual(Purchase.objects.count(), 1)
+        self.assertEqual(PaypalWebhookEvent.objects.get().status, PaypalWebhookEvent.PROCESSED)
+
+    def test_worker_retries_unknown_order(self):
+        self.deliver(self.event(order_id="ORDER-UNKNOWN"))
+
+        process_webhook_batch()
+
+        event = PaypalWebhookEvent.objects.get()
+        self.assertEqual(event.status, PaypalWebhookEvent.PENDING)
+        self.assertEqual(event.attempts, 1)
+        self.assertFalse(Purchase.objects.exists())
+
+    def test_cert_url_must_be_paypal(self):
+        self.assertTrue(PaypalCertCache.is_paypal_url("https://api.paypal.com/v1/notifications/certs/CERT-1"))
+        self.assertFalse(PaypalCertCache.is_paypal_url("http://api.paypal.com/certs"))
+        self.assertFalse(PaypalCertCache.is_paypal_url("https://paypal.com.evil.test/certs"))
+
+
+class FakeCertSession:
+    """Serves a certificate bundle like PAYPAL-CERT-URL, counting the downloads."""
+
+    def __init__(self, pem):
+        self.pem = pem
+        self.fetches = 0
+
+    def get(self, url, timeout=None):
+        self.fetches += 1
+        response = requests.Response()
+        response.status_code = 200
+        response._content = self.pem.encode()
+        return response
+
+
+class TestPaypalClientRetries(FakePaypalMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        token_cache.store("TOKEN", 32400)
+        self.client = get_paypal_client()
+
+    def post(self):
+        requests_before = self.paypal.requests
+        response = self.client.post("/v1/catalogs/products", json={"name": "Retried"})
+        return response, self.paypal.requests - requests_before
+
+    def test_failed_post_is_retried_once(self):
+        self.paypal.fail_next(503, count=2, path="/v1/catalogs/products")
+
+        response, requests_sent = self.post()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(requests_sent, 3)
+        self.assertEqual(len(self.paypal.products), 1)
+
+    def test_retries_are_not_multiplied(self):
+        self.paypal.fail_next(503, count=100, path="/v1/catalogs/products")
+
+        response, requests_sent = self.post()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(requests_sent, settings.PAYPAL_MAX_RETRIES + 1)
+
+
+class TestPaypalCertCache(SimpleTestCase):
+    url = "https://api.paypal.com/v1/notifications/certs/CERT-1"
+    subject = "messageverificationcerts.paypal.com"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root_public, cls.root_private = rsa.newkeys(1024)
+        cls.ca_public, cls.ca_private = rsa.newkeys(1024)
+        cls.public_key, cls.private_key = rsa.newkeys(1024)
+
+    def setUp(self):
+        now = timezone.now()
+        self.valid = (now - timedelta(days=1), now + timedelta(days=30))
+
+        bundle = tempfile.NamedTemporaryFile('w', suffix='.pem', delete=False)
+        bundle.write(make_certificate("Test Root", self.root_public, "Test Root", self.root_private,
+                                      *self.valid, ca=True))
+        bundle.close()
+        self.addCleanup(os.unlink, bundle.name)
+        self.ca_bundle = bundle.name
+
+    def chain(self, subject=None, validity=None, ca=True, ca_usage=('keyCertSign', 'cRLSign'),
+              leaf_usage=('digitalSignature',)):
+        leaf = make_certificate(subject or self.subject, self.public_key, "Test CA", self.ca_private,
+                                *(validity or self.valid), key_usage=leaf_usage)
+        intermediate = make_certificate("Test CA", self.ca_public, "Test Root", self.root_private,
+                                        *self.valid, ca=ca, key_usage=ca_usage)
+        return leaf + intermediate
+
+    def get(self, pem):
+        certs = PaypalCertCache(3600, subjects=[self.subject], ca_bundle=self.ca_bundle,
+                                session=FakeCertSession(pem))
+        return certs, certs.get(self.url)
+
+    def test_trusted_chain_is_cached(self):
+        certs, public_key = self.get(self.chain())
+        signature = rsa.sign(b"message", self.private_key, 'SHA-256')
+
+        self.assertEqual(rsa.verify(b"message", signature, public_key), 'SHA-256')
+        self.assertIs(certs.get(self.url), public_key)
+        self.assertEqual(certs.session.fetches, 1)
+
+    def test_expired_certificate(self):
+        now = timezone.now()
+        with self.assertRaises(ValueError):
+            self.get(self.chain(validity=(now - timedelta(days=30), now - timedelta(days=1))))
+
+    def test_other_subject(self):
+        with self.assertRaises(ValueError):
+            self.get(self.chain(subject="evil.example.com"))
+
+    def test_issuer_must_be_a_ca(self):
+        with self.assertRaises(ValueError):
+            self.get(self.chain(ca=False))
+
+    def test_issuer_must_be_allowed_to_sign_certificates(self):
+        with self.assertRaises(ValueError):
+            self.get(self.chain(ca_usage=('digitalSignature',)))
+
+    def test_leaf_must_be_allowed_to_sign(self):
+        with self.assertRaises(ValueError):
+            self.get(self.chain(leaf_usage=('keyEncipherment',)))
+
+    def test_path_length_constraint(self):
+        other_public, other_private = rsa.newkeys(1024)
+        leaf = make_certificate(self.subject, self.public_key, "Test Sub CA", other_private, *self.valid)
+        sub_ca = make_certificate("Test Sub CA", other_public, "Test CA", self.ca_private, *self.valid, ca=True)
+
+        for path_len, valid in ((0, False), (1, True)):
+            intermediate = make_certificate("Test CA", self.ca_public, "Test Root", self.root_private,
+                                            *self.valid, ca=True, path_len=path_len)
+            with self.subTest(path_len=path_len):
+                if valid:
+                    self.get(leaf + sub_ca + intermediate)
+                else:
+                    with self.assertRaises(ValueError):
+                        self.get(leaf + sub_ca + intermediate)
+
+    def test_untrusted_root(self):
+        other_public, other_private = rsa.newkeys(1024)
+        leaf = make_certificate(self.subject, self.public_key, "Test Root", other_private, *self.valid)
+
+        with self.assertRaises(ValueError):
+            self.get(leaf)
+
+
+class TestProductCatalog(SetUpAuthUser):
+
+    def setUp(self):
+        super().setUp()
+        self.product = PaypalProductModel.objects.create(name="Test1", description="Test1", home_url="https://example.com", user=self.user, paypal_id_product="PROD-TEST")
+
+    def test_lookups(self):
+        self.assertEqual(product_catalog.get_by_paypal_id("PROD-TEST"), self.product)
+        self.assertEqual(product_catalog.get_by_name("Test1"), self.product)
+        self.assertIsNone(product_catalog.get_by_paypal_id("PROD-INVALID"))
+
+    def test_cart_validation_needs_no_queries(self):
+        product_catalog.get_by_paypal_id("PROD-TEST")
+
+        with self.assertNumQueries(0):
+            serializer = OrderSerializer(data={'cart': [{'id': 'PROD-TEST', 'value': '10'}]})
+            self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data['cart'][0], self.product)
+
+    def test_save_and_delete_invalidate(self):
+        product_catalog.get_by_paypal_id("PROD-TEST")
+
+        self.product.name = "Renamed"
+        self.product.save()
+        self.assertEqual(product_catalog.get_by_name("Renamed"), self.product)
+
+        self.product.delete()
+        self.assertIsNone(product_catalog.get_by_paypal_id("PROD-TEST"))
+
+    def test_other_process_reloads_on_version_change(self):
+        other = ProductCatalog(check_interval=0)
+        other.get_by_paypal_id("PROD-TEST")
+
+        # Simulates a save in another process: only the shared version moves
+        PaypalProductModel.objects.filter(pk=self.product.pk).update(name="Renamed")
+        self.assertEqual(other.get_by_name("Test1"), self.product)
+        caches[settings.PAYPAL_CATALOG_CACHE].set(ProductCatalog.VERSION_KEY, "other-version", timeout=None)
+
+        self.assertIsNotNone(other.get_by_name("Renamed"))
+
+    @override_settings(PAYPAL_CATALOG_CACHE='default')
+    def test_process_local_cache_refused(self):
+        self.assertEqual([error.id for error in check_catalog_cache(None)], ['paypal.E001'])
+
+
+class TestPurchaseAggregates(SetUpAuthUser):
+
+    def setUp(self):
+        super().setUp()
+        self.product = PaypalProductModel.objects.create(name="Test1", description="Test1", home_url="https://example.com", user=self.user, paypal_id_product="PROD-TEST")
+
+    def test_amount_is_parsed_from_price(self):
+        purchase = Purchase.objects.create(user=self.user, product=self.product, price="9.99")
+        self.assertEqual(purchase.amount, Decimal("9.99"))
+
+        purchase = Purchase.objects.create(user=self.user, product=self.product, price="INVALID")
+        self.assertIsNone(purchase.amount)
+
+    def test_record_purchase_updates_aggregates(self):
+        record_purchase(self.user, self.product, "10.00")
+        last = record_purchase(self.user, self.product, "5.50")
+
+        with self.assertNumQueries(1):
+            spend = get_user_spend(self.user)
+        self.assertEqual(spend.total_spent, Decimal("15.50"))
+        self.assertEqual(spend.purchase_count, 2)
+        self.assertEqual(spend.last_purchase_at, last.purchased_date)
+
+        daily = ProductDailySales.objects.get(product=self.product)
+        self.assertEqual(daily.total_amount, Decimal("15.50"))
+        self.assertEqual(daily.purchase_count, 2)
+
+    def test_user_without_purchases(self):
+        spend = get_user_spend(self.user)
+        self.assertEqual(spend.total_spent, 0)
+        self.assertEqual(spend.purchase_count, 0)
+
+
+class TestReconciliation(FakePaypalMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.paypal.captures.clear()
+        self.user = CustomUser.objects.create_user(email="buyer@example.com", password="Buyer1234", verified=True)
+        self.product = PaypalProductModel.objects.create(
+            name="Test1", description="Test1", home_url="https://example.com", user=self.user, paypal_id_product=PRODUCT_ID)
+        self.start = timezone.now() - timedelta(days=1)
+        self.end = timezone.now() + timedelta(minutes=1)
+
+    def capture(self, value="10"):
+        order = create_paypal_order(self.user, self.product, value)
+        response = capture_paypal_payment(order['id'])
+        return order['id'], response, response['purchase_units'][0]['payments']['captures'][0]['id']
+
+    def test_report_and_repair(self):
+        order_id, response, fulfilled = self.capture()
+        fulfil_capture_result(record_capture(self.user, order_id, response))
+
+        order_id, response, recorded = self.capture()
+        record_capture(self.user, order_id, response)
+
+        _, _, lost = self.capture()
+
+        order_id, _, foreign = self.capture()
+        PaypalOrder.objects.filter(order_id=order_id).delete()
+
+        states = dict(reconcile(self.start, self.end))
+        self.assertEqual(states, {fulfilled: OK, recorded: MISSING, lost: MISSING, foreign: MISSING})
+        self.assertEqual(get_balance(self.user), 10)
+
+        states = dict(reconcile(self.start, self.end, repair=True))
+        self.assertEqual(states, {fulfilled: OK, recorded: REPAIRED, lost: REPAIRED, foreign: UNMATCHED})
+        self.assertEqual(get_balance(self.user), 30)
+        self.assertEqual(Purchase.objects.count(), 3)
+
+        states = dict(reconcile(self.start, self.end, repair=True))
+        self.assertEqual(states[recorded], OK)
+        self.assertEqual(states[lost], OK)
+        self.assertEqual(get_balance(self.user), 30)
+
+    def test_pages_and_chunks(self):
+        captures = {self.capture()[2] for _ in range(5)}
+
+        with self.assertNumQueries(6):  # two per chunk of two
+            states = list(reconcile(self.start, self.end, page_size=2, chunk_size=2))
+        self.assertEqual({capture_id for capture_id, _ in states}, captures)
+
+    def test_command(self):
+        self.capture()
+        out = StringIO()
+
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+        call_command('reconcile_paypal', '--repair', '--end', tomorrow, stdout=out)
+
+        self.assertIn("Reconciled 1 payments: 1 repaired.", out.getvalue())
+        self.assertEqual(get_balance(self.user), 10)
+
+
+class TestProductSync(FakePaypalMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_superuser(email="admin@example.com", password="Admin1234")
+
+    def create_product(self, name):
+        return PaypalProductModel.objects.create(
+            name=name, description=name, home_url="https://example.com", user=self.user)
+
+    def test_product_is_synced_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            product = self.create_product("Synced")
+
+        # Nothing was sent to PayPal while saving
+        self.assertIn(start_product_sync, callbacks)
+        product.refresh_from_db()
+        self.assertIsNone(product.paypal_id_product)
+        self.assertEqual(product.sync_status, PaypalProductModel.PENDING)
+
+        self.assertEqual(sync_products_batch(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.sync_status, PaypalProductModel.SYNCED)
+        self.assertIn(product.paypal_id_product, self.paypal.products)
+        self.assertEqual(product_catalog.get_by_paypal_id(product.paypal_id_product), product)
+
+    def test_products_are_synced_in_batches(self):
+        for i in range(12):
+            self.create_product(f"Bulk {i}")
+
+        self.assertEqual(sync_products_batch(batch_size=5), 5)
+        self.assertEqual(sync_products_batch(batch_size=10), 7)
+        self.assertEqual(sync_products_batch(), 0)
+        self.assertFalse(PaypalProductModel.objects.filter(paypal_id_product__isnull=True).exists())
+
+    def test_product_with_paypal_id_is_not_synced(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            product = PaypalProductModel.objects.create(
+                name="Imported", description="Imported", home_url="https://example.com",
+                user=self.user, paypal_id_product="PROD-IMPORTED")
+
+        self.assertNotIn(start_product_sync, callbacks)
+        self.assertEqual(product.sync_status, PaypalProductModel.SYNCED)
+        self.assertEqual(sync_products_batch(), 0)
+
+    def test_failed_sync_is_retried_with_the_same_request_id(self):
+        product = self.create_product("Retried")
+        # More failures than the client retries
+        self.paypal.fail_next(503, count=10, path="/v1/catalogs/products")
+
+        self.assertEqual(sync_products_batch(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.sync_status, PaypalProductModel.PENDING)
+        self.assertEqual(product.sync_attempts, 1)
+        self.assertGreater(product.sync_next_attempt_at, timezone.now())
+
+        self.paypal.failures.clear()
+        PaypalProductModel.objects.filter(pk=product.pk).update(sync_next_attempt_at=timezone.now())
+        self.assertEqual(sync_products_batch(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.sync_status, PaypalProductModel.SYNCED)
+        self.assertEqual(self.paypal.responses[f"PRODUCT-{product.pk}"][1]["id"], product.paypal_id_product)
@@ -1,14 +1,20 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
 
     # paypal
     path('orders/', views.create_order, name="create_order"),
     path('orders/capture/', views.capture_order, name='capture_order'),
+    path('webhook/', views.webhook, name='paypal_webhook'),
+
+    # paypal (async, for ASGI deployments)
+    path('orders/async/', async_views.create_order_async, name="create_order_async"),
+    path('orders/capture/async/', async_views.capture_order_async, name='capture_order_async'),
     
     # user
     path('purchases/', views.purchases, name="purchases"),
+    path('purchases/export/<str:file_format>/', views.export_purchases, name="export_purchases"),
 
 
 ]
@@ -1,14 +1,23 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes, throttle_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import api_view, permission_classes, authentication_classes
+from rest_framework.permissions import IsAuthenticated, AllowAny
 
 from .serializers import OrderSerializer, OnSuccessSerializer
 from helpers.handle_errors import raise_400_HTTP_if_serializer_invalid
-from .services import capture_paypal_payment, process_completed_payment, create_paypal_order
+from .services import (capture_paypal_payment, create_paypal_order, record_webhook_event,
+                       get_capture_result, is_order_of, record_capture, fulfil_capture_result)
+from .helpers.webhooks import verify_webhook_signature
 from user.permissions import IsVerifiedPermission
 from .models import Purchase
 from .serializers import PurchaseSerializer
+from .pagination import PurchaseCursorPagination
+from .export import (EXPORT_FIELDS, EXPORT_FORMATS, EXPORT_HEADER, STAFF_FIELDS, STAFF_HEADER,
+                     buffered, export_rows, gzipped)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated, IsVerifiedPermission])
@@ -63,50 +72,107 @@ def capture_order(request):
         Response:
             - 200 OK: The PayPal capture response data.
             - 400 Bad Request: If there is an error during the payment capture process.
+            - 404 Not Found: If the order isn't one of the user's orders.
 
     Steps:
         1. Retrieve the user from the request.
         2. Extract the order ID from the PayPal response.
-        3. Generate a PayPal access token.
-        4. Capture the PayPal payment using the order ID.
-        5. Process the capture response:
-            - If the payment status is 'COMPLETED':
-                - If the reference is 'CUSTOM' (custom token purchase):
-                    - Calculate the number of tokens purchased.
-                    - Add the tokens to the user's account.
-                    - Send an email notification to the user.
-                - Save the user's updated token balance.
-                - Create a Purchase record with the user, product, and price.
+        3. Reject orders that weren't created by this user (404).
+           If the order was already captured, use the stored
+           CaptureResult instead of calling PayPal again.
+        4. Capture the PayPal payment using the order ID (with a
+           PayPal-Request-Id, so PayPal doesn't capture twice either).
+        5. Store the capture result and, if the payment status is 'COMPLETED'
+           and it wasn't fulfilled yet:
+            - If the reference is 'CUSTOM' (custom token purchase):
+                - Calculate the number of tokens purchased.
+                - Add the tokens to the user's account.
+                - Send an email notification to the user.
+            - Create a Purchase record with the user, product, and price.
             - If there is an exception, return an error response.
         6. Return the PayPal capture response.
+
+    When PAYPAL_WEBHOOK_ID is set, fulfilment in step 5 is skipped: the
+    PAYMENT.CAPTURE.COMPLETED webhook fulfils the order instead.
     """
 
     serializer = OnSuccessSerializer(data=request.data)
     raise_400_HTTP_if_serializer_invalid(serializer)
     order_id = serializer.validated_data.get("orderID")
 
+    if not is_order_of(request.user, order_id):
+        return Response({"msg": "Order not found."}, status=404)
 
-    try:
-        capture_response = capture_paypal_payment(order_id)
-    except Exception as e:
-        print(str(e))
-        return Response({"msg": "Paypal unexpected error."}, status=400)
+    result = get_capture_result(order_id)
+    if result is None:
+        try:
+            capture_response = capture_paypal_payment(order_id)
+        except Exception as e:
+            print(str(e))
+            return Response({"msg": "Paypal unexpected error."}, status=400)
 
-    if capture_response['status'] == 'COMPLETED':
-        process_completed_payment(request.user, capture_response)
+        result = record_capture(request.user, order_id, capture_response)
+
+    if not settings.PAYPAL_WEBHOOK_ID:
+        try:
+            # Also completes a stored capture whose fulfilment failed before
+            fulfil_capture_result(result)
+        except Exception as e:
+            print(str(e))
+            return Response({"msg": "Unexpected error."}, status=400)
 
     return Response(status=201)
 
 
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def webhook(request):
+    """
+    PayPal webhook listener.
+
+    Verifies the transmission signature, stores PAYMENT.CAPTURE.COMPLETED
+    events and acknowledges right away. Fulfilment runs in
+    `manage.py process_paypal_webhooks`.
+
+    Returns:
+        Response:
+            - 200 OK: The event was stored (or is not one we handle).
+            - 400 Bad Request: Invalid signature or body.
+    """
+
+    body = request.body
+    if not verify_webhook_signature(request.headers, body):
+        return Response({"msg": "Invalid webhook signature."}, status=400)
+
+    try:
+        event = json.loads(body)
+    except ValueError:
+        event = None
+    if not isinstance(event, dict) or not event.get('id'):
+        return Response({"msg": "Invalid webhook body."}, status=400)
+
+    if event.get('event_type') == 'PAYMENT.CAPTURE.COMPLETED':
+        record_webhook_event(event)
+
+    return Response(status=200)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated, IsVerifiedPermission])
 def purchases(request):
+    """
+    The user's purchases, newest first.
+
+    Query Params:
+        - cursor (str): Opaque position taken from the `next`/`previous` links.
+        - page_size (int): Purchases per page (default 5, max 50).
+        - include_total (bool): Also return `count` and `results.total_pages`.
+    """
 
     user = request.user
-    user_purchases = Purchase.objects.filter(
-        user=user).order_by('-purchased_date')
-    paginator = PageNumberPagination()
-    paginator.page_size = request.GET.get('page_size', 5)
+    user_purchases = Purchase.objects.filter(user=user).select_related('product', 'user')
+    paginator = PurchaseCursorPagination()
     user_purchases_page = paginator.paginate_queryset(user_purchases, request)
 
     product_fields = ['name']
@@ -117,7 +183,51 @@ def purchases(request):
     return paginator.get_paginated_response(
         {
             "user_purchases": serializer.data,
-            "total_pages": paginator.page.paginator.num_pages
         }
     )
 
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsVerifiedPermission])
+def export_purchases(request, file_format):
+    """
+    Stream the user's whole purchase history as a file, newest first.
+    Rows are read and sent in chunks, and gzipped on the fly when the
+    client accepts it.
+
+    URL Params:
+        - file_format (str): "csv" or "jsonl".
+
+    Query Params:
+        - all (bool): Staff only. Export the purchases of every user, with their email.
+
+    Returns:
+        StreamingHttpResponse:
+            - 200 OK: The file, as an attachment.
+        Response:
+            - 400 Bad Request: If the format is not supported.
+            - 403 Forbidden: If `all` is requested by a non-staff user.
+    """
+
+    if file_format not in EXPORT_FORMATS:
+        return Response({"msg": f"Unsupported format '{file_format}'."}, status=400)
+
+    if request.query_params.get('all') in ('true', '1'):
+        if not request.user.is_staff:
+            return Response({"msg": "Only staff can export every purchase."}, status=403)
+        queryset = Purchase.objects.order_by('id')
+        fields, header = STAFF_FIELDS, STAFF_HEADER
+    else:
+        queryset = Purchase.objects.filter(user=request.user).order_by('-purchased_date', '-id')
+        fields, header = EXPORT_FIELDS, EXPORT_HEADER
+
+    lines, content_type = EXPORT_FORMATS[file_format]
+    content = buffered(lines(export_rows(queryset, fields), header))
+
+    gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    response = StreamingHttpResponse(gzipped(content) if gzip else content, content_type=content_type)
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Content-Disposition'] = f'attachment; filename="purchases.{file_format}"'
+    return response
@@ -67,6 +67,7 @@ INSTALLED_APPS = [
 
     'user',
     'paypal',
+    'mailing',
 ]
 
 MIDDLEWARE = [
@@ -108,9 +109,33 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # On disk rather than in memory: SQLite's shared in-memory database
+        # fails concurrent writers with "table is locked", and
+        # TestTokenBalanceConcurrency debits one account from several threads
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Seen by every worker, e.g. token versions (user/helpers/claims.py).
+    # Set REDIS_URL in production. Without it this is a file cache,
+    # which costs a disk read per lookup and is only shared by the workers
+    # of one host (see the user.W002 check)
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL'),
+    } if os.environ.get('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SHARED_CACHE_LOCATION', str(BASE_DIR / 'cache' / 'shared')),
+    },
+}
+
+# Tests run with a throwaway location for the shared cache
+TEST_RUNNER = 'src.test_runner.TestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -162,7 +187,7 @@ REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'helpers.handle_errors.custom_exception_handler',
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user.authentication.ClaimsJWTAuthentication',
     ),
 
     'DEFAULT_THROTTLE_RATES': {
@@ -179,8 +204,107 @@ if DEBUG == False:
 
 
 
+# EMAIL
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 465))
+EMAIL_USE_SSL = os.environ.get('EMAIL_USE_SSL', 'True') == 'True'
+EMAIL_HOST_USER = os.environ.get('EMAIL_ADDRESS')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_PASSWORD')
+EMAIL_TIMEOUT = 10
+
+# Pooled SMTP sessions (helpers/smtp.py)
+EMAIL_POOL_SIZE = int(os.environ.get('EMAIL_POOL_SIZE', 4))
+EMAIL_POOL_MAX_IDLE = int(os.environ.get('EMAIL_POOL_MAX_IDLE', 60))
+
+# Outbox delivered by `manage.py send_outbox` (mailing app)
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_BACKOFF = 30  # seconds, doubled on every attempt
+EMAIL_OUTBOX_MAX_BACKOFF = 60 * 60
+EMAIL_OUTBOX_LEASE = 5 * 60  # reclaim emails held by a dead worker
+
+
+# PAYPAL
+# Point to a local stand-in server for benchmarks (e.g. http://127.0.0.1:8081)
+PAYPAL_API_BASE_URL = os.environ.get('PAYPAL_API_BASE_URL', 'https://api-m.sandbox.paypal.com')
+PAYPAL_POOL_SIZE = int(os.environ.get('PAYPAL_POOL_SIZE', 10))
+PAYPAL_ASYNC_POOL_SIZE = int(os.environ.get('PAYPAL_ASYNC_POOL_SIZE', 100))
+PAYPAL_CONNECT_TIMEOUT = 3.05
+PAYPAL_READ_TIMEOUT = 15
+PAYPAL_MAX_RETRIES = 3
+# Refresh the OAuth token this many seconds before PayPal's expires_in
+PAYPAL_TOKEN_REFRESH_MARGIN = 300
+# Django cache alias used to share the token between worker processes (None: per process)
+PAYPAL_TOKEN_CACHE = os.environ.get('PAYPAL_TOKEN_CACHE')
+# Webhook ID from the PayPal dashboard. When set, captures are fulfilled by
+# `manage.py process_paypal_webhooks` instead of inside `capture_order`
+PAYPAL_WEBHOOK_ID = os.environ.get('PAYPAL_WEBHOOK_ID')
+# Product catalog snapshot (paypal/catalog.py). The cache must be shared by
+# all the workers, so product changes reach every process within
+# PAYPAL_CATALOG_CHECK_INTERVAL seconds
+PAYPAL_CATALOG_CACHE = os.environ.get('PAYPAL_CATALOG_CACHE', 'shared')
+PAYPAL_CATALOG_CHECK_INTERVAL = 5
+PAYPAL_CATALOG_MAX_AGE = 5 * 60
+PAYPAL_WEBHOOK_CERT_TTL = 24 * 60 * 60
+# Webhook signing certificates must be issued to one of these names and chain
+# up to a root of this bundle (None: certifi's)
+PAYPAL_WEBHOOK_CERT_SUBJECTS = os.environ.get(
+    'PAYPAL_WEBHOOK_CERT_SUBJECTS',
+    'messageverificationcerts.paypal.com,messageverificationcerts.sandbox.paypal.com').split(',')
+PAYPAL_WEBHOOK_CA_BUNDLE = os.environ.get('PAYPAL_WEBHOOK_CA_BUNDLE')
+# Reject deliveries whose PAYPAL-TRANSMISSION-TIME is further from now than this
+PAYPAL_WEBHOOK_MAX_AGE = 5 * 60
+PAYPAL_WEBHOOK_MAX_ATTEMPTS = 5
+PAYPAL_WEBHOOK_BACKOFF = 30  # seconds, doubled on every attempt
+PAYPAL_WEBHOOK_LEASE = 5 * 60
+
+# Creating products in the PayPal catalog (`manage.py sync_paypal_products`)
+PAYPAL_PRODUCT_SYNC_MAX_ATTEMPTS = 5
+PAYPAL_PRODUCT_SYNC_BACKOFF = 30  # seconds, doubled on every attempt
+PAYPAL_PRODUCT_SYNC_LEASE = 5 * 60
+
+
 # USER
 AUTH_USER_MODEL = 'user.CustomUser'
+# Ledger entries younger than this are not compacted by `manage.py compact_token_ledger`
+TOKEN_LEDGER_COMPACTION_DELAY = 60
+# Buffered usage metering (user/helpers/metering.py)
+TOKEN_METER_FLUSH_INTERVAL = float(os.environ.get('TOKEN_METER_FLUSH_INTERVAL', 1))
+TOKEN_METER_MAX_BATCH = int(os.environ.get('TOKEN_METER_MAX_BATCH', 5000))
+TOKEN_METER_BALANCE_TTL = float(os.environ.get('TOKEN_METER_BALANCE_TTL', 5))
+# Usage is journaled here until charged, and charged by the other workers
+# sharing the directory if its worker dies. TOKEN_METER_FSYNC also makes it
+# survive a host crash, at the cost of an fsync per request
+TOKEN_METER_JOURNAL_DIR = os.environ.get('TOKEN_METER_JOURNAL_DIR', BASE_DIR / 'cache' / 'usage')
+TOKEN_METER_FSYNC = os.environ.get('TOKEN_METER_FSYNC', 'False') == 'True'
+# Usage references and applied batches older than this are pruned by
+# `manage.py compact_token_ledger`: a client retrying later is charged again
+TOKEN_USAGE_RETENTION = 7 * 24 * 60 * 60
+# Cache telling ClaimsJWTAuthentication which access tokens have outdated
+# claims. Claims are only trusted if it is shared by all the processes
+USER_TOKEN_VERSION_CACHE = os.environ.get('USER_TOKEN_VERSION_CACHE', 'shared')
+# Validated access tokens kept per process (0 disables)
+ACCESS_TOKEN_CACHE_SIZE = int(os.environ.get('ACCESS_TOKEN_CACHE_SIZE', 10000))
+# Refresh tokens are checked against a per-process bloom filter of the
+# blacklist, synced this often (see RefreshTokenBlacklist)
+REFRESH_BLACKLIST_SYNC_INTERVAL = float(os.environ.get('REFRESH_BLACKLIST_SYNC_INTERVAL', 1))
+REFRESH_BLACKLIST_BLOOM_CAPACITY = int(os.environ.get('REFRESH_BLACKLIST_BLOOM_CAPACITY', 1000000))
+# Tokens blacklisted by other processes are looked up this far back, in
+# case their transaction committed late
+REFRESH_BLACKLIST_SYNC_DELAY = int(os.environ.get('REFRESH_BLACKLIST_SYNC_DELAY', 60))
+REFRESH_BLACKLIST_REBUILD_INTERVAL = int(os.environ.get('REFRESH_BLACKLIST_REBUILD_INTERVAL', 3600))
+# Tokens just blacklisted are also kept here for this many seconds, so
+# other processes see them before their next sync. Without a shared cache
+# every check queries the database
+REFRESH_BLACKLIST_CACHE = os.environ.get('REFRESH_BLACKLIST_CACHE', 'shared')
+REFRESH_BLACKLIST_RECENT_TTL = int(os.environ.get('REFRESH_BLACKLIST_RECENT_TTL', 300))
+# Refreshing a token again within this many seconds returns the tokens
+# already issued for it instead of failing (see user/helpers/refresh.py)
+REFRESH_GRACE_PERIOD = int(os.environ.get('REFRESH_GRACE_PERIOD', 10))
+# Must be shared by all the workers, so a refresh landing on another one
+# gets the same tokens (the user.E001 check refuses a per-process cache)
+REFRESH_GRACE_CACHE = os.environ.get('REFRESH_GRACE_CACHE', 'shared')
+# Longest a refresh waits for the same token being refreshed by another worker
+REFRESH_LOCK_TIMEOUT = 5
 
 # GOOGLE AUTH
 SOCIALACCOUNT_PROVIDERS = {
@@ -195,6 +319,14 @@ SOCIALACCOUNT_PROVIDERS = {
 
 SOCIAL_AUTH_GOOGLE_OAUTH2_KEY = os.environ.get("SOCIAL_AUTH_GOOGLE_OAUTH2_KEY")
 SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET = os.environ.get("SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET")
+# Google sign-in (user/helpers/google.py). Signing keys are refreshed in
+# the background this many seconds before Google's max-age runs out
+GOOGLE_CERTS_REFRESH_MARGIN = 5 * 60
+GOOGLE_POOL_SIZE = int(os.environ.get('GOOGLE_POOL_SIZE', 10))
+GOOGLE_TIMEOUT = 5
+# Userinfo of Google access tokens, cached by token hash (cache alias, seconds)
+GOOGLE_USERINFO_CACHE = os.environ.get('GOOGLE_USERINFO_CACHE', 'default')
+GOOGLE_USERINFO_CACHE_TTL = 5 * 60
 
 # JWT
 SIMPLE_JWT = {
@@ -229,7 +361,7 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
     "TOKEN_OBTAIN_SERIALIZER": "user.serializers.MyTokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "user.serializers.MyTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
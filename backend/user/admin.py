@@ -1,9 +1,14 @@
 from django.contrib import admin
-from .models import CustomUser, WhitelistData, UserPreferences, OtpCode
+from .models import (CustomUser, WhitelistData, UserPreferences, OtpCode, TokenLedger, TokenBalance, TokenUsage,
+                     UsageOverdraft)
 
 # Register your models here.
 admin.site.register(CustomUser)
 admin.site.register(WhitelistData)
 admin.site.register(UserPreferences)
 admin.site.register(OtpCode)
+admin.site.register(TokenLedger)
+admin.site.register(TokenBalance)
+admin.site.register(TokenUsage)
+admin.site.register(UsageOverdraft)
 
@@ -0,0 +1,80 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .helpers.blacklist import get_refresh_blacklist
+from .helpers.claims import CLAIM_FIELDS, VERSION_CLAIM, add_user_claims, is_stale, shares_token_versions
+from .helpers.token_cache import get_token_cache
+from .models import ClaimsUser, CustomUser
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that builds the user from the claims of the access
+    token (see `add_user_claims`) instead of loading it, so requests that
+    only need the id, email, verified or premium don't query the users
+    table. Other fields are loaded on first access. Inactive users are
+    rejected from the claims too.
+
+    Falls back to the database for tokens issued without claims, or whose
+    claims are older than the user's last change (`is_stale`), and for
+    every token if USER_TOKEN_VERSION_CACHE is local to each process.
+
+    Validated tokens are kept in `token_cache` until they expire.
+    """
+
+    def __init__(self, *args, token_cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.token_cache = token_cache if token_cache is not None else get_token_cache()
+
+    def get_validated_token(self, raw_token):
+        token = self.token_cache.get(raw_token)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            self.token_cache.add(raw_token, token)
+        return token
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        version = validated_token.get(VERSION_CLAIM)
+
+        if (user_id is None or version is None or any(field not in validated_token for field in CLAIM_FIELDS)
+                or not shares_token_versions() or is_stale(user_id, version)):
+            return super().get_user(validated_token)
+        if not validated_token['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return ClaimsUser.from_claims(user_id, validated_token)
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """
+    Refresh token whose access tokens carry the user's current claims
+    rather than the ones copied from the refresh token when it was issued.
+
+    Blacklist checks and writes go through `RefreshTokenBlacklist`.
+    """
+
+    def check_blacklist(self):
+        if get_refresh_blacklist().contains(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        get_refresh_blacklist().add(
+            self.payload[api_settings.JTI_CLAIM], str(self),
+            self.payload.get(api_settings.USER_ID_CLAIM), datetime_from_epoch(self.payload['exp']))
+
+    @property
+    def access_token(self):
+        access = super().access_token
+
+        try:
+            user = CustomUser.objects.get(id=self[api_settings.USER_ID_CLAIM])
+        except (KeyError, CustomUser.DoesNotExist):
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return add_user_claims(access, user)
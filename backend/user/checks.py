@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+
+from .helpers.claims import PROCESS_LOCAL_CACHES, shares_token_versions
+
+
+@checks.register(checks.Tags.security)
+def check_token_version_cache(app_configs, **kwargs):
+    authentication_classes = settings.REST_FRAMEWORK.get('DEFAULT_AUTHENTICATION_CLASSES', ())
+    if 'user.authentication.ClaimsJWTAuthentication' not in authentication_classes or shares_token_versions():
+        return []
+
+    return [checks.Warning(
+        "USER_TOKEN_VERSION_CACHE is local to each process: access token claims are not trusted "
+        "and every authenticated request loads the user.",
+        hint="Point USER_TOKEN_VERSION_CACHE to a cache shared by all the workers (file based, Redis or Memcached).",
+        id='user.W001',
+    )]
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache_is_not_file_based(app_configs, **kwargs):
+    if not isinstance(caches[settings.USER_TOKEN_VERSION_CACHE], FileBasedCache):
+        return []
+
+    return [checks.Warning(
+        "USER_TOKEN_VERSION_CACHE is a file cache: it is only shared by the workers of one host, "
+        "and every authenticated request reads a file.",
+        hint="Set REDIS_URL (or point USER_TOKEN_VERSION_CACHE to a Redis or Memcached cache) "
+             "when running on several hosts.",
+        id='user.W002',
+    )]
+
+
+@checks.register(checks.Tags.caches)
+def check_refresh_grace_cache(app_configs, **kwargs):
+    if not settings.REFRESH_GRACE_PERIOD or not isinstance(
+            caches[settings.REFRESH_GRACE_CACHE], PROCESS_LOCAL_CACHES):
+        return []
+
+    return [checks.Error(
+        "REFRESH_GRACE_CACHE is local to each process: a refresh token reused on another worker "
+        "within REFRESH_GRACE_PERIOD is rejected.",
+        hint="Point REFRESH_GRACE_CACHE to a cache shared by all the workers, or set REFRESH_GRACE_PERIOD to 0.",
+        id='user.E001',
+    )]
@@ -1,6 +1,4 @@
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
-import requests
+from user.helpers.google import get_google_userinfo, verify_google_id_token
 from user.serializers import MyTokenObtainPairSerializer
 from dotenv import load_dotenv
 import os
@@ -12,28 +10,20 @@ def get_google_id_info(validated_data):
     token = validated_data['userInfo'].get('credential')
     
     if token:
-        return id_token.verify_oauth2_token(token, google_requests.Request(), client_id), token
+        return verify_google_id_token(token, client_id), token
     else:
         access_token = validated_data['userInfo'].get('access_token')
-        userinfo_url = f'https://www.googleapis.com/oauth2/v3/userinfo?access_token={access_token}'
-        response = requests.get(userinfo_url)
-        return response.json(), access_token
+        return get_google_userinfo(access_token) or {}, access_token
 
 
 def check_google_credentials(tok):
     try:
-        id_token.verify_oauth2_token(tok, google_requests.Request(), client_id)
+        verify_google_id_token(tok, client_id)
         return True
     except:
         pass
-    
-    
-    userinfo_url = f'https://www.googleapis.com/oauth2/v3/userinfo?access_token={tok}'
-    response = requests.get(userinfo_url)
-    if response.status_code == 200:
-        return True
-    else:
-        return False
+
+    return get_google_userinfo(tok) is not None
 
 
 def get_user_or_create_otps(email):
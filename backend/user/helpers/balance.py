@@ -0,0 +1,152 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from user.models import TokenBalance, TokenLedger
+
+
+class InsufficientTokens(Exception):
+    pass
+
+
+def get_balance(user):
+    """
+    Current balance of `user`: the compacted snapshot plus the ledger
+    entries written after it. Entries are never deleted, so a compaction
+    running in between can't make this miss or double count anything.
+    """
+    balance, last_entry_id = TokenBalance.objects.filter(user=user).values_list(
+        'balance', 'last_entry_id').first() or (0, 0)
+
+    recent = TokenLedger.objects.filter(user=user, id__gt=last_entry_id).aggregate(
+        total=Sum('amount'))['total']
+    return balance + (recent or 0)
+
+
+def credit_tokens(user, amount, reason=TokenLedger.PURCHASE, reference=''):
+    """
+    Add `amount` tokens to `user`. A single INSERT into the ledger: credits
+    never lock or rewrite the user row. Returns the new balance.
+    """
+    if amount < 0:
+        raise ValueError("amount must be positive.")
+
+    TokenLedger.objects.create(user=user, amount=amount, reason=reason, reference=reference)
+    return get_balance(user)
+
+
+def _lock_balance(user_id):
+    # Writing the snapshot row first takes its row lock (or SQLite's write
+    # lock) before the balance is read, which serializes debits of one user
+    if not TokenBalance.objects.filter(user_id=user_id).update(updated_at=timezone.now()):
+        TokenBalance.objects.get_or_create(user_id=user_id)
+        TokenBalance.objects.filter(user_id=user_id).update(updated_at=timezone.now())
+
+
+def get_balances(user_ids):
+    """
+    Like get_balance for many users at once: {user_id: balance} in two queries.
+    """
+    balances = dict.fromkeys(user_ids, 0)
+    balances.update(TokenBalance.objects.filter(user_id__in=user_ids).values_list('user_id', 'balance'))
+
+    snapshot = TokenBalance.objects.filter(user=OuterRef('user')).values('last_entry_id')
+    recent = (
+        TokenLedger.objects.filter(user_id__in=user_ids, id__gt=Coalesce(Subquery(snapshot), Value(0)))
+        .values('user')
+        .annotate(total=Sum('amount'))
+        .values_list('user', 'total')
+    )
+    for user_id, total in recent:
+        balances[user_id] += total
+    return balances
+
+
+def _lock_balances(user_ids):
+    # _lock_balance for many users. Rows are locked in pk order so two
+    # batches sharing users can't deadlock; on SQLite the INSERT takes the
+    # write lock
+    TokenBalance.objects.bulk_create(
+        [TokenBalance(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+    list(TokenBalance.objects.select_for_update().filter(user_id__in=user_ids).order_by('pk').values_list('pk'))
+
+
+def debit_tokens(user, amount, reason=TokenLedger.USAGE, reference=''):
+    """
+    Take `amount` tokens from `user` only if the balance covers it.
+    Returns the new balance.
+
+    Raises:
+        InsufficientTokens: If the balance is lower than `amount`.
+    """
+    if amount < 0:
+        raise ValueError("amount must be positive.")
+
+    with transaction.atomic():
+        _lock_balance(user.pk)
+        balance = get_balance(user)
+        if balance < amount:
+            raise InsufficientTokens(f"User {user.pk} has less than {amount} tokens.")
+
+        TokenLedger.objects.create(user=user, amount=-amount, reason=reason, reference=reference)
+    return balance - amount
+
+
+def compact_balance(user_id, before):
+    """
+    Fold the ledger entries of `user_id` up to the last one created before
+    `before` into its snapshot. Returns whether anything was folded.
+    """
+    with transaction.atomic():
+        _lock_balance(user_id)
+        last_entry_id = TokenBalance.objects.filter(user_id=user_id).values_list(
+            'last_entry_id', flat=True).get()
+
+        cutoff = TokenLedger.objects.filter(
+            user_id=user_id, id__gt=last_entry_id, created_at__lt=before).aggregate(last=Max('id'))['last']
+        if cutoff is None:
+            return False
+
+        total = TokenLedger.objects.filter(
+            user_id=user_id, id__gt=last_entry_id, id__lte=cutoff).aggregate(total=Sum('amount'))['total']
+        TokenBalance.objects.filter(user_id=user_id).update(
+            balance=F('balance') + total, last_entry_id=cutoff)
+    return True
+
+
+def users_to_compact(before):
+    """
+    Ids of users with ledger entries older than `before` that are not in
+    their snapshot yet.
+    """
+    snapshot = TokenBalance.objects.filter(user=OuterRef('user')).values('last_entry_id')
+    return (
+        TokenLedger.objects.filter(created_at__lt=before)
+        .values('user')
+        .annotate(last=Max('id'), compacted=Coalesce(Subquery(snapshot), Value(0)))
+        .filter(last__gt=F('compacted'))
+        .order_by('user')
+        .values_list('user', flat=True)
+    )
+
+
+def compact_ledger(batch_size=500):
+    """
+    Compact every user with pending entries. Entries younger than
+    TOKEN_LEDGER_COMPACTION_DELAY are left alone: a transaction still in
+    flight may commit one with a lower id than entries already visible.
+    Returns the number of users compacted.
+    """
+    before = timezone.now() - timedelta(seconds=settings.TOKEN_LEDGER_COMPACTION_DELAY)
+
+    compacted = 0
+    while True:
+        user_ids = list(users_to_compact(before)[:batch_size])
+        folded = sum(compact_balance(user_id, before) for user_id in user_ids)
+        compacted += folded
+        if len(user_ids) < batch_size or not folded:
+            return compacted
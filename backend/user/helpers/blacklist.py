@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from .claims import PROCESS_LOCAL_CACHES
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Set of strings answering "maybe" or "certainly not" in a fixed amount of
+    memory: about 1.8 MB per million keys at a 0.1% false positive rate.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        if all(self.bits[p >> 3] & (1 << (p & 7)) for p in positions):
+            return
+        for p in positions:
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+def write_blacklist(entries):
+    """
+    Blacklist `entries` ({jti: (token, user_id, expires_at)}) in three
+    queries, creating the OutstandingToken rows that don't exist yet.
+    """
+    with transaction.atomic():
+        OutstandingToken.objects.bulk_create([
+            OutstandingToken(jti=jti, token=token, user_id=user_id, expires_at=expires_at)
+            for jti, (token, user_id, expires_at) in entries.items()
+        ], ignore_conflicts=True)
+        token_ids = OutstandingToken.objects.filter(jti__in=list(entries)).values_list('id', flat=True)
+        BlacklistedToken.objects.bulk_create(
+            [BlacklistedToken(token_id=token_id) for token_id in token_ids], ignore_conflicts=True)
+
+
+class RefreshTokenBlacklist:
+    """
+    Per-process read accelerator for the refresh token blacklist.
+
+    `add()` writes the BlacklistedToken row before the rotation returns and
+    marks the jti as recently blacklisted in the `cache` alias for
+    `recent_ttl` seconds. `contains()` answers from a bloom filter of the
+    blacklisted jtis, so the usual case (a token that was never
+    blacklisted) needs no query; bloom filter hits are confirmed in the
+    database. A miss is only trusted together with the cache: a token
+    blacklisted by another process since the filter was last synced is
+    found there.
+
+    The background thread loads the rows other processes wrote into the
+    filter every `sync_interval` seconds. Each sync reads the rows
+    blacklisted from `sync_delay` seconds before the previous sync started,
+    not from the last id seen: transactions commit out of id order, so a
+    row can become visible after higher ids were loaded. The filter is
+    rebuilt without the expired tokens every `rebuild_interval` seconds, or
+    once it holds `capacity` of them. Every check queries the database
+    until the filter is first loaded, when it was not synced within
+    `recent_ttl` seconds (so the cache may have forgotten tokens it misses)
+    or when the cache is not shared by all the processes.
+
+    With `sync_interval=None` nothing runs in the background: call `sync()`.
+    """
+
+    def __init__(self, sync_interval=1.0, capacity=1000000, sync_delay=60, rebuild_interval=3600,
+                 cache='shared', recent_ttl=300):
+        self.sync_interval = sync_interval
+        self.capacity = capacity
+        self.sync_delay = sync_delay
+        self.rebuild_interval = rebuild_interval
+        self.cache = cache
+        self.recent_ttl = recent_ttl
+
+        self._bloom = None
+        self._built_at = 0  # time.monotonic() of the last rebuild
+        self._synced_at = None  # Start of the last sync
+        self._synced_monotonic = 0  # time.monotonic() at the start of the last sync
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._thread = None
+
+    def _key(self, jti):
+        return f'user:blacklisted:{jti}'
+
+    def contains(self, jti):
+        self._start()
+        with self._lock:
+            bloom = self._bloom
+            fresh = time.monotonic() < self._synced_monotonic + self.recent_ttl
+        cache = caches[self.cache]
+        if (bloom is not None and jti not in bloom and fresh
+                and not isinstance(cache, PROCESS_LOCAL_CACHES)):
+            # Rows committed before the last sync are in the filter, later
+            # ones (recent_ttl at most) in the cache
+            return cache.get(self._key(jti)) is not None
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+    def add(self, jti, token, user_id, expires_at):
+        write_blacklist({jti: (token, user_id, expires_at)})
+        caches[self.cache].set(self._key(jti), True, timeout=self.recent_ttl)
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+        self._start()
+
+    def sync(self):
+        """
+        Load the recently blacklisted tokens into the filter, or rebuild it
+        from all the unexpired ones when it is missing, old or full.
+        """
+        with self._sync_lock:
+            started_at = timezone.now()
+            started_monotonic = time.monotonic()
+            rebuild = (self._bloom is None or self._bloom.count >= self.capacity
+                       or started_monotonic >= self._built_at + self.rebuild_interval)
+            if rebuild:
+                bloom = BloomFilter(self.capacity)
+                rows = BlacklistedToken.objects.filter(token__expires_at__gt=aware_utcnow())
+            else:
+                bloom = self._bloom
+                rows = BlacklistedToken.objects.filter(
+                    blacklisted_at__gte=self._synced_at - timedelta(seconds=self.sync_delay))
+
+            for jti in rows.values_list('token__jti', flat=True).iterator(chunk_size=10000):
+                with self._lock:
+                    bloom.add(jti)
+
+            with self._lock:
+                if rebuild:
+                    # Tokens add()ed meanwhile are in the database or the cache
+                    self._bloom = bloom
+                    self._built_at = started_monotonic
+                self._synced_at = started_at
+                self._synced_monotonic = started_monotonic
+
+    def _start(self):
+        if self._thread is not None or self.sync_interval is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="token-blacklist", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Refresh token blacklist sync failed")
+                # Start over with a fresh connection in case this one broke
+                connection.close()
+            time.sleep(self.sync_interval)
+
+
+def prune_expired_tokens(batch_size=1000):
+    """
+    Delete one batch of expired outstanding tokens (and their blacklist
+    rows), oldest first. Expired tokens are rejected before the blacklist
+    is checked, so they are not needed. Returns the number deleted.
+    """
+    ids = list(OutstandingToken.objects.filter(expires_at__lte=aware_utcnow())
+               .order_by('id').values_list('id', flat=True)[:batch_size])
+    if ids:
+        with transaction.atomic():
+            BlacklistedToken.objects.filter(token_id__in=ids).delete()
+            OutstandingToken.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+_blacklist = None
+_blacklist_lock = threading.Lock()
+
+
+def get_refresh_blacklist():
+    global _blacklist
+
+    if _blacklist is None:
+        with _blacklist_lock:
+            if _blacklist is None:
+                _blacklist = RefreshTokenBlacklist(
+                    sync_interval=settings.REFRESH_BLACKLIST_SYNC_INTERVAL,
+                    capacity=settings.REFRESH_BLACKLIST_BLOOM_CAPACITY,
+                    sync_delay=settings.REFRESH_BLACKLIST_SYNC_DELAY,
+                    rebuild_interval=settings.REFRESH_BLACKLIST_REBUILD_INTERVAL,
+                    cache=settings.REFRESH_BLACKLIST_CACHE,
+                    recent_ttl=settings.REFRESH_BLACKLIST_RECENT_TTL,
+                )
+    return _blacklist
@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework_simplejwt.settings import api_settings
+
+# Fields copied into access tokens, so requests can be authenticated
+# without loading the user (see user/authentication.py)
+CLAIM_FIELDS = ('email', 'verified', 'premium', 'is_active')
+VERSION_CLAIM = 'ver'
+
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def _cache():
+    return caches[settings.USER_TOKEN_VERSION_CACHE]
+
+
+def _version_key(user_id):
+    return f'user:token_version:{user_id}'
+
+
+def _timeout():
+    return api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()
+
+
+def shares_token_versions():
+    """
+    Whether every process sees the versions published here. If not, a
+    change saved by one worker would go unnoticed by the others, so token
+    claims must not be trusted.
+    """
+    return not isinstance(_cache(), PROCESS_LOCAL_CACHES)
+
+
+def add_user_claims(token, user):
+    for field in CLAIM_FIELDS:
+        token[field] = getattr(user, field)
+    token[VERSION_CLAIM] = user.token_version
+    # Known now, so checking the token doesn't have to look it up
+    _cache().add(_version_key(user.pk), user.token_version, timeout=_timeout())
+    return token
+
+
+def publish_token_version(user_id, version):
+    """
+    Announce that tokens of `user_id` older than `version` carry stale
+    claims. Kept as long as an access token lives; after that every token
+    still in use was issued (or refreshed) with the new claims.
+    """
+    _cache().set(_version_key(user_id), version, timeout=_timeout())
+
+
+def is_stale(user_id, version):
+    """
+    Whether claims `version` of `user_id` are outdated. A version that
+    isn't cached is read from the database; tokens of deleted users are
+    always outdated.
+    """
+    from user.models import CustomUser
+
+    cache = _cache()
+    key = _version_key(user_id)
+    current = cache.get(key)
+    if current is None:
+        current = CustomUser.objects.filter(pk=user_id).values_list('token_version', flat=True).first()
+        if current is None:
+            return True
+        # Unless a newer version was published meanwhile
+        cache.add(key, current, timeout=_timeout())
+    return current > version
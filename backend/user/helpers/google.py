@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from google.auth import jwt
+from requests.adapters import HTTPAdapter
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_USERINFO_URL = 'https://www.googleapis.com/oauth2/v3/userinfo'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+logger = logging.getLogger(__name__)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_google_session():
+    """
+    Process-wide keep-alive session for Google endpoints.
+    """
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=settings.GOOGLE_POOL_SIZE)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def max_age(cache_control):
+    match = re.search(r'max-age=(\d+)', cache_control or '')
+    return int(match.group(1)) if match else 0
+
+
+class GoogleCertCache:
+    """
+    Google's id_token signing certificates.
+
+    They are kept for the max-age Google sends with them (hours) and
+    refreshed in the background `refresh_margin` seconds before that runs
+    out, so sign-ins never wait for the download. A token signed with an
+    unknown key id (keys were rotated) triggers a reload, at most once
+    every `min_ttl` seconds.
+    """
+
+    def __init__(self, url=GOOGLE_CERTS_URL, session=None, refresh_margin=300, min_ttl=60, timeout=5):
+        self.url = url
+        self.session = session
+        self.refresh_margin = refresh_margin
+        self.min_ttl = min_ttl
+        self.timeout = timeout
+
+        self._certs = None  # key id -> PEM certificate
+        self._fetched_at = 0
+        self._expires_at = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        session = self.session or get_google_session()
+        response = session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+
+        now = time.monotonic()
+        self._certs = response.json()
+        self._fetched_at = now
+        self._expires_at = now + max(max_age(response.headers.get('Cache-Control')), self.min_ttl)
+
+    def _refresh(self):
+        try:
+            with self._lock:
+                self._fetch()
+        except Exception:
+            # Keep the current certs until they expire
+            logger.exception("Google certificates refresh failed")
+        finally:
+            self._refreshing = False
+
+    def get(self, key_id=None):
+        """
+        The current certificates, by key id, reloaded first if they expired
+        or don't include `key_id`.
+        """
+        now = time.monotonic()
+        stale = self._certs is None or now >= self._expires_at
+        rotated = self._certs is not None and key_id not in self._certs and now >= self._fetched_at + self.min_ttl
+
+        if stale or rotated:
+            with self._lock:
+                now = time.monotonic()
+                if self._certs is None or now >= self._expires_at or (
+                        key_id not in self._certs and now >= self._fetched_at + self.min_ttl):
+                    self._fetch()
+        elif now >= self._expires_at - self.refresh_margin and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh, name="google-certs", daemon=True).start()
+
+        return self._certs
+
+
+google_certs = GoogleCertCache(
+    refresh_margin=settings.GOOGLE_CERTS_REFRESH_MARGIN,
+    timeout=settings.GOOGLE_TIMEOUT,
+)
+
+
+def verify_google_id_token(token, audience, certs=None, clock_skew=10):
+    """
+    Verify a Google id_token against the cached certificates and return its
+    claims. Same checks as google.oauth2.id_token.verify_oauth2_token,
+    without downloading the certificates every time.
+
+    Raises:
+        ValueError: If the token is malformed, badly signed, expired, or
+            not issued by Google for `audience`.
+    """
+    key_id = jwt.decode_header(token).get('kid')
+    payload = jwt.decode(token, certs=(certs or google_certs).get(key_id), audience=audience,
+                         clock_skew_in_seconds=clock_skew)
+
+    if payload.get('iss') not in GOOGLE_ISSUERS:
+        raise ValueError("Token was not issued by Google.")
+    return payload
+
+
+def get_google_userinfo(access_token, session=None):
+    """
+    Google's userinfo for an OAuth `access_token`, or None if Google
+    rejects it. Valid answers are cached for GOOGLE_USERINFO_CACHE_TTL
+    seconds under a hash of the token (the token itself is never stored),
+    so the signup flow validating the same token twice asks Google once.
+    """
+    if not access_token:
+        return None
+
+    cache = caches[settings.GOOGLE_USERINFO_CACHE]
+    key = 'google:userinfo:' + hashlib.sha256(access_token.encode()).hexdigest()
+    userinfo = cache.get(key)
+    if userinfo is not None:
+        return userinfo
+
+    response = (session or get_google_session()).get(
+        GOOGLE_USERINFO_URL, headers={'Authorization': f'Bearer {access_token}'}, timeout=settings.GOOGLE_TIMEOUT)
+    if response.status_code != 200:
+        return None
+
+    userinfo = response.json()
+    cache.set(key, userinfo, timeout=settings.GOOGLE_USERINFO_CACHE_TTL)
+    return userinfo
@@ -0,0 +1,355 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from user.models import TokenLedger, TokenUsage, UsageBatch, UsageOverdraft
+from .balance import InsufficientTokens, _lock_balances, get_balances
+
+logger = logging.getLogger(__name__)
+
+
+def apply_usage(batch, events):
+    """
+    Charge a batch of usage `events` ((user_id, amount, reference) tuples,
+    reference None when the client sent none) as one USAGE ledger entry per
+    user. Returns {user_id: balance after}.
+
+    Events whose reference the user already sent are skipped, and a batch
+    already applied is not charged again, so a flush retried after an error
+    or a client retrying a request never double counts. Only events with a
+    reference are kept, in TokenUsage.
+
+    Usage beyond the balance (spent meanwhile by another process) is charged
+    down to zero and the rest is kept in UsageOverdraft.
+    """
+    user_ids = sorted({user_id for user_id, _, _ in events})
+
+    with transaction.atomic():
+        _lock_balances(user_ids)
+        if UsageBatch.objects.filter(batch=batch).exists():
+            return get_balances(user_ids)
+        UsageBatch.objects.create(batch=batch)
+
+        TokenUsage.objects.bulk_create(
+            [TokenUsage(user_id=user_id, amount=amount, reference=reference, batch=batch)
+             for user_id, amount, reference in events if reference is not None],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        totals = Counter()
+        for user_id, amount, reference in events:
+            if reference is None:
+                totals[user_id] += amount
+        totals.update(dict(
+            TokenUsage.objects.filter(batch=batch)
+            .values('user')
+            .annotate(total=Sum('amount'))
+            .values_list('user', 'total')
+        ))
+
+        balances = get_balances(user_ids)
+        entries, overdrafts = [], []
+        for user_id, total in totals.items():
+            charged = min(total, max(balances[user_id], 0))
+            if charged:
+                entries.append(TokenLedger(
+                    user_id=user_id, amount=-charged, reason=TokenLedger.USAGE, reference=f"usage:{batch}"))
+                balances[user_id] -= charged
+            if total > charged:
+                overdrafts.append(UsageOverdraft(user_id=user_id, amount=total - charged, batch=batch))
+        TokenLedger.objects.bulk_create(entries)
+        UsageOverdraft.objects.bulk_create(overdrafts)
+    return balances
+
+
+def prune_usage(before, batch_size=1000):
+    """
+    Delete one batch of the TokenUsage and UsageBatch rows older than
+    `before`: references and batches that can't be replayed anymore.
+    Returns the number deleted.
+    """
+    ids = list(TokenUsage.objects.filter(created_at__lt=before).order_by('id')
+               .values_list('id', flat=True)[:batch_size])
+    TokenUsage.objects.filter(id__in=ids).delete()
+    batches = list(UsageBatch.objects.filter(applied_at__lt=before).values_list('batch', flat=True)[:batch_size])
+    UsageBatch.objects.filter(batch__in=batches).delete()
+    return len(ids) + len(batches)
+
+
+class UsageSegment:
+    """
+    The usage of one batch, appended to its journal file as it is recorded.
+    """
+
+    def __init__(self, batch, path, fd, events=None, fsync=False):
+        self.batch = batch
+        self.path = path
+        self.fd = fd
+        self.events = events if events is not None else []
+        self.fsync = fsync
+
+    def append(self, event):
+        os.write(self.fd, (json.dumps(event) + '\n').encode())
+        if self.fsync:
+            os.fsync(self.fd)
+        self.events.append(event)
+
+    def close(self):
+        os.close(self.fd)
+
+    def remove(self):
+        os.unlink(self.path)
+        self.close()
+
+
+class UsageJournal:
+    """
+    Usage accepted but not charged yet, one file per batch in `directory`.
+
+    A file is locked (flock) by the process writing it until the batch is
+    charged and the file removed. A file nobody holds was left by a process
+    that died, and `orphans()` hands it to be charged under the same batch
+    id. Without `fsync` the files outlive the process but not the host.
+    """
+
+    def __init__(self, directory, fsync=False):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+
+    def create(self):
+        batch = uuid.uuid4().hex
+        temp_path = self.directory / f'{batch}.tmp'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # Only visible to orphans() once locked
+        path = self.directory / f'{batch}.log'
+        os.rename(temp_path, path)
+        return UsageSegment(batch, path, fd, fsync=self.fsync)
+
+    def orphans(self):
+        """
+        Yield the segments of dead processes, locked until closed or removed.
+        """
+        for path in sorted(self.directory.glob('*.log')):
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            if os.fstat(fd).st_nlink == 0:
+                # Charged and removed by its process meanwhile
+                os.close(fd)
+                continue
+
+            events = []
+            for line in path.read_bytes().splitlines():
+                try:
+                    user_id, amount, reference = json.loads(line)
+                except (TypeError, ValueError):
+                    # Torn last line of a write cut short
+                    continue
+                events.append((user_id, amount, reference))
+            yield UsageSegment(path.stem, path, fd, events, fsync=self.fsync)
+
+
+class UsageMeter:
+    """
+    Per-process buffer of token usage. `record()` appends the event to this
+    process's current journal segment (one write to a local file, no query)
+    before it returns; a background thread charges the segments every
+    `flush_interval` seconds, or as soon as `max_batch` events are waiting.
+
+    Each user's known balance is cached for `balance_ttl` seconds and usage
+    is reserved against it, so a process never accepts more than the user
+    had. Processes don't see each other's buffers: the overlap is bounded by
+    one flush interval and settled by `apply_usage`.
+
+    Segments left by a process that was killed before charging them are
+    charged by the next meter using the same `journal_dir` (`recover()`,
+    which the background thread runs after every flush). A segment is
+    charged under its own batch id, so recovering one that was charged but
+    not removed yet doesn't count it twice.
+
+    With `flush_interval=None` nothing runs in the background: call
+    `flush()` and `recover()`.
+    """
+
+    def __init__(self, journal_dir, flush_interval=1.0, max_batch=5000, balance_ttl=5.0, fsync=False):
+        self.journal = UsageJournal(journal_dir, fsync=fsync)
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.balance_ttl = balance_ttl
+
+        self._segment = None  # UsageSegment being recorded
+        self._references = set()  # (user_id, reference) in the buffer
+        self._pending = Counter()  # user_id -> tokens recorded, not charged yet
+        self._balances = {}  # user_id -> (balance, loaded_at)
+        self._batches = []  # [UsageSegment] taken from the buffer, not applied yet
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _known_balance(self, user_id):
+        entry = self._balances.get(user_id)
+        if entry and entry[1] + self.balance_ttl > time.monotonic():
+            return entry[0]
+
+        loaded_at = time.monotonic()
+        balance = get_balances([user_id])[user_id]
+        with self._lock:
+            # A flush that finished meanwhile stored a newer balance
+            entry = self._balances.get(user_id)
+            if entry and entry[1] > loaded_at:
+                return entry[0]
+            self._balances[user_id] = (balance, loaded_at)
+        return balance
+
+    def record(self, user, amount, reference=None):
+        """
+        Reserve `amount` tokens of `user` and journal the usage. Recording a
+        `reference` already in the buffer is a no-op. Returns the tokens
+        left.
+
+        Raises:
+            InsufficientTokens: If the tokens left are lower than `amount`.
+        """
+        if amount <= 0:
+            raise ValueError("amount must be positive.")
+        user_id = user.pk
+        key = (user_id, reference)
+
+        balance = self._known_balance(user_id)
+        with self._lock:
+            available = balance - self._pending[user_id]
+            if reference is not None and key in self._references:
+                return available
+            if available < amount:
+                raise InsufficientTokens(f"User {user_id} has less than {amount} tokens.")
+
+            if self._segment is None:
+                self._segment = self.journal.create()
+            self._segment.append((user_id, amount, reference))
+            if reference is not None:
+                self._references.add(key)
+            self._pending[user_id] += amount
+            full = len(self._segment.events) >= self.max_batch
+
+        self._start()
+        if full:
+            self._wakeup.set()
+        return available - amount
+
+    def flush(self):
+        """
+        Charge everything recorded so far. A batch that fails stays queued
+        (and journaled) with the same id and is retried first on the next
+        flush. Returns the number of events written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._segment is not None:
+                    self._batches.append(self._segment)
+                    self._segment = None
+
+            written = 0
+            while self._batches:
+                segment = self._batches[0]
+                events = segment.events
+                balances = apply_usage(segment.batch, events)
+                self._batches.pop(0)
+                segment.remove()
+
+                totals = Counter()
+                for user_id, amount, _ in events:
+                    totals[user_id] += amount
+
+                now = time.monotonic()
+                with self._lock:
+                    for user_id, total in totals.items():
+                        self._pending[user_id] -= total
+                        if not self._pending[user_id]:
+                            del self._pending[user_id]
+                        self._balances[user_id] = (balances[user_id], now)
+                    self._references.difference_update(
+                        (user_id, reference) for user_id, _, reference in events if reference is not None)
+                    self._balances = {user_id: entry for user_id, entry in self._balances.items()
+                                      if entry[1] + self.balance_ttl > now}
+                written += len(events)
+            return written
+
+    def recover(self):
+        """
+        Charge the journal segments of processes that died before charging
+        them. Returns the number of events charged.
+        """
+        recovered = 0
+        with self._flush_lock:
+            for segment in self.journal.orphans():
+                try:
+                    if segment.events:
+                        apply_usage(segment.batch, segment.events)
+                except Exception:
+                    segment.close()
+                    raise
+                segment.remove()
+                recovered += len(segment.events)
+        return recovered
+
+    def _start(self):
+        if self._thread is not None or self.flush_interval is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="usage-meter", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                self.recover()
+            except Exception:
+                # The batches stay queued and journaled for the next flush
+                logger.exception("Usage meter flush failed")
+                # Start over with a fresh connection in case this one broke
+                connection.close()
+
+
+_meter = None
+_meter_lock = threading.Lock()
+
+
+def get_usage_meter():
+    global _meter
+
+    if _meter is None:
+        with _meter_lock:
+            if _meter is None:
+                _meter = UsageMeter(
+                    settings.TOKEN_METER_JOURNAL_DIR,
+                    flush_interval=settings.TOKEN_METER_FLUSH_INTERVAL,
+                    max_batch=settings.TOKEN_METER_MAX_BATCH,
+                    balance_ttl=settings.TOKEN_METER_BALANCE_TTL,
+                    fsync=settings.TOKEN_METER_FSYNC,
+                )
+    return _meter
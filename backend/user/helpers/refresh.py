@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RefreshCoalescer:
+    """
+    Runs one refresh per token at a time in this process: requests for a
+    token already being refreshed wait for that refresh and get its result
+    (or its error) instead of rotating the token again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+coalescer = RefreshCoalescer()
+
+
+def _wait_for(cache, key, lock_key, timeout):
+    # Until the process holding the lock stores the tokens or gives up
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        tokens = cache.get(key)
+        if tokens is not None or cache.get(lock_key) is None:
+            return tokens
+        time.sleep(0.05)
+    return None
+
+
+def refresh_once(raw_token, rotate):
+    """
+    `rotate()` (which refreshes `raw_token` and returns the new tokens), at
+    most once per token: concurrent requests in this process share its
+    result, requests in other processes wait for it (for up to
+    REFRESH_LOCK_TIMEOUT seconds), and for REFRESH_GRACE_PERIOD seconds
+    after it the same tokens are returned from the REFRESH_GRACE_CACHE
+    cache instead of failing because the token was just blacklisted.
+    """
+    cache = caches[settings.REFRESH_GRACE_CACHE]
+    key = 'user:refresh:' + hashlib.sha256(raw_token.encode()).hexdigest()
+    lock_key = key + ':lock'
+
+    def rotate_and_remember():
+        tokens = cache.get(key)
+        if tokens is not None or not settings.REFRESH_GRACE_PERIOD:
+            return tokens or rotate()
+
+        owner = uuid.uuid4().hex
+        if not cache.add(lock_key, owner, timeout=settings.REFRESH_LOCK_TIMEOUT):
+            tokens = _wait_for(cache, key, lock_key, settings.REFRESH_LOCK_TIMEOUT)
+            if tokens is not None:
+                return tokens
+        try:
+            tokens = rotate()
+            cache.set(key, tokens, timeout=settings.REFRESH_GRACE_PERIOD)
+            return tokens
+        finally:
+            # Unless it expired and another process took it meanwhile
+            if cache.get(lock_key) == owner:
+                cache.delete(lock_key)
+
+    tokens = cache.get(key)
+    if tokens is None:
+        tokens = coalescer.run(key, rotate_and_remember)
+    return dict(tokens)
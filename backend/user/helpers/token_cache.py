@@ -0,0 +1,98 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+class _Entry:
+    __slots__ = ('token_class', 'payload', 'exp')
+
+    def __init__(self, token_class, payload, exp):
+        self.token_class = token_class
+        self.payload = payload
+        self.exp = exp
+
+
+class ValidatedTokenCache:
+    """
+    LRU cache of access tokens already verified in this process, so a
+    client sending the same token on every request pays for the signature
+    check and decoding once. Entries are keyed by a digest of the token
+    (the token itself is not kept) and dropped when the token expires.
+
+    `maxsize=0` disables the cache.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(raw_token):
+        return hashlib.sha256(raw_token if isinstance(raw_token, bytes) else raw_token.encode()).digest()
+
+    def get(self, raw_token):
+        """
+        A validated token equal to the one `raw_token` decoded to when it
+        was added, or None.
+        """
+        if self.maxsize <= 0:
+            self.misses += 1
+            return None
+
+        key = self._key(raw_token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.exp <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        token = entry.token_class.__new__(entry.token_class)
+        token.token = raw_token
+        token.current_time = aware_utcnow()
+        token.payload = dict(entry.payload)
+        return token
+
+    def add(self, raw_token, token):
+        if self.maxsize <= 0 or 'exp' not in token.payload:
+            return
+
+        entry = _Entry(type(token), dict(token.payload), token.payload['exp'])
+        key = self._key(raw_token)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    global _token_cache
+
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                _token_cache = ValidatedTokenCache(maxsize=settings.ACCESS_TOKEN_CACHE_SIZE)
+    return _token_cache
@@ -0,0 +1,34 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from user.helpers.balance import compact_ledger
+from user.helpers.metering import prune_usage
+
+
+class Command(BaseCommand):
+    help = ("Fold token ledger entries into the per-user balance snapshots and prune usage references "
+            "older than TOKEN_USAGE_RETENTION.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep running, compacting every N seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            compacted = compact_ledger(options['batch_size'])
+            self.stdout.write(f"Compacted {compacted} balances.")
+
+            before = timezone.now() - timedelta(seconds=settings.TOKEN_USAGE_RETENTION)
+            pruned = 0
+            while deleted := prune_usage(before, options['batch_size']):
+                pruned += deleted
+            self.stdout.write(f"Pruned {pruned} usage records.")
+
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
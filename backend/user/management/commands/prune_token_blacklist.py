@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from user.helpers.blacklist import prune_expired_tokens
+
+
+class Command(BaseCommand):
+    help = "Delete expired refresh tokens from the outstanding and blacklisted token tables, in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep running, pruning every N seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            pruned = 0
+            while deleted := prune_expired_tokens(options['batch_size']):
+                pruned += deleted
+                if deleted < options['batch_size']:
+                    break
+            self.stdout.write(f"Pruned {pruned} expired tokens.")
+
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
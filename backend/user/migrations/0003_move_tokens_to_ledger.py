@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:38
+
+from django.db import migrations
+from django.db.models import Sum
+
+
+def tokens_to_ledger(apps, schema_editor):
+    CustomUser = apps.get_model('user', 'CustomUser')
+    TokenLedger = apps.get_model('user', 'TokenLedger')
+    TokenBalance = apps.get_model('user', 'TokenBalance')
+
+    users = CustomUser.objects.exclude(tokens__isnull=True).exclude(tokens=0).values_list('id', 'tokens')
+    for user_id, tokens in users.iterator(chunk_size=2000):
+        entry = TokenLedger.objects.create(user_id=user_id, amount=tokens, reason='opening')
+        TokenBalance.objects.create(user_id=user_id, balance=tokens, last_entry_id=entry.id)
+
+
+def ledger_to_tokens(apps, schema_editor):
+    CustomUser = apps.get_model('user', 'CustomUser')
+    TokenLedger = apps.get_model('user', 'TokenLedger')
+
+    balances = TokenLedger.objects.values('user').annotate(total=Sum('amount')).order_by()
+    for row in balances.iterator(chunk_size=2000):
+        CustomUser.objects.filter(pk=row['user']).update(tokens=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0002_tokenledger_tokenbalance'),
+    ]
+
+    operations = [
+        migrations.RunPython(tokens_to_ledger, ledger_to_tokens),
+    ]
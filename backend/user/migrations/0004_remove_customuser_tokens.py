@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:38
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0003_move_tokens_to_ledger'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='customuser',
+            name='tokens',
+        ),
+    ]
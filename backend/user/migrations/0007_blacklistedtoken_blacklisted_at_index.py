@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # RefreshTokenBlacklist.sync() reads the recently blacklisted tokens
+    # every second; simplejwt doesn't index that column.
+
+    dependencies = [
+        ('user', '0006_claimsuser_customuser_token_version'),
+        ('token_blacklist', '0012_alter_outstandingtoken_user'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX token_blacklist_blacklisted_at_idx ON token_blacklist_blacklistedtoken (blacklisted_at)',
+            reverse_sql='DROP INDEX token_blacklist_blacklisted_at_idx',
+        ),
+    ]
@@ -1,12 +1,13 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
-from django.db import models
-from helpers.email import send_email
+from django.db import models, transaction
+from django.db.models import F
+from mailing.services import enqueue_email
 
 from django.utils import timezone
 import string
 import secrets
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 
@@ -41,13 +42,12 @@ class OtpCode(models.Model):
         self.expiry_date = expiry_date
         self.save()
 
-        sent = send_email("OTP", self.email, context={
+        # Delivered by the outbox worker, outside the request
+        enqueued = enqueue_email("OTP", self.email, context={
             "email": self.email,
             "otp": self.otp})
 
-
-       
-        return sent
+        return enqueued
 
     def validate_otp(self, code, action_type, delete_otp=False):
         
@@ -77,7 +77,50 @@ class OtpCode(models.Model):
 
 
 
-class CustomUserManager(BaseUserManager):
+class CustomUserQuerySet(models.QuerySet):
+    """
+    `update()` and `bulk_update()` of versioned fields bump `token_version`
+    like `CustomUser.save()` does, so bulk changes (e.g. deactivating users
+    from the admin) revoke the claims of the affected users too.
+    """
+
+    def _publish(self, pks):
+        from .helpers.claims import publish_token_version
+
+        versions = dict(self.model._base_manager.using(self.db).filter(pk__in=pks).values_list(
+            'pk', 'token_version'))
+        for pk, version in versions.items():
+            publish_token_version(pk, version)
+        return versions
+
+    def update(self, **kwargs):
+        if not set(kwargs) & set(self.model.VERSIONED_FIELDS):
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            # The filter may not match the rows anymore once updated
+            pks = list(self.values_list('pk', flat=True))
+            rows = super().update(token_version=F('token_version') + 1, **kwargs)
+            self._publish(pks)
+        return rows
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        if not set(fields) & set(self.model.VERSIONED_FIELDS):
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+
+        with transaction.atomic(using=self.db):
+            pks = [obj.pk for obj in objs]
+            rows = super().bulk_update(objs, fields, batch_size=batch_size)
+            self.model._base_manager.using(self.db).filter(pk__in=pks).update(
+                token_version=F('token_version') + 1)
+            versions = self._publish(pks)
+        for obj in objs:
+            # So saving it later doesn't write the old version back
+            obj.token_version = versions.get(obj.pk, obj.token_version)
+        return rows
+
+
+class CustomUserManager(BaseUserManager.from_queryset(CustomUserQuerySet)):
     def create_user(self, email, password=None, **extra_fields):
         if not email:
             raise ValueError('Email is required.')
@@ -115,18 +158,48 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     is_staff = models.BooleanField(default=False)
     date_joined = models.DateTimeField(auto_now_add=True)
     paypal_id = models.CharField(max_length=500, blank=True, null=True)
-    tokens = models.IntegerField(null=True, blank=True, default=0)
     verified = models.BooleanField(default=False)
     premium = models.BooleanField(default=False)
+    # Bumped whenever a field access tokens rely on changes, by save() and
+    # by QuerySet.update() / bulk_update() (see CustomUserQuerySet)
+    token_version = models.PositiveIntegerField(default=0)
 
     objects = CustomUserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
+    VERSIONED_FIELDS = ('email', 'password', 'verified', 'premium', 'is_active', 'is_staff', 'is_superuser')
+
     def __str__(self):
         return self.email
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_versioned_fields()
+        return instance
+
+    def _remember_versioned_fields(self):
+        # Only loaded fields: reading deferred ones here would query them
+        self._versioned = {field: self.__dict__[field] for field in self.VERSIONED_FIELDS if field in self.__dict__}
+
+    def save(self, *args, **kwargs):
+        from .helpers.claims import publish_token_version
+
+        versioned = getattr(self, '_versioned', {})
+        changed = any(self.__dict__.get(field, value) != value for field, value in versioned.items())
+        if changed:
+            self.token_version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'token_version'}
+
+        super().save(*args, **kwargs)
+
+        self._remember_versioned_fields()
+        if changed:
+            publish_token_version(self.pk, self.token_version)
+
     def change_password(self, user, new_password):
         # Custom password validation
         if len(new_password) < 8:
@@ -149,6 +222,34 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         user.save()
 
 
+class ClaimsUser(CustomUser):
+    """
+    A CustomUser built from the claims of an access token, without a
+    query. Reading any other field loads all the missing ones at once.
+    """
+
+    class Meta:
+        proxy = True
+
+    @classmethod
+    def from_claims(cls, user_id, claims):
+        from .helpers.claims import CLAIM_FIELDS, VERSION_CLAIM
+
+        values = {'id': user_id, 'token_version': claims[VERSION_CLAIM]}
+        values.update((field, claims[field]) for field in CLAIM_FIELDS)
+        return cls.from_db('default', list(values), [
+            values[field.attname] for field in cls._meta.concrete_fields if field.attname in values])
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred.issuperset(fields):
+            fields = deferred
+        super().refresh_from_db(using, fields, **kwargs)
+        # Keep the snapshot of the fields already loaded, they may have been changed
+        self._versioned.update((field, self.__dict__[field]) for field in self.VERSIONED_FIELDS
+                               if field in deferred and field in self.__dict__)
+
+
 class UserPreferences(models.Model):
 
     LANGUAGE_CHOICES = [
@@ -169,9 +270,113 @@ class WhitelistData(models.Model):
     email = models.CharField(max_length=200)
     date_joined = models.DateTimeField(auto_now_add=True)
 
+class TokenLedger(models.Model):
+    """
+    Append-only history of token credits (positive) and debits (negative).
+    The balance is TokenBalance plus the entries after its `last_entry_id`.
+    """
+
+    PURCHASE = 'purchase'
+    USAGE = 'usage'
+    ADJUSTMENT = 'adjustment'
+    OPENING = 'opening'
+    REASON_CHOICES = [
+        (PURCHASE, 'Purchase'),
+        (USAGE, 'Usage'),
+        (ADJUSTMENT, 'Adjustment'),
+        (OPENING, 'Opening balance'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    amount = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    reference = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.amount:+d} | {self.reason}"
+
+
+class TokenBalance(models.Model):
+    """
+    Compacted balance of the ledger up to `last_entry_id`. Debits also lock
+    this row, so two of them can't spend the same tokens.
+    """
+
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='token_balance')
+    balance = models.IntegerField(default=0)
+    last_entry_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user} | {self.balance}"
+
+
+class TokenUsage(models.Model):
+    """
+    A metered usage event sent with a client reference, written in batches
+    by the usage meter. The reference is unique per user, so replaying the
+    event (e.g. a retried request) is a no-op until it is pruned after
+    TOKEN_USAGE_RETENTION. Events without a reference are only charged.
+    """
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField()
+    reference = models.CharField(max_length=100)
+    batch = models.CharField(max_length=32, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'reference'], name='unique_token_usage_reference'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.amount} | {self.reference}"
+
+
+class UsageBatch(models.Model):
+    """
+    A usage meter batch already charged, so charging it again after a retry
+    or a restart is a no-op. Pruned after TOKEN_USAGE_RETENTION.
+    """
+
+    batch = models.CharField(max_length=32, primary_key=True)
+    applied_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.batch
+
+
+class UsageOverdraft(models.Model):
+    """
+    Metered usage that was accepted but not charged because the balance ran
+    out first (spent meanwhile by another process).
+    """
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField()
+    batch = models.CharField(max_length=32)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user} {self.amount} | {self.batch}"
+
+
 @receiver(post_save, sender=CustomUser)
 def create_user_utils_models(sender, instance, created, **kwargs):
     if created:
 
         OtpCode.objects.get_or_create(email=instance.email)
         UserPreferences.objects.create(user=instance)
+
+
+@receiver(post_delete, sender=CustomUser)
+def expire_user_tokens(sender, instance, **kwargs):
+    from .helpers.claims import publish_token_version
+    publish_token_version(instance.pk, instance.token_version + 1)
@@ -1,11 +1,17 @@
+from functools import partial
+
 from rest_framework import serializers
 from .models import OtpCode, CustomUser, UserPreferences
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from django.contrib.auth import authenticate
 from .helpers.sms import send_sms, verify_otp_sms
 from django.core.validators import EmailValidator
 from .helpers.validators import is_not_registered, is_registered, validate_password, validate_register_type
-from helpers.email import send_email
+from .helpers.balance import get_balance
+from .helpers.claims import add_user_claims
+from .helpers.refresh import refresh_once
+from .authentication import ClaimsRefreshToken
+from mailing.services import enqueue_email
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
@@ -13,9 +19,14 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         token = super().get_token(user)
 
         # Add custom claims
-        token['email'] = user.email
+        return add_user_claims(token, user)
+
 
-        return token
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = ClaimsRefreshToken
+
+    def validate(self, attrs):
+        return refresh_once(attrs['refresh'], partial(super().validate, attrs))
 
 
 class PasswordSerializer(serializers.Serializer):
@@ -46,12 +57,15 @@ class CustomUserStatusSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(label="Email")
     verified = serializers.BooleanField(label="Verified")
     premium = serializers.BooleanField(label="Premium")
-    tokens = serializers.IntegerField(label="Tokens")
+    tokens = serializers.SerializerMethodField(label="Tokens")
 
     class Meta:
         model = CustomUser
         fields = ('email', 'verified', 'premium', 'tokens')
 
+    def get_tokens(self, user):
+        return get_balance(user)
+
 
 class UserPreferencesSerializer(serializers.ModelSerializer):
     language = serializers.ChoiceField(choices=UserPreferences.LANGUAGE_CHOICES, label="Language")
@@ -88,7 +102,7 @@ class RegisterEmailSerializer(serializers.Serializer):
         tokens = MyTokenObtainPairSerializer().get_token(user_authenticated)
 
         # send welcome email
-        send_email("register", email, context={
+        enqueue_email("register", email, context={
             "email": email})
 
 
@@ -121,7 +135,7 @@ class ChangePasswordForgotSerializer(OTPForgotSerializer, PasswordSerializer):
 class UserDataSerializer(serializers.ModelSerializer):
     
     email = serializers.EmailField(label="Email")
-    tokens = serializers.IntegerField(label="Tokens")
+    tokens = serializers.SerializerMethodField(label="Tokens")
     verified = serializers.BooleanField(label="Verified")
     num = serializers.IntegerField(label="Phone")
     date_joined = serializers.DateTimeField(label="Date Joined")
@@ -130,6 +144,9 @@ class UserDataSerializer(serializers.ModelSerializer):
         model = CustomUser
         fields = ['email', 'tokens', 'verified', 'num', 'date_joined']
 
+    def get_tokens(self, user):
+        return get_balance(user)
+
     def get_fields(self):
         fields = super().get_fields()
         requested_fields = self.context.get('requested_fields', None)
@@ -161,20 +178,24 @@ class ContactMeSerializer(serializers.Serializer):
     subject = serializers.CharField(max_length=100, label="Subject")
     msg = serializers.CharField(max_length=1000, label="Message")
 
+
+class UsageSerializer(serializers.Serializer):
+    amount = serializers.IntegerField(min_value=1, label="Amount")
+    reference = serializers.CharField(max_length=100, required=False, label="Reference")
+
     
 class NumberSerializer(serializers.Serializer):
     user_num = serializers.CharField(max_length=20, label="Phone")
 
     def validate(self, data):
         user = self.context.get("user")
-        custom_user = CustomUser.objects.get(id=user.id)
         user_num = data.get('user_num')
         
 
         if CustomUser.objects.filter(num=user_num).exists():
             raise serializers.ValidationError("Num already verified.")
 
-        if custom_user.verified:
+        if user.verified:
             raise serializers.ValidationError("User already verified.")
         
         return user_num
@@ -1,12 +1,25 @@
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import cache, caches
 from rest_framework.test import APITestCase
 from faker import Faker
 from django.urls import reverse
 from rest_framework import status
+from ..helpers.blacklist import RefreshTokenBlacklist
 from ..models import CustomUser
 faker = Faker()
 
 class SetUpAuthUser(APITestCase):
     def setUp(self):
+        # Token versions published for users of other tests (ids are reused)
+        cache.clear()
+        caches[settings.USER_TOKEN_VERSION_CACHE].clear()
+        # The bloom filter is loaded by sync(), not by a background thread
+        self.blacklist = RefreshTokenBlacklist(sync_interval=None)
+        patcher = patch("user.authentication.get_refresh_blacklist", return_value=self.blacklist)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.login_url = reverse("auth_credentials")
         self.email = 'francocraftero78@gmail.com'
         self.user = CustomUser.objects.create_superuser(
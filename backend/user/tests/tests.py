@@ -1,10 +1,45 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import Mock, patch
+
+import requests
+import rsa
+from google.auth import crypt, jwt
+
 from .setup import SetUpAuthUser
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import call_command
+from django.db import connection
 from django.shortcuts import get_object_or_404
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from rest_framework.test import APITestCase
 from faker import Faker
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from ..models import CustomUser, OtpCode
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from ..authentication import ClaimsJWTAuthentication
+from ..checks import check_refresh_grace_cache, check_shared_cache_is_not_file_based, check_token_version_cache
+from ..models import ClaimsUser, CustomUser, OtpCode, TokenLedger, TokenBalance, TokenUsage, UsageBatch, UsageOverdraft
+from ..helpers.balance import credit_tokens, debit_tokens, get_balance, compact_ledger, InsufficientTokens
+from ..helpers.metering import UsageMeter, apply_usage
+from ..helpers.token_cache import ValidatedTokenCache
+from ..helpers.blacklist import BloomFilter, RefreshTokenBlacklist, prune_expired_tokens
+from ..helpers.refresh import RefreshCoalescer, refresh_once
+from ..helpers.google import GoogleCertCache, verify_google_id_token
+from ..helpers.auth import check_google_credentials, get_google_id_info
 fake = Faker()
 
 
@@ -591,3 +626,738 @@ class TestSendOtpSMS(SetUpAuthUser):
 
 
 """
+
+
+class TestTokenBalance(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="balance@example.com", password="Balance123")
+
+    def test_credit_and_debit(self):
+        self.assertEqual(credit_tokens(self.user, 10), 10)
+        self.assertEqual(debit_tokens(self.user, 4), 6)
+        self.assertEqual(get_balance(self.user), 6)
+        self.assertEqual(list(TokenLedger.objects.values_list('amount', flat=True).order_by('id')), [10, -4])
+
+    def test_debit_refuses_to_go_negative(self):
+        credit_tokens(self.user, 3)
+
+        with self.assertRaises(InsufficientTokens):
+            debit_tokens(self.user, 4)
+        self.assertEqual(get_balance(self.user), 3)
+
+    def test_compaction(self):
+        credit_tokens(self.user, 10)
+        debit_tokens(self.user, 3)
+
+        with override_settings(TOKEN_LEDGER_COMPACTION_DELAY=-60):
+            self.assertEqual(compact_ledger(), 1)
+            self.assertEqual(compact_ledger(), 0)
+
+        snapshot = TokenBalance.objects.get(user=self.user)
+        self.assertEqual(snapshot.balance, 7)
+        self.assertEqual(snapshot.last_entry_id, TokenLedger.objects.latest('id').id)
+
+        credit_tokens(self.user, 5)
+        self.assertEqual(get_balance(self.user), 12)
+
+    def test_recent_entries_are_not_compacted(self):
+        credit_tokens(self.user, 10)
+
+        self.assertEqual(compact_ledger(), 0)
+        self.assertEqual(get_balance(self.user), 10)
+
+
+class TestTokenBalanceConcurrency(TransactionTestCase):
+
+    def test_concurrent_updates_are_not_lost(self):
+        user = CustomUser.objects.create_user(email="balance@example.com", password="Balance123")
+        credit_tokens(user, 100)
+
+        def work(i):
+            try:
+                if i % 2:
+                    credit_tokens(user, 3)
+                else:
+                    debit_tokens(user, 1)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(work, range(200)))
+
+        self.assertEqual(get_balance(user), 100 + 100 * 3 - 100)
+
+    def test_concurrent_debits_never_overdraw(self):
+        user = CustomUser.objects.create_user(email="balance@example.com", password="Balance123")
+        credit_tokens(user, 50)
+
+        def work(_):
+            try:
+                debit_tokens(user, 1)
+                return True
+            except InsufficientTokens:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(work, range(80)))
+
+        self.assertEqual(results.count(True), 50)
+        self.assertEqual(get_balance(user), 0)
+
+
+class TestUsageMeter(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="usage@example.com", password="Usage1234")
+        credit_tokens(self.user, 10)
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir)
+        self.meter = UsageMeter(self.journal_dir, flush_interval=None)
+
+    def test_usage_is_flushed_as_one_debit(self):
+        for _ in range(3):
+            self.meter.record(self.user, 2)
+        self.assertEqual(get_balance(self.user), 10)
+
+        self.assertEqual(self.meter.flush(), 3)
+        self.assertEqual(get_balance(self.user), 4)
+        self.assertEqual(TokenLedger.objects.filter(reason=TokenLedger.USAGE).count(), 1)
+        self.assertFalse(TokenUsage.objects.exists())
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_usage_of_killed_process_is_recovered(self):
+        self.meter.record(self.user, 2)
+        self.meter.record(self.user, 3, reference="req-1")
+        other = UsageMeter(self.journal_dir, flush_interval=None)
+
+        # Still held by a live process
+        self.assertEqual(other.recover(), 0)
+
+        # The process dies without flushing: its lock goes with it
+        self.meter._segment.close()
+        self.assertEqual(other.recover(), 2)
+        self.assertEqual(get_balance(self.user), 5)
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_recovered_batch_is_not_charged_twice(self):
+        self.meter.record(self.user, 2)
+        segment = self.meter._segment
+        apply_usage(segment.batch, segment.events)
+
+        # Charged, but killed before removing the segment
+        segment.close()
+        UsageMeter(self.journal_dir, flush_interval=None).recover()
+        self.assertEqual(get_balance(self.user), 8)
+
+    def test_reservation_enforces_balance(self):
+        self.assertEqual(self.meter.record(self.user, 8), 2)
+
+        with self.assertRaises(InsufficientTokens):
+            self.meter.record(self.user, 3)
+        self.meter.flush()
+        self.assertEqual(get_balance(self.user), 2)
+
+    def test_repeated_reference_is_counted_once(self):
+        self.meter.record(self.user, 4, reference="req-1")
+        self.meter.record(self.user, 4, reference="req-1")
+        self.meter.flush()
+
+        # A restarted worker sees the same request again
+        UsageMeter(self.journal_dir, flush_interval=None).record(self.user, 4, reference="req-1")
+        self.meter.flush()
+        self.assertEqual(get_balance(self.user), 6)
+
+    def test_reference_is_per_user(self):
+        other = CustomUser.objects.create_user(email="other-usage@example.com", password="Usage1234")
+        credit_tokens(other, 10)
+
+        self.meter.record(self.user, 4, reference="req-1")
+        self.meter.record(other, 3, reference="req-1")
+        self.meter.flush()
+
+        self.assertEqual(get_balance(self.user), 6)
+        self.assertEqual(get_balance(other), 7)
+
+    def test_retried_batch_is_not_charged_twice(self):
+        events = [(self.user.pk, 3, "a"), (self.user.pk, 2, "b")]
+
+        self.assertEqual(apply_usage("batch-1", events), {self.user.pk: 5})
+        self.assertEqual(apply_usage("batch-1", events), {self.user.pk: 5})
+        self.assertEqual(get_balance(self.user), 5)
+
+    def test_overlapping_processes_never_overdraw(self):
+        other = UsageMeter(self.journal_dir, flush_interval=None)
+        self.meter.record(self.user, 7)
+        other.record(self.user, 7)
+
+        self.meter.flush()
+        other.flush()
+        self.assertEqual(get_balance(self.user), 0)
+        self.assertEqual(UsageOverdraft.objects.get().amount, 4)
+
+    def test_old_references_are_pruned(self):
+        self.meter.record(self.user, 1, reference="req-1")
+        self.meter.flush()
+
+        call_command("compact_token_ledger", stdout=StringIO())
+        self.assertEqual(TokenUsage.objects.count(), 1)
+
+        with override_settings(TOKEN_USAGE_RETENTION=-1):
+            call_command("compact_token_ledger", stdout=StringIO())
+        self.assertFalse(TokenUsage.objects.exists())
+        self.assertFalse(UsageBatch.objects.exists())
+
+
+class TestRecordUsage(SetUpAuthUser):
+
+    def setUp(self):
+        super().setUp()
+        credit_tokens(self.user, 5)
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir)
+        self.meter = UsageMeter(journal_dir, flush_interval=None)
+        patcher = patch("user.views.get_usage_meter", return_value=self.meter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = reverse("record_usage")
+        self.headers = {'Authorization': f'Bearer {self.token}'}
+
+    def test_record_usage(self):
+        response = self.client.post(self.url, {'amount': 3}, format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data.get("tokens"), 2)
+
+        self.meter.flush()
+        self.assertEqual(get_balance(self.user), 2)
+
+    def test_not_enough_tokens(self):
+        response = self.client.post(self.url, {'amount': 6}, format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data.get("msg"), "Not enough tokens.")
+
+    def test_invalid_amount(self):
+        response = self.client.post(self.url, {'amount': 0}, format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestClaimsAuthentication(SetUpAuthUser):
+
+    def setUp(self):
+        super().setUp()
+        self.authentication = ClaimsJWTAuthentication()
+
+    def get_user(self, token):
+        return self.authentication.get_user(AccessToken(token))
+
+    def refresh(self):
+        response = self.client.post(reverse("auth_refresh"), {'refresh': self.refresh_token}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data.get("access")
+
+    def test_user_from_claims(self):
+        with self.assertNumQueries(0):
+            user = self.get_user(self.token)
+            self.assertIsInstance(user, ClaimsUser)
+            self.assertEqual((user.id, user.email, user.verified, user.premium),
+                             (self.user.id, self.user.email, True, False))
+
+        # Other fields are loaded together, on first access
+        with self.assertNumQueries(1):
+            self.assertEqual(user.first_name, "Developer")
+            self.assertTrue(user.is_superuser)
+            self.assertIsNone(user.num)
+
+    def test_authenticated_request_without_user_query(self):
+        response = self.client.get(reverse("user_data") + '?fields=email,verified',
+                                   headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            self.client.get(reverse("user_data") + '?fields=email,verified',
+                            headers={'Authorization': f'Bearer {self.token}'})
+
+    def test_changed_user_falls_back_to_database(self):
+        self.user.verified = False
+        self.user.save()
+        self.assertEqual(self.user.token_version, 1)
+
+        with self.assertNumQueries(1):
+            user = self.get_user(self.token)
+        self.assertNotIsInstance(user, ClaimsUser)
+        self.assertFalse(user.verified)
+
+    def test_unrelated_change_keeps_claims(self):
+        self.user.first_name = "Other"
+        self.user.save()
+        self.assertEqual(self.user.token_version, 0)
+        self.assertIsInstance(self.get_user(self.token), ClaimsUser)
+
+    def test_change_of_lazy_user(self):
+        user = self.get_user(self.token)
+        user.num = "+5491100000000"
+        user.premium = True
+        user.save()
+
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.num, self.user.premium, self.user.token_version), ("+5491100000000", True, 1))
+        self.assertNotIsInstance(self.get_user(self.token), ClaimsUser)
+
+    def test_refresh_with_current_claims(self):
+        self.user.premium = True
+        self.user.save()
+
+        access = self.refresh()
+        self.assertEqual((AccessToken(access)['premium'], AccessToken(access)['ver']), (True, 1))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.get_user(access).premium)
+
+    def test_deactivated_in_other_process(self):
+        # The other worker's client of the shared cache
+        other_process = FileBasedCache(settings.CACHES['shared']['LOCATION'], {})
+        with patch("user.helpers.claims._cache", return_value=other_process):
+            self.user.is_active = False
+            self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.get_user(self.token)
+
+    def test_deactivated_with_queryset_update(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        with self.assertRaises(AuthenticationFailed):
+            self.get_user(self.token)
+
+    def test_deactivated_with_bulk_update(self):
+        self.user.is_active = False
+        CustomUser.objects.bulk_update([self.user], ['is_active'])
+
+        with self.assertRaises(AuthenticationFailed):
+            self.get_user(self.token)
+        self.assertEqual(self.user.token_version, CustomUser.objects.get(pk=self.user.pk).token_version)
+
+    def test_inactive_claim_rejected(self):
+        access = AccessToken(self.token)
+        access['is_active'] = False
+
+        with self.assertNumQueries(0), self.assertRaises(AuthenticationFailed):
+            self.authentication.get_user(access)
+
+    def test_deleted_user(self):
+        self.user.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.get_user(self.token)
+
+    def test_unknown_version_read_from_database(self):
+        caches[settings.USER_TOKEN_VERSION_CACHE].clear()
+        with self.assertNumQueries(1):
+            self.assertIsInstance(self.get_user(self.token), ClaimsUser)
+        with self.assertNumQueries(0):
+            self.get_user(self.token)
+
+        CustomUser.objects.filter(pk=self.user.pk).delete()
+        caches[settings.USER_TOKEN_VERSION_CACHE].clear()
+        with self.assertRaises(AuthenticationFailed):
+            self.get_user(self.token)
+
+    @override_settings(USER_TOKEN_VERSION_CACHE='default')
+    def test_process_local_cache_not_trusted(self):
+        with self.assertNumQueries(1):
+            user = self.get_user(self.token)
+        self.assertNotIsInstance(user, ClaimsUser)
+        self.assertEqual([error.id for error in check_token_version_cache(None)], ['user.W001'])
+
+    def test_file_cache_is_single_host(self):
+        self.assertEqual([error.id for error in check_shared_cache_is_not_file_based(None)], ['user.W002'])
+
+    def test_refresh_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.post(reverse("auth_refresh"), {'refresh': self.refresh_token}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        with self.assertRaises(AuthenticationFailed):
+            self.get_user(self.token)
+
+
+class TestValidatedTokenCache(SetUpAuthUser):
+
+    def setUp(self):
+        super().setUp()
+        self.token_cache = ValidatedTokenCache(maxsize=2)
+        self.authentication = ClaimsJWTAuthentication(token_cache=self.token_cache)
+
+    def test_token_validated_once(self):
+        with patch.object(AccessToken, "verify", autospec=True) as verify:
+            first = self.authentication.get_validated_token(self.token.encode())
+            second = self.authentication.get_validated_token(self.token.encode())
+
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual((self.token_cache.hits, self.token_cache.misses), (1, 1))
+        self.assertIsInstance(second, AccessToken)
+        self.assertEqual(second.payload, first.payload)
+        self.assertEqual(second['user_id'], self.user.id)
+
+    def test_invalid_token_not_cached(self):
+        token = self.token[:-2] + ('AA' if not self.token.endswith('AA') else 'BB')
+        for _ in range(2):
+            with self.assertRaises(InvalidToken):
+                self.authentication.get_validated_token(token.encode())
+        self.assertEqual(len(self.token_cache), 0)
+
+    def test_expired_token_dropped(self):
+        self.authentication.get_validated_token(self.token.encode())
+        exp = AccessToken(self.token)['exp']
+
+        with patch("user.helpers.token_cache.time.time", return_value=exp):
+            self.assertIsNone(self.token_cache.get(self.token.encode()))
+        self.assertEqual(len(self.token_cache), 0)
+
+    def test_least_recently_used_evicted(self):
+        tokens = [self.token] + [str(AccessToken.for_user(self.user)) for _ in range(2)]
+        self.token_cache.add(tokens[0], AccessToken(tokens[0]))
+        self.token_cache.add(tokens[1], AccessToken(tokens[1]))
+        self.token_cache.get(tokens[0])
+        self.token_cache.add(tokens[2], AccessToken(tokens[2]))
+
+        self.assertIsNotNone(self.token_cache.get(tokens[0]))
+        self.assertIsNone(self.token_cache.get(tokens[1]))
+        self.assertIsNotNone(self.token_cache.get(tokens[2]))
+
+    def test_disabled(self):
+        token_cache = ValidatedTokenCache(maxsize=0)
+        token_cache.add(self.token, AccessToken(self.token))
+        self.assertIsNone(token_cache.get(self.token))
+        self.assertEqual((len(token_cache), token_cache.misses), (0, 1))
+
+
+class TestBloomFilter(SimpleTestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        keys = [f"jti-{i}" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertGreater(bloom.count, 950)  # keys that were false positives aren't counted
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+@override_settings(REFRESH_GRACE_PERIOD=0)  # reused tokens go to the blacklist check
+class TestRefreshTokenBlacklist(SetUpAuthUser):
+
+    def refresh(self, refresh_token):
+        return self.client.post(reverse("auth_refresh"), {'refresh': refresh_token}, format='json')
+
+    def jti(self, token):
+        return RefreshToken(token, verify=False)['jti']
+
+    def test_rotated_token_blacklisted(self):
+        response = self.refresh(self.refresh_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(BlacklistedToken.objects.filter(token__jti=self.jti(self.refresh_token)).exists())
+        # The login token's outstanding row is reused
+        self.assertEqual(OutstandingToken.objects.get(jti=self.jti(self.refresh_token)).user, self.user)
+
+        caches[settings.REFRESH_GRACE_CACHE].clear()
+        self.assertEqual(self.refresh(self.refresh_token).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.refresh(response.data['refresh']).status_code, status.HTTP_200_OK)
+
+    def test_membership_from_bloom_filter(self):
+        self.blacklist.add("revoked", "token", self.user.id, timezone.now() + timedelta(days=1))
+        self.blacklist.sync()
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.blacklist.contains("unknown"))
+        with self.assertNumQueries(1):  # confirmed in the database
+            self.assertTrue(self.blacklist.contains("revoked"))
+
+    def test_other_processes_tokens_seen_before_sync(self):
+        self.blacklist.sync()
+        other = RefreshTokenBlacklist(sync_interval=None)
+        other.add("elsewhere", "token", self.user.id, timezone.now() + timedelta(days=1))
+
+        self.assertTrue(self.blacklist.contains("elsewhere"))  # from the shared cache
+        caches[settings.REFRESH_BLACKLIST_CACHE].clear()
+        self.blacklist.sync()
+        self.assertTrue(self.blacklist.contains("elsewhere"))
+
+    def test_database_checked_when_filter_is_stale(self):
+        self.blacklist.sync()
+        self.blacklist_row("stale")
+
+        later = time.monotonic() + self.blacklist.recent_ttl
+        with patch("user.helpers.blacklist.time.monotonic", return_value=later):
+            self.assertTrue(self.blacklist.contains("stale"))
+
+    @override_settings(REFRESH_BLACKLIST_CACHE='default')
+    def test_database_checked_without_shared_cache(self):
+        blacklist = RefreshTokenBlacklist(sync_interval=None, cache=settings.REFRESH_BLACKLIST_CACHE)
+        blacklist.sync()
+        with self.assertNumQueries(1):
+            self.assertFalse(blacklist.contains("unknown"))
+
+    def blacklist_row(self, jti, row_id=None):
+        token = OutstandingToken.objects.create(jti=jti, token="token", expires_at=timezone.now() + timedelta(days=1))
+        return BlacklistedToken.objects.create(id=row_id, token=token)
+
+    def test_sync_loads_rows_committed_out_of_order(self):
+        self.blacklist_row("later", row_id=100)
+        self.blacklist.sync()
+
+        # An earlier transaction (lower id) committing after the sync
+        self.blacklist_row("earlier", row_id=50)
+        self.blacklist.sync()
+
+        self.assertTrue(self.blacklist.contains("earlier"))
+
+    def test_filter_rebuilt_periodically(self):
+        blacklist = RefreshTokenBlacklist(sync_interval=None, sync_delay=0, rebuild_interval=60)
+        blacklist.sync()
+        row = self.blacklist_row("old")
+        BlacklistedToken.objects.filter(pk=row.pk).update(blacklisted_at=timezone.now() - timedelta(hours=1))
+
+        blacklist.sync()
+        self.assertFalse(blacklist.contains("old"))  # older than the sync window
+
+        with patch("user.helpers.blacklist.time.monotonic", return_value=time.monotonic() + 60):
+            blacklist.sync()
+        self.assertTrue(blacklist.contains("old"))
+
+    def test_prune_expired_tokens(self):
+        now = timezone.now()
+        self.blacklist.add("expired", "token", self.user.id, now - timedelta(seconds=1))
+        self.blacklist.add("valid", "token", self.user.id, now + timedelta(days=1))
+        OutstandingToken.objects.create(jti="expired-2", token="token", expires_at=now - timedelta(days=1))
+
+        self.assertEqual(prune_expired_tokens(batch_size=1), 1)
+        call_command("prune_token_blacklist", "--batch-size", "10", stdout=StringIO())
+
+        self.assertEqual(prune_expired_tokens(), 0)
+        self.assertEqual(list(BlacklistedToken.objects.values_list('token__jti', flat=True)), ["valid"])
+        self.assertFalse(OutstandingToken.objects.filter(jti__startswith="expired").exists())
+
+
+class TestRefreshGracePeriod(SetUpAuthUser):
+
+    def refresh(self, refresh_token):
+        return self.client.post(reverse("auth_refresh"), {'refresh': refresh_token}, format='json')
+
+    def test_same_tokens_within_grace_period(self):
+        first = self.refresh(self.refresh_token)
+        second = self.refresh(self.refresh_token)
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+        self.assertEqual(self.refresh(first.data['refresh']).status_code, status.HTTP_200_OK)
+
+    def test_rejected_after_grace_period(self):
+        self.refresh(self.refresh_token)
+        caches[settings.REFRESH_GRACE_CACHE].clear()
+
+        self.assertEqual(self.refresh(self.refresh_token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_invalid_token_not_remembered(self):
+        for _ in range(2):
+            self.assertEqual(self.refresh("123").status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_waits_for_refresh_in_other_process(self):
+        shared = caches[settings.REFRESH_GRACE_CACHE]
+        key = 'user:refresh:' + hashlib.sha256(self.refresh_token.encode()).hexdigest()
+        tokens = {'refresh': 'new', 'access': 'new'}
+        # Another worker is rotating the same token
+        shared.add(key + ':lock', 'other')
+        threading.Timer(0.2, shared.set, (key, tokens)).start()
+
+        rotate = Mock()
+        self.assertEqual(refresh_once(self.refresh_token, rotate), tokens)
+        rotate.assert_not_called()
+
+    @override_settings(REFRESH_GRACE_CACHE='default')
+    def test_process_local_cache_refused(self):
+        self.assertEqual([error.id for error in check_refresh_grace_cache(None)], ['user.E001'])
+
+
+class TestRefreshCoalescer(SimpleTestCase):
+
+    def run_concurrently(self, func, callers=5):
+        coalescer = RefreshCoalescer()
+        with ThreadPoolExecutor(max_workers=callers) as executor:
+            futures = [executor.submit(coalescer.run, "token", func) for _ in range(callers)]
+            time.sleep(0.1)  # let them all join the first call
+            self.release.set()
+        return coalescer, futures
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def test_one_refresh_for_concurrent_requests(self):
+        def refresh():
+            self.calls += 1
+            self.release.wait()
+            return {'refresh': 'new', 'access': 'new'}
+
+        coalescer, futures = self.run_concurrently(refresh)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([future.result() for future in futures], [{'refresh': 'new', 'access': 'new'}] * 5)
+        self.assertEqual(coalescer.run("token", lambda: 'again'), 'again')
+
+    def test_error_shared(self):
+        def refresh():
+            self.calls += 1
+            self.release.wait()
+            raise ValueError("Token is blacklisted")
+
+        _, futures = self.run_concurrently(refresh)
+
+        self.assertEqual(self.calls, 1)
+        for future in futures:
+            with self.assertRaises(ValueError):
+                future.result()
+
+
+class FakeCertsSession:
+    """Answers the certs URL like Google does, counting the downloads."""
+
+    def __init__(self, certs, max_age=3600):
+        self.certs = certs
+        self.max_age = max_age
+        self.fetches = 0
+
+    def get(self, url, timeout=None):
+        self.fetches += 1
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(self.certs).encode()
+        response.headers['Cache-Control'] = f'public, max-age={self.max_age}, must-revalidate'
+        return response
+
+
+class TestGoogleIdToken(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        public_key, private_key = rsa.newkeys(1024)
+        cls.signer = crypt.RSASigner.from_string(private_key.save_pkcs1(), 'key-1')
+        cls.certs = {'key-1': public_key.save_pkcs1().decode()}
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch('user.helpers.google.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.session = FakeCertsSession(self.certs, max_age=3600)
+        self.cache = GoogleCertCache(session=self.session, refresh_margin=300, min_ttl=60)
+
+    def token(self, signer=None, **claims):
+        now = int(time.time())
+        payload = {'iss': 'https://accounts.google.com', 'aud': 'client-id', 'sub': '123',
+                   'email': 'google@example.com', 'iat': now, 'exp': now + 3600}
+        payload.update(claims)
+        return jwt.encode(signer or self.signer, payload)
+
+    def verify(self, token):
+        return verify_google_id_token(token, 'client-id', certs=self.cache)
+
+    def test_verifies_locally_after_first_download(self):
+        for _ in range(3):
+            self.assertEqual(self.verify(self.token())['email'], 'google@example.com')
+        self.assertEqual(self.session.fetches, 1)
+
+    def test_rejects_invalid_tokens(self):
+        tampered = self.token()[:-4] + b'AAAA'
+        for token in (self.token(aud='other'), self.token(iss='evil.com'),
+                      self.token(exp=int(time.time()) - 60), tampered):
+            with self.assertRaises(ValueError):
+                self.verify(token)
+
+    def test_certs_are_kept_for_their_max_age(self):
+        self.verify(self.token())
+
+        self.now += 3000
+        self.verify(self.token())
+        self.assertEqual(self.session.fetches, 1)
+
+        self.now += 700  # past max-age
+        self.verify(self.token())
+        self.assertEqual(self.session.fetches, 2)
+
+    def test_certs_are_refreshed_in_background_before_expiry(self):
+        self.verify(self.token())
+
+        self.now += 3400  # within refresh_margin of max-age
+        with patch('user.helpers.google.threading.Thread') as thread:
+            self.verify(self.token())
+        thread.assert_called_once()
+        self.assertEqual(self.session.fetches, 1)
+
+        thread.call_args.kwargs['target']()
+        self.assertEqual(self.session.fetches, 2)
+
+    def test_rotated_key_is_fetched(self):
+        self.verify(self.token())
+
+        public_key, private_key = rsa.newkeys(1024)
+        signer = crypt.RSASigner.from_string(private_key.save_pkcs1(), 'key-2')
+        self.session.certs = dict(self.certs, **{'key-2': public_key.save_pkcs1().decode()})
+
+        # Right after a download unknown keys don't hit Google again
+        with self.assertRaises(ValueError):
+            self.verify(self.token(signer))
+        self.assertEqual(self.session.fetches, 1)
+
+        self.now += 60
+        self.assertEqual(self.verify(self.token(signer))['sub'], '123')
+        self.assertEqual(self.session.fetches, 2)
+
+
+class FakeUserinfoSession:
+    """Answers Google's userinfo endpoint for one valid access token."""
+
+    def __init__(self, access_token):
+        self.access_token = access_token
+        self.requests = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests += 1
+        response = requests.Response()
+        if headers.get('Authorization') == f'Bearer {self.access_token}':
+            response.status_code = 200
+            response._content = json.dumps({'sub': '123', 'email': 'google@example.com'}).encode()
+        else:
+            response.status_code = 401
+            response._content = b'{"error": "invalid_request"}'
+        return response
+
+
+class TestGoogleUserinfo(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.session = FakeUserinfoSession('access-token')
+        patcher = patch('user.helpers.google.get_google_session', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_signup_flow_asks_google_once(self):
+        idinfo, token = get_google_id_info({'userInfo': {'access_token': 'access-token'}})
+        self.assertEqual(idinfo['email'], 'google@example.com')
+
+        self.assertTrue(check_google_credentials(token))
+        self.assertEqual(self.session.requests, 1)
+
+    def test_rejected_token_is_not_cached(self):
+        for _ in range(2):
+            idinfo, _ = get_google_id_info({'userInfo': {'access_token': 'expired'}})
+            self.assertNotIn('sub', idinfo)
+        self.assertFalse(check_google_credentials('expired'))
+        self.assertEqual(self.session.requests, 3)
@@ -27,6 +27,7 @@ urlpatterns = [
 
     # Users
     path('me/', views.user_data, name="user_data"),
+    path('me/usage/', views.record_usage, name="record_usage"),
 
     # Utilites
     path("contact/", views.contact_me, name="contact"),
@@ -11,10 +11,12 @@ from helpers.email import send_email_to_me
 
 from user.models import CustomUser, OtpCode
 from user.models import CustomUser
-from .serializers import (ContactMeSerializer, OTPSMSVerificationSerializer, GoogleAuthRequestSerializer, UserDataSerializer, ChangePasswordForgotSerializer,
+from .serializers import (ContactMeSerializer, UsageSerializer, OTPSMSVerificationSerializer, GoogleAuthRequestSerializer, UserDataSerializer, ChangePasswordForgotSerializer,
                           EmailExistsSerializer, OTPForgotSerializer, OTPSendSMSSerializer, RegisterEmailSerializer, OTPCodeSignUpSerializer, EmailSerializer)
 from rest_framework import status
 from .helpers.auth import get_google_id_info, get_user_tokens
+from .helpers.balance import InsufficientTokens
+from .helpers.metering import get_usage_meter
 
 
 @api_view(['POST'])
@@ -353,6 +355,44 @@ def user_data(request):
     return Response(serialized_data)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def record_usage(request):
+    """
+    Consume tokens of the authenticated user. The usage is buffered and
+    charged within a second or so (TOKEN_METER_FLUSH_INTERVAL).
+
+    Request Body:
+        amount (int): The number of tokens to consume.
+        reference (str, optional): Unique id of this usage. Sending it again
+            (e.g. retrying a request) doesn't consume the tokens twice.
+
+    Returns:
+        Response:
+            - 202 Accepted:
+                {
+                    "tokens": int
+                }
+                The tokens left after this usage.
+            - 400 Bad Request:
+                - If the amount or reference is invalid according to the serializer.
+                - If the user doesn't have enough tokens.
+    """
+
+    serializer = UsageSerializer(data=request.data)
+
+    raise_400_HTTP_if_serializer_invalid(serializer)
+
+    validated_data = serializer.validated_data
+    try:
+        tokens = get_usage_meter().record(
+            request.user, validated_data.get("amount"), validated_data.get("reference"))
+    except InsufficientTokens:
+        return Response({"msg": "Not enough tokens."}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({"tokens": tokens}, status=status.HTTP_202_ACCEPTED)
+
+
 @api_view(['GET', 'POST'])
 @throttle_classes([SimpleRateThrottle])
 def otp_change_password(request):
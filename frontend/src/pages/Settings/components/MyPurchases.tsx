@@ -23,24 +23,22 @@ type Purchase = {
 export const MyPurchases = () => {
 
   const [userPurchases, setUserPurchases] = useState<Purchase[] | null>(null)
-  const [currentPage, setCurrentPage] = useState(1)
-  const [totalPages, setTotalPages] = useState(1)
+  const [currentUrl, setCurrentUrl] = useState(urlBase + "/paypal/purchases/")
+  const [nextUrl, setNextUrl] = useState<string | null>(null)
+  const [previousUrl, setPreviousUrl] = useState<string | null>(null)
 
   const getData = async () => {
 
-    const response = await axios.get(urlBase + "/paypal/purchases/", {
-      params: {
-        page: currentPage
-      }
-    })
+    const response = await axios.get(currentUrl)
     setUserPurchases(response.data.results.user_purchases)
-    setTotalPages(response.data.results.total_pages)
+    setNextUrl(response.data.next)
+    setPreviousUrl(response.data.previous)
 
   }
 
   useEffect(() => {
     getData()
-  }, [currentPage])
+  }, [currentUrl])
 
   const fillEmptyRows = () => {
     const emptyRows = Math.max(5 - (userPurchases ? userPurchases.length : 0), 0);
@@ -85,8 +83,8 @@ export const MyPurchases = () => {
         </Table>
 
         <div className="flex justify-end gap-4">
-          <Button onClick={() => setCurrentPage(currentPage - 1)} disabled={currentPage === 1}>Previous</Button>
-          <Button onClick={() => setCurrentPage(currentPage + 1)} disabled={currentPage === totalPages}>Next</Button>
+          <Button onClick={() => previousUrl && setCurrentUrl(previousUrl)} disabled={!previousUrl}>Previous</Button>
+          <Button onClick={() => nextUrl && setCurrentUrl(nextUrl)} disabled={!nextUrl}>Next</Button>
         </div>
       </div>
 